@@ -0,0 +1,232 @@
+"""
+Pixelate images from asyncio code without blocking the event loop.
+The work runs on a managed executor, with a semaphore bounding how many images
+are handed to it at once.
+"""
+
+import asyncio
+import contextlib
+import weakref
+from collections.abc import AsyncIterable, AsyncIterator, Iterable
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import cv2
+from PIL import Image
+
+from proper_pixel_art import batch
+from proper_pixel_art.batch import BatchResult, ImageSource
+from proper_pixel_art.variants import Variant
+
+# One default pixelator per event loop, as its semaphore belongs to the loop
+_default_pixelators: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, "AsyncPixelator"
+] = weakref.WeakKeyDictionary()
+
+
+class AsyncPixelator:
+    """
+    Runs pixelate for asyncio code on an executor it manages.
+    - workers:
+        Number of workers of the executor, defaults to batch.default_workers,
+        so OpenCV's own threads never stack on top of the workers: a worker
+        per CPU for processes, fewer threads while OpenCV runs multithreaded.
+    - concurrency:
+        Maximum number of images on the executor at once, defaults to workers.
+        Callers beyond it wait on the event loop, without holding any worker.
+    - executor:
+        'thread' (the default) or 'process', as for batch.pixelate_many, or an
+        executor from batch.create_executor, which is then not shut down by aclose.
+        Canny, HoughLinesP, PIL resizing and the numpy reductions release the GIL,
+        so threads run the heavy stages in parallel and skip copying the pixels
+        to another process. Worker processes run OpenCV single threaded.
+    - opencv_threads:
+        If set, cv2.setNumThreads(opencv_threads) is called in this process
+        before the workers are counted, e.g. 1 for a worker thread per CPU.
+        The setting applies to every OpenCV call of the process and is
+        not restored, so it is left alone unless asked for.
+    """
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        concurrency: int | None = None,
+        executor: str | Executor = "thread",
+        opencv_threads: int | None = None,
+    ):
+        if opencv_threads is not None:
+            cv2.setNumThreads(opencv_threads)
+        self._owns_pool = not isinstance(executor, Executor)
+        self._pool = (
+            batch.create_executor(workers, executor) if self._owns_pool else executor
+        )
+        self._use_processes = isinstance(self._pool, ProcessPoolExecutor)
+        self.workers = workers or batch.default_workers(
+            "process" if self._use_processes else "thread"
+        )
+        self.concurrency = concurrency or self.workers
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def __aenter__(self) -> "AsyncPixelator":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """Cancel the queued images and shut down the executor if it is managed here."""
+        if self._owns_pool:
+            await asyncio.to_thread(self._pool.shutdown, wait=True, cancel_futures=True)
+
+    def _finished(self, shm: shared_memory.SharedMemory | None) -> None:
+        batch._release(shm)
+        self._slots.release()
+
+    async def _run(
+        self,
+        source: ImageSource,
+        params: dict,
+        profile: bool,
+        timeout: float | None,
+    ) -> tuple:
+        """
+        The output of batch._run_task for source, once a slot is free.
+        The timeout covers waiting for the slot and pixelating. On timeout or
+        cancellation an image still queued on the executor is dropped, while
+        one already running keeps its slot until it finishes.
+        """
+        loop = asyncio.get_running_loop()
+        async with asyncio.timeout(timeout):
+            await self._slots.acquire()
+            try:
+                future, shm = batch._submit(
+                    self._pool, source, self._use_processes, params, profile
+                )
+            except BaseException:
+                self._slots.release()
+                raise
+
+            def done(_: Future) -> None:
+                try:
+                    loop.call_soon_threadsafe(self._finished, shm)
+                except RuntimeError:
+                    # The loop is closed, so no one waits on the slot any more
+                    batch._release(shm)
+
+            future.add_done_callback(done)
+            return await asyncio.wrap_future(future)
+
+    async def pixelate(
+        self, image: ImageSource, timeout: float | None = None, **params
+    ) -> Image.Image:
+        """
+        pixelate image, a PIL image or a path, with the keyword arguments of pixelate.
+        Raises TimeoutError if it takes longer than timeout seconds, and any error
+        raised by pixelate.
+        """
+        output = await self._run(image, params, False, timeout)
+        return batch._batch_result(0, image, output, params).image
+
+    async def pixelate_many(
+        self,
+        images: Iterable[ImageSource] | AsyncIterable[ImageSource],
+        timeout: float | None = None,
+        profile: bool = False,
+        variants: tuple[Variant, ...] | None = None,
+        **params,
+    ) -> AsyncIterator[BatchResult]:
+        """
+        Pixelate many images, yielding a batch.BatchResult per item in completion
+        order, as batch.pixelate_many does. images may be an async iterable.
+        timeout applies to each item, which then yields a TimeoutError in
+        BatchResult.error. At most two items per slot are taken from images
+        at once, and closing the iterator cancels the items not yet done.
+        """
+        if variants:
+            params = {**params, "variants": variants}
+        items = _aenumerate(images)
+        pending: dict[asyncio.Task, tuple[int, ImageSource]] = {}
+        try:
+            exhausted = False
+            while pending or not exhausted:
+                while not exhausted and len(pending) < 2 * self.concurrency:
+                    try:
+                        index, source = await anext(items)
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    task = asyncio.create_task(
+                        self._run(source, params, profile, timeout)
+                    )
+                    pending[task] = (index, source)
+
+                if not pending:
+                    continue
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    index, source = pending.pop(task)
+                    try:
+                        output = task.result()
+                    except Exception as error:
+                        yield BatchResult(index, source, error=error)
+                        continue
+                    yield batch._batch_result(index, source, output, params)
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def _aenumerate(
+    images: Iterable[ImageSource] | AsyncIterable[ImageSource],
+) -> AsyncIterator[tuple[int, ImageSource]]:
+    index = 0
+    if isinstance(images, AsyncIterable):
+        async for image in images:
+            yield index, image
+            index += 1
+    else:
+        for image in images:
+            yield index, image
+            index += 1
+
+
+def default_pixelator() -> AsyncPixelator:
+    """The thread AsyncPixelator of the running event loop, with a worker per CPU."""
+    loop = asyncio.get_running_loop()
+    if loop not in _default_pixelators:
+        _default_pixelators[loop] = AsyncPixelator()
+    return _default_pixelators[loop]
+
+
+async def apixelate(
+    image: ImageSource,
+    timeout: float | None = None,
+    pixelator: AsyncPixelator | None = None,
+    **params,
+) -> Image.Image:
+    """
+    pixelate image without blocking the event loop, on pixelator or the
+    default_pixelator. See AsyncPixelator.pixelate.
+    """
+    pixelator = pixelator or default_pixelator()
+    return await pixelator.pixelate(image, timeout=timeout, **params)
+
+
+async def apixelate_many(
+    images: Iterable[ImageSource] | AsyncIterable[ImageSource],
+    timeout: float | None = None,
+    pixelator: AsyncPixelator | None = None,
+    **params,
+) -> AsyncIterator[BatchResult]:
+    """
+    Pixelate many images without blocking the event loop, on pixelator or the
+    default_pixelator. See AsyncPixelator.pixelate_many.
+    """
+    pixelator = pixelator or default_pixelator()
+    results = pixelator.pixelate_many(images, timeout=timeout, **params)
+    async with contextlib.aclosing(results):
+        async for result in results:
+            yield result
@@ -0,0 +1,270 @@
+"""Pixelate animations and frame sequences with a mesh and a palette shared across frames"""
+
+import os
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from PIL import Image, ImageSequence
+from PIL.PngImagePlugin import Disposal
+
+from proper_pixel_art import mesh, pixelate, profiling
+from proper_pixel_art.cache import StageCache
+from proper_pixel_art.palette import Palette
+from proper_pixel_art.session import PixelationSession
+from proper_pixel_art.utils import Mesh
+
+# Later frames keeping at least this share of the mesh fit of their keyframe reuse its mesh
+MIN_FIT_RATIO = 0.8
+DEFAULT_DURATION = 100  # ms per frame when the source does not say
+# The disposal method clearing a frame to transparent before the next, by file suffix
+DISPOSE_TO_BACKGROUND = {
+    ".gif": 2,
+    ".png": Disposal.OP_BACKGROUND,
+    ".apng": Disposal.OP_BACKGROUND,
+}
+
+
+@dataclass
+class Animation:
+    """
+    Frames with their timing.
+    - frames: RGBA frames, all composited, in order
+    - durations: Display time of each frame in milliseconds
+    - loop: Number of times to play, 0 for forever
+    - keyframes: Indices of the frames the mesh was detected on, set by pixelate_animation
+    """
+
+    frames: list[Image.Image]
+    durations: list[int] = field(default_factory=list)
+    loop: int = 0
+    keyframes: list[int] = field(default_factory=list)
+
+    def __post_init__(self):
+        if not self.durations:
+            self.durations = [DEFAULT_DURATION] * len(self.frames)
+
+
+@dataclass
+class _Keyframe:
+    index: int
+    size: tuple[int, int]
+    mesh_lines: Mesh
+    mesh_scale: int
+    fit: float
+
+
+def is_animated(path: Path | str) -> bool:
+    """True if the image at path has more than one frame."""
+    with Image.open(path) as image:
+        return getattr(image, "n_frames", 1) > 1
+
+
+def load_animation(source: Path | str | Sequence[Path | str]) -> Animation:
+    """
+    The frames of an animated GIF, APNG or WebP, or of a sequence of image files
+    in the given order, e.g. numbered PNGs.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with Image.open(source) as image:
+            frames, durations = [], []
+            for frame in ImageSequence.Iterator(image):
+                frames.append(frame.convert("RGBA"))
+                durations.append(int(frame.info.get("duration", DEFAULT_DURATION)))
+            return Animation(frames, durations, image.info.get("loop", 0))
+    frames = []
+    for path in source:
+        with Image.open(path) as image:
+            frames.append(image.convert("RGBA"))
+    return Animation(frames)
+
+
+def save_animation(animation: Animation, path: Path | str) -> None:
+    """
+    Save the frames as an animation in the format of the suffix of path,
+    e.g. .gif, .png for APNG, or .webp. Frames of different sizes
+    are placed at the top left of a transparent canvas fitting all of them.
+    """
+    width = max(frame.width for frame in animation.frames)
+    height = max(frame.height for frame in animation.frames)
+    frames = []
+    for frame in animation.frames:
+        canvas = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+        canvas.paste(frame.convert("RGBA"), (0, 0))
+        frames.append(canvas)
+    frames[0].save(
+        path,
+        save_all=True,
+        append_images=frames[1:],
+        duration=animation.durations,
+        loop=animation.loop,
+        # Clear each frame before the next so transparent pixels do not show the last one
+        disposal=DISPOSE_TO_BACKGROUND.get(Path(path).suffix.lower(), 0),
+    )
+
+
+def _detect_keyframe(
+    index: int, frame: Image.Image, params: dict, cache: StageCache | None
+) -> _Keyframe:
+    """Detect the mesh of a preprocessed frame and how well the frame fits it."""
+    session = PixelationSession(frame, cache=cache, **params)
+    mesh_lines, mesh_scale = session.mesh, session.upscale_factor
+    fit = mesh.mesh_fit(frame, mesh_lines, mesh_scale)
+    profiling.note(keyframe=index)
+    return _Keyframe(index, frame.size, mesh_lines, mesh_scale, fit)
+
+
+@profiling.traced
+def assign_meshes(
+    frames: Sequence[Image.Image],
+    params: dict,
+    min_fit_ratio: float = MIN_FIT_RATIO,
+    cache: StageCache | None = None,
+) -> list[_Keyframe]:
+    """
+    The keyframe whose mesh each preprocessed frame is downsampled with.
+    The first frame is a keyframe. Each later frame is checked against the
+    current keyframe with mesh.mesh_fit, which only projects the frame's gradients,
+    and becomes a new keyframe with its own mesh detection when its size differs
+    or its fit drops below min_fit_ratio of the keyframe's.
+    """
+    mesh_params = {
+        name: params[name]
+        for name in (
+            "initial_upscale_factor",
+            "pixel_width",
+            "mesh_method",
+            "grid",
+            "exact_upscale",
+        )
+        if name in params
+    }
+    keyframes = []
+    keyframe = None
+    for index, frame in enumerate(frames):
+        if keyframe is None or frame.size != keyframe.size:
+            keyframe = _detect_keyframe(index, frame, mesh_params, cache)
+        elif mesh_params.get("grid") is None:
+            fit = mesh.mesh_fit(frame, keyframe.mesh_lines, keyframe.mesh_scale)
+            if fit < min_fit_ratio * keyframe.fit:
+                keyframe = _detect_keyframe(index, frame, mesh_params, cache)
+        keyframes.append(keyframe)
+    profiling.note(num_keyframes=len({keyframe.index for keyframe in keyframes}))
+    return keyframes
+
+
+def _quantize_together(
+    frames: list[Image.Image],
+    num_colors: int | None,
+    palette: Palette | None,
+    quantize_method: str,
+) -> list[Image.Image]:
+    """
+    Quantize the downsampled frames to one palette, by quantizing them stacked
+    into a single image and cutting the result back into frames.
+    A given palette is applied to each frame directly.
+    """
+    if palette is not None:
+        return [palette.apply(frame) for frame in frames]
+    if num_colors is None:
+        return frames
+    width = max(frame.width for frame in frames)
+    stacked = Image.new("RGBA", (width, sum(frame.height for frame in frames)))
+    top = 0
+    for frame in frames:
+        stacked.paste(frame, (0, top))
+        top += frame.height
+    quantized = pixelate.quantize(stacked, num_colors, quantize_method=quantize_method)
+    result, top = [], 0
+    for frame in frames:
+        result.append(quantized.crop((0, top, frame.width, top + frame.height)))
+        top += frame.height
+    return result
+
+
+def _trim_together(frames: list[Image.Image]) -> list[Image.Image]:
+    """Crop every frame to the union of the bounding boxes of their opaque pixels."""
+    boxes = [frame.getchannel("A").getbbox() for frame in frames]
+    boxes = [box for box in boxes if box is not None]
+    if not boxes:
+        return frames
+    union = (
+        min(box[0] for box in boxes),
+        min(box[1] for box in boxes),
+        max(box[2] for box in boxes),
+        max(box[3] for box in boxes),
+    )
+    return [frame.crop(union) for frame in frames]
+
+
+@profiling.traced
+def pixelate_animation(
+    animation: Animation,
+    workers: int | None = None,
+    min_fit_ratio: float = MIN_FIT_RATIO,
+    **params,
+) -> Animation:
+    """
+    Pixelate every frame of an animation with the parameters of pixelate,
+    detecting the mesh only on keyframes (see assign_meshes) and quantizing
+    all frames to one shared palette of num_colors, so colors do not flicker,
+    or mapping them to a given palette.
+    Preprocessing and downsampling run on a pool of workers threads.
+    trim crops every frame to the same box, so the frames stay aligned.
+    Returns the pixelated frames with the timing of the source.
+    """
+    num_colors = params.pop("num_colors", None)
+    palette = params.pop("palette", None)
+    quantize_method = params.pop("quantize_method", "maxcoverage")
+    trim = params.pop("trim", False)
+    scale_result = params.pop("scale_result", None)
+    cell_color = params.pop("cell_color", "mean")
+    transparent_background = params.pop("transparent_background", False)
+    remove_watermark = params.pop("remove_watermark", False)
+    background_mode = params.pop("background_mode", "global")
+    cache = params.pop("cache", None)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        frames = list(
+            pool.map(
+                lambda frame: pixelate.preprocess(
+                    frame, transparent_background, remove_watermark, background_mode
+                ),
+                animation.frames,
+            )
+        )
+        keyframes = assign_meshes(frames, params, min_fit_ratio, cache)
+        small = list(
+            pool.map(
+                lambda frame, keyframe: pixelate.downsample(
+                    frame,
+                    keyframe.mesh_lines,
+                    skip_quantization=True,
+                    mesh_scale=keyframe.mesh_scale,
+                    cell_color=cell_color,
+                ),
+                frames,
+                keyframes,
+            )
+        )
+
+    small = _quantize_together(small, num_colors, palette, quantize_method)
+    if trim:
+        small = _trim_together(small)
+    result = [pixelate.finish(frame, False, scale_result) for frame in small]
+    return Animation(
+        result,
+        list(animation.durations),
+        animation.loop,
+        sorted({keyframe.index for keyframe in keyframes}),
+    )
+
+
+def pixelate_file(
+    source: Path | str | Sequence[Path | str], out_path: Path | str, **params
+) -> Animation:
+    """Load an animation or frame sequence, pixelate it and save it to out_path."""
+    result = pixelate_animation(load_animation(source), **params)
+    save_animation(result, out_path)
+    return result
@@ -0,0 +1,308 @@
+"""Pixelate many images in parallel with the pixelate_many function"""
+
+import contextlib
+import os
+from collections.abc import Iterable, Iterator
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from proper_pixel_art import pixelate, profiling
+from proper_pixel_art.cache import StageCache
+from proper_pixel_art.variants import Variant, pixelate_variants
+
+ImageSource = Image.Image | str | os.PathLike
+EXECUTORS = ("process", "thread")
+
+
+@dataclass
+class BatchResult:
+    """
+    The outcome of pixelating one item of a batch.
+    - index: Position of the item in the input sequence
+    - source: The path, or the image, that was pixelated
+    - image: The pixelated image, None if pixelating failed
+    - error: The exception raised while pixelating, None on success
+    - trace: The stage records of pixelating the item, if profiling was requested
+    - variants: The image of every variant, if variants were requested,
+        in which case image is that of the first one
+    """
+
+    index: int
+    source: ImageSource
+    image: Image.Image | None = None
+    error: BaseException | None = None
+    trace: list[dict] | None = None
+    variants: dict[Variant, Image.Image] | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _init_worker() -> None:
+    """
+    Runs once in every worker process of the pool.
+    Importing this module has already loaded numpy, cv2 and PIL, so later
+    tasks start warm. Each process is one unit of parallelism,
+    so OpenCV's own thread pool would only oversubscribe the cores.
+    """
+    cv2.setNumThreads(1)
+
+
+def default_workers(executor: str = "process") -> int:
+    """
+    Number of workers of an executor when none is given.
+    Worker processes run OpenCV single threaded, so there is one per CPU.
+    Worker threads share OpenCV's own thread pool, so there are only as many
+    as keep them times OpenCV's threads within the CPUs.
+    """
+    cpus = os.cpu_count() or 1
+    if executor == "thread":
+        return max(1, cpus // max(1, cv2.getNumThreads()))
+    return cpus
+
+
+def create_executor(workers: int | None = None, executor: str = "process") -> Executor:
+    """
+    Create an executor with warm workers for pixelate_many.
+    Passing the same executor to several pixelate_many calls
+    keeps the worker processes, and their imports, alive between batches.
+    workers defaults to default_workers(executor).
+    """
+    if executor not in EXECUTORS:
+        raise ValueError(f"executor must be one of {EXECUTORS}")
+    workers = workers or default_workers(executor)
+    if executor == "thread":
+        return ThreadPoolExecutor(max_workers=workers)
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+
+
+def _pixelate(
+    image: Image.Image, params: dict
+) -> Image.Image | dict[Variant, Image.Image]:
+    """pixelate image, or pixelate_variants if params has variants."""
+    if params.get("variants"):
+        return pixelate_variants(image, **params)
+    return pixelate.pixelate(image, **params)
+
+
+def _pixelate_path(
+    path: str | os.PathLike, params: dict
+) -> Image.Image | dict[Variant, Image.Image]:
+    """Open the image in the worker so no pixels cross the process boundary."""
+    with Image.open(path) as image:
+        return _pixelate(image, params)
+
+
+def _load_shared(name: str, shape: tuple[int, ...]) -> Image.Image:
+    """Load an RGBA image whose pixels are in the named shared memory block."""
+    height, width = shape[:2]
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        # frombytes makes the one copy pixelate needs, so no view outlives the block
+        return Image.frombytes("RGBA", (width, height), shm.buf)
+    finally:
+        shm.close()
+
+
+def _run_task(
+    source: Image.Image | Path | tuple[str, tuple],
+    params: dict,
+    profile: bool,
+    in_process: bool,
+) -> tuple[
+    Image.Image | dict[Variant, Image.Image], StageCache | None, list[dict] | None
+]:
+    """
+    Pixelate one item from an image, a path, or the name and shape of a shared
+    memory block. Returns the result with the stage records if profile is set.
+    A worker process has its own copy of any cache, so the copy is returned with
+    only this item's lookups counted, for the parent to add to its own counters.
+    """
+    cache = params.get("cache") if in_process else None
+    if cache is not None:
+        cache.hits.clear()
+        cache.misses.clear()
+    # tracemalloc is shared by all threads, so only worker processes measure memory
+    tracer = (
+        profiling.Tracer(memory=in_process) if profile else contextlib.nullcontext()
+    )
+    with tracer:
+        if isinstance(source, Image.Image):
+            result = _pixelate(source, params)
+        elif isinstance(source, Path):
+            result = _pixelate_path(source, params)
+        else:
+            result = _pixelate(_load_shared(*source), params)
+    trace = tracer.to_dicts() if profile else None
+    return result, cache, trace
+
+
+def _share_image(image: Image.Image) -> tuple[shared_memory.SharedMemory, tuple]:
+    """Copy the RGBA pixels of image into a new shared memory block."""
+    pixels = np.asarray(image.convert("RGBA"))
+    shm = shared_memory.SharedMemory(create=True, size=max(pixels.nbytes, 1))
+    shm.buf[: pixels.nbytes] = pixels.reshape(-1)
+    return shm, pixels.shape
+
+
+def _submit(
+    pool: Executor,
+    source: ImageSource,
+    use_processes: bool,
+    params: dict,
+    profile: bool = False,
+) -> tuple[Future, shared_memory.SharedMemory | None]:
+    """Submit one item to the pool. Returns its future and shared memory to free once done."""
+    if isinstance(source, (str, os.PathLike)):
+        return pool.submit(
+            _run_task, Path(source), params, profile, use_processes
+        ), None
+    if not isinstance(source, Image.Image):
+        raise TypeError(f"Expected a PIL image or a path, got {type(source).__name__}")
+    if not use_processes:
+        return pool.submit(_run_task, source, params, profile, False), None
+    shm, shape = _share_image(source)
+    try:
+        task = pool.submit(_run_task, (shm.name, shape), params, profile, True)
+        return task, shm
+    except BaseException:
+        _release(shm)
+        raise
+
+
+def _release(shm: shared_memory.SharedMemory | None) -> None:
+    if shm is not None:
+        shm.close()
+        shm.unlink()
+
+
+def _batch_result(
+    index: int,
+    source: ImageSource,
+    output: tuple[
+        Image.Image | dict[Variant, Image.Image], StageCache | None, list[dict] | None
+    ],
+    params: dict,
+) -> BatchResult:
+    """
+    The BatchResult of the output of _run_task, adding the lookups of a worker
+    process' copy of the cache to the counters of the cache in params.
+    """
+    result, worker_cache, trace = output
+    if worker_cache is not None:
+        for stage in worker_cache.stats():
+            params["cache"].record(
+                stage,
+                hits=worker_cache.hits[stage],
+                misses=worker_cache.misses[stage],
+            )
+    if isinstance(result, dict):
+        return BatchResult(
+            index,
+            source,
+            image=next(iter(result.values())),
+            trace=trace,
+            variants=result,
+        )
+    return BatchResult(index, source, image=result, trace=trace)
+
+
+def pixelate_many(
+    images: Iterable[ImageSource],
+    workers: int | None = None,
+    executor: str | Executor = "process",
+    profile: bool = False,
+    variants: tuple[Variant, ...] | None = None,
+    **params,
+) -> Iterator[BatchResult]:
+    """
+    Pixelate many images in parallel, yielding results in completion order.
+    inputs:
+    - images:
+        PIL images or paths to images. Paths are opened by the workers.
+    - workers:
+        Number of workers, defaults to default_workers of the executor.
+    - executor:
+        'process' runs the items in a pool of processes. The pixels of in-memory
+        images are handed over through shared memory instead of being pickled.
+        'thread' runs them in a thread pool, which avoids any copying.
+        An executor from create_executor can be passed to reuse its warm workers.
+    - profile:
+        If True, each item is pixelated under a profiling.Tracer and
+        its stage records are returned in BatchResult.trace.
+        Peak memory is only measured with the process executor.
+    - variants:
+        If set, each item is pixelated once for every variant.Variant with
+        pixelate_variants, sharing its mesh, and the images are returned in
+        BatchResult.variants. params must then not set num_colors or scale_result.
+    - params:
+        Keyword arguments passed to pixelate for every image.
+        A StageCache given as cache is shared by all workers,
+        and its hit and miss counters include the lookups made in worker processes.
+
+    Yields a BatchResult per item. An item that fails yields its exception
+    in BatchResult.error, and the rest of the batch carries on.
+    At most two items per worker are in flight, so a long stream of images
+    is never loaded into memory all at once.
+    """
+    owns_pool = not isinstance(executor, Executor)
+    pool = create_executor(workers, executor) if owns_pool else executor
+    use_processes = isinstance(pool, ProcessPoolExecutor)
+    max_in_flight = 2 * (
+        workers or default_workers("process" if use_processes else "thread")
+    )
+    if variants:
+        params = {**params, "variants": variants}
+
+    pending: dict[
+        Future, tuple[int, ImageSource, shared_memory.SharedMemory | None]
+    ] = {}
+    items = enumerate(images)
+    try:
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    index, source = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                try:
+                    future, shm = _submit(pool, source, use_processes, params, profile)
+                except Exception as error:
+                    yield BatchResult(index, source, error=error)
+                    continue
+                pending[future] = (index, source, shm)
+
+            if not pending:
+                continue
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, source, shm = pending.pop(future)
+                _release(shm)
+                error = future.exception()
+                if error is not None:
+                    yield BatchResult(index, source, error=error)
+                    continue
+                yield _batch_result(index, source, future.result(), params)
+    finally:
+        for future in pending:
+            future.cancel()
+        if owns_pool:
+            pool.shutdown(wait=True, cancel_futures=True)
+        for _, _, shm in pending.values():
+            _release(shm)
@@ -0,0 +1,133 @@
+"""On disk cache for the expensive stages of the pixelation pipeline"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zipfile
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+
+def default_cache_dir() -> Path:
+    """The user cache directory, e.g. ~/.cache/proper-pixel-art"""
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "proper-pixel-art"
+
+
+class StageCache:
+    """
+    Content addressed cache of pipeline stage outputs, stored as .npz files.
+
+    Entries are keyed by a hash of the input pixels and the parameters the stage
+    depends on, so the same directory can be shared by the CLI, the batch API and
+    the web UI, and by several processes at once. Writes are atomic.
+    When the directory grows past max_bytes the least recently used entries are removed.
+
+    Hits and misses are counted per stage in the hits and misses counters.
+    """
+
+    def __init__(
+        self, directory: Path | str | None = None, max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        self.directory = (
+            Path(directory) if directory is not None else default_cache_dir()
+        )
+        self.max_bytes = max_bytes
+        self.hits: Counter[str] = Counter()
+        self.misses: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(image: Image.Image, **params) -> str:
+        """Hash of the pixels of image and the given parameters."""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{image.mode} {image.size}".encode())
+        digest.update(image.tobytes())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def _path(self, stage: str, key: str) -> Path:
+        return self.directory / f"{stage}-{key}.npz"
+
+    def get(self, stage: str, key: str) -> dict[str, np.ndarray] | None:
+        """The arrays stored for the stage and key, or None on a miss."""
+        path = self._path(stage, key)
+        try:
+            with np.load(path, allow_pickle=False) as stored:
+                arrays = {name: stored[name] for name in stored.files}
+            # Mark the entry as recently used
+            os.utime(path)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            self.record(stage, misses=1)
+            return None
+        self.record(stage, hits=1)
+        return arrays
+
+    def put(self, stage: str, key: str, arrays: dict[str, np.ndarray]) -> None:
+        """Store arrays for the stage and key, then evict entries over the size cap."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as temp_file:
+                np.savez(temp_file, **arrays)
+            os.replace(temp_path, self._path(stage, key))
+        except BaseException:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".npz"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            # Another process may have removed it already
+            Path(path).unlink(missing_ok=True)
+            total -= size
+
+    def clear(self) -> None:
+        """Remove every entry from the cache directory."""
+        if self.directory.is_dir():
+            for path in self.directory.glob("*.npz"):
+                path.unlink(missing_ok=True)
+
+    def record(self, stage: str, hits: int = 0, misses: int = 0) -> None:
+        """Add to the hit and miss counters of a stage."""
+        with self._lock:
+            self.hits[stage] += hits
+            self.misses[stage] += misses
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Hits and misses of every stage looked up so far."""
+        stages = sorted(set(self.hits) | set(self.misses))
+        return {
+            stage: {"hits": self.hits[stage], "misses": self.misses[stage]}
+            for stage in stages
+        }
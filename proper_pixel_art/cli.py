@@ -1,11 +1,120 @@
 """Command line interface"""
 
 import argparse
+import contextlib
+import contextvars
+import glob
+import hashlib
+import json
+import sys
+import time
 from pathlib import Path
 
 from PIL import Image
+from PIL.PngImagePlugin import PngInfo
 
-from proper_pixel_art import pixelate
+from proper_pixel_art import (
+    animation,
+    batch,
+    client,
+    colors,
+    mesh,
+    profiling,
+    quantizers,
+    spritesheet,
+    variants,
+)
+from proper_pixel_art.cache import DEFAULT_MAX_BYTES, StageCache
+from proper_pixel_art.palette import Palette
+from proper_pixel_art.session import PixelationSession
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp", ".tif", ".tiff"}
+SKIP_MODES = ("mtime", "hash")
+# Inputs of a batch pixelated to fit the palette of --lock-palette
+PALETTE_SAMPLE_SIZE = 16
+# PNG text key storing the digest of the source and parameters an output was made from
+DIGEST_KEY = "proper-pixel-art:source-digest"
+
+
+# Directory the paths of the command line are relative to while parse_args runs,
+# if not the current directory. Per thread, so a server can parse for many clients.
+_working_dir: contextvars.ContextVar[Path | None] = contextvars.ContextVar(
+    "working_dir", default=None
+)
+
+
+class CommandLineError(ValueError):
+    """An invalid command line, raised by parse_args with exit_on_error=False."""
+
+
+class _ArgumentParser(argparse.ArgumentParser):
+    """
+    An ArgumentParser that, with exit_on_error=False, raises CommandLineError
+    for every error and for --help instead of printing and exiting.
+    """
+
+    def _print_message(self, message: str, file=None) -> None:
+        if self.exit_on_error:
+            super()._print_message(message, file)
+
+    def exit(self, status: int = 0, message: str | None = None):
+        if self.exit_on_error:
+            super().exit(status, message)
+        raise CommandLineError(message or "")
+
+    def error(self, message: str):
+        if self.exit_on_error:
+            super().error(message)
+        raise CommandLineError(message)
+
+
+def user_path(path: str | Path) -> Path:
+    """path with ~ expanded, relative to the working directory given to parse_args."""
+    path = Path(path).expanduser()
+    working_dir = _working_dir.get()
+    return path if working_dir is None else working_dir / path
+
+
+def grid_arg(spec: str) -> mesh.KnownGrid:
+    """argparse type of --grid."""
+    if spec.lower().endswith(".json"):
+        spec = str(user_path(spec))
+    try:
+        return mesh.parse_grid(spec)
+    except (OSError, ValueError, KeyError) as error:
+        raise argparse.ArgumentTypeError(str(error)) from error
+
+
+def palette_arg(path: str) -> Palette:
+    """argparse type of --palette."""
+    try:
+        return Palette.load(user_path(path))
+    except (OSError, ValueError) as error:
+        raise argparse.ArgumentTypeError(str(error)) from error
+
+
+def colors_arg(value: str) -> int | str:
+    """argparse type of -c."""
+    if value == quantizers.AUTO_COLORS:
+        return value
+    try:
+        return int(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(
+            f"phải là số nguyên hoặc '{quantizers.AUTO_COLORS}': {value!r}"
+        ) from error
+
+
+def upscale_arg(value: str) -> int | str:
+    """argparse type of --initial-upscale."""
+    if value == mesh.AUTO_UPSCALE:
+        return value
+    try:
+        return int(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(
+            f"phải là số nguyên hoặc '{mesh.AUTO_UPSCALE}': {value!r}"
+        ) from error
 
 
 def add_pixelation_args(
@@ -25,9 +134,35 @@ def add_pixelation_args(
         "-c",
         "--colors",
         dest="num_colors",
-        type=int,
+        type=colors_arg,
+        default=None,
+        help=(
+            "Số lượng màu để nén ảnh (1-256). Bỏ qua để giữ nguyên tất cả các màu. "
+            f"'{quantizers.AUTO_COLORS}' tự chọn số màu (tối đa "
+            f"{quantizers.AUTO_MAX_COLORS}) tại điểm gãy của đường cong sai số."
+        ),
+    )
+    pixel_group.add_argument(
+        "--quantize-method",
+        dest="quantize_method",
+        choices=quantizers.QUANTIZE_METHODS,
+        default="maxcoverage",
+        help=(
+            "Thuật toán nén màu cho -c. 'maxcoverage' và 'fastoctree' dùng PIL; "
+            "'median_cut' và 'kmeans' chỉ gom nhóm các màu không trong suốt "
+            "trong không gian màu Oklab (mặc định: maxcoverage)."
+        ),
+    )
+    pixel_group.add_argument(
+        "--palette",
+        dest="palette",
+        type=palette_arg,
         default=None,
-        help="Số lượng màu để nén ảnh (1-256). Bỏ qua để giữ nguyên tất cả các màu.",
+        metavar="PALETTE.gpl|.hex|.png",
+        help=(
+            "Dùng bảng màu cố định thay cho -c: tệp GIMP .gpl, tệp .hex (mỗi dòng một màu) "
+            "hoặc ảnh chứa các màu. Mỗi màu được thay bằng màu gần nhất trong bảng."
+        ),
     )
     pixel_group.add_argument(
         "-s",
@@ -45,6 +180,17 @@ def add_pixelation_args(
         default=False,
         help="Tạo nền trong suốt cho kết quả đầu ra.",
     )
+    pixel_group.add_argument(
+        "--background-mode",
+        dest="background_mode",
+        choices=colors.BACKGROUND_MODES,
+        default="global",
+        help=(
+            "Các pixel trùng màu nền được xóa khi dùng -t. 'global' xóa mọi pixel trùng màu; "
+            "'connected' chỉ xóa vùng nối liền với viền ảnh, giữ lại màu nền "
+            "bên trong nhân vật (mặc định: global)."
+        ),
+    )
     pixel_group.add_argument(
         "-w",
         "--pixel-width",
@@ -57,12 +203,57 @@ def add_pixelation_args(
         "-u",
         "--initial-upscale",
         dest="initial_upscale",
-        type=int,
+        type=upscale_arg,
         default=2,
+        metavar="{<int>,auto}",
         help=(
             "Hệ số phóng to ảnh ban đầu trong thuật toán phát hiện lưới. "
             "Nếu khoảng cách lưới phát hiện quá lớn, "
-            "việc tăng giá trị này có thể hữu ích."
+            "việc tăng giá trị này có thể hữu ích. 'auto' ước lượng nhanh độ rộng pixel "
+            "và chỉ phóng to khi pixel nhỏ (mặc định: 2)."
+        ),
+    )
+    pixel_group.add_argument(
+        "--mesh-method",
+        dest="mesh_method",
+        choices=mesh.MESH_METHODS,
+        default="hough",
+        help=(
+            "Phương pháp phát hiện lưới pixel. 'hough' dùng Canny và biến đổi Hough "
+            "trên ảnh đã phóng to; 'spectral' ước lượng chu kỳ lưới từ gradient ảnh, "
+            "nhanh hơn và không cần phóng to (mặc định: hough)."
+        ),
+    )
+    pixel_group.add_argument(
+        "--grid",
+        dest="grid",
+        type=grid_arg,
+        default=None,
+        metavar="WxH+X+Y|MESH.json",
+        help=(
+            "Lưới đã biết trước: kích thước ô và độ lệch tính bằng pixel ảnh (ví dụ 16x16+4+0), "
+            "hoặc tệp JSON lưu bằng --save-mesh. Bỏ qua hoàn toàn bước dò lưới."
+        ),
+    )
+    pixel_group.add_argument(
+        "--cell-color",
+        dest="cell_color",
+        choices=colors.CELL_COLORS,
+        default="mean",
+        help=(
+            "Cách chọn màu của mỗi ô từ các pixel của nó. 'mean' giống ảnh gốc nhất "
+            "khi nhìn từ xa; 'median', 'mode' và 'dominant' bỏ qua nhiễu, "
+            "phù hợp với ảnh JPEG (mặc định: mean)."
+        ),
+    )
+    pixel_group.add_argument(
+        "--no-exact-upscale",
+        dest="exact_upscale",
+        action="store_false",
+        default=True,
+        help=(
+            "Không kiểm tra ảnh có phải là bản phóng to nearest neighbor sạch hay không. "
+            "Mặc định, ảnh như vậy được cắt lại trực tiếp mà không cần dò lưới."
         ),
     )
     pixel_group.add_argument(
@@ -82,18 +273,34 @@ def add_pixelation_args(
     return parser
 
 
-def parse_args() -> argparse.Namespace:
-    parser = argparse.ArgumentParser(
-        description="Tạo ảnh pixel-art độ phân giải thực từ ảnh nguồn."
+def parse_args(
+    argv: list[str] | None = None,
+    cwd: Path | None = None,
+    exit_on_error: bool = True,
+) -> argparse.Namespace:
+    """
+    Parse and check the ppa command line argv.
+    With cwd, relative paths are taken from that directory instead of the
+    current one and returned absolute, and files named by options are read from it.
+    With exit_on_error=False, errors raise CommandLineError instead of printing
+    the usage and exiting, so nothing is written to stdout or stderr.
+    """
+    parser = _ArgumentParser(
+        description="Tạo ảnh pixel-art độ phân giải thực từ ảnh nguồn.",
+        exit_on_error=exit_on_error,
     )
     parser.add_argument(
-        "input_path", type=Path, nargs="?", help="Đường dẫn đến tệp nguồn đầu vào."
+        "input_paths",
+        nargs="*",
+        help=(
+            "Tệp nguồn đầu vào. Cũng có thể là thư mục, mẫu glob (ví dụ 'sprites/**/*.png') "
+            "hoặc @danh_sách.txt chứa mỗi dòng một đường dẫn để xử lý hàng loạt."
+        ),
     )
     parser.add_argument(
         "-i",
         "--input",
         dest="input_path_flag",
-        type=Path,
         help="Đường dẫn đến tệp nguồn đầu vào.",
     )
     parser.add_argument(
@@ -102,26 +309,276 @@ def parse_args() -> argparse.Namespace:
         dest="out_path",
         type=Path,
         default=Path("."),
-        help="Đường dẫn nơi ảnh pixelated sẽ được lưu. Có thể là thư mục hoặc đường dẫn tệp.",
+        help=(
+            "Đường dẫn nơi ảnh pixelated sẽ được lưu. Có thể là thư mục hoặc đường dẫn tệp. "
+            "Khi xử lý hàng loạt, đây là thư mục gốc của cây thư mục đầu ra."
+        ),
+    )
+    parser.add_argument(
+        "--variants",
+        dest="variants",
+        default=None,
+        metavar="SCALEx@COLORS,...",
+        help=(
+            "Lưu nhiều phiên bản của mỗi ảnh với các hệ số phóng to và số màu khác nhau, "
+            "ví dụ '1x@16,4x@16,8x@32'. Lưới chỉ được dò một lần cho mọi phiên bản; "
+            "bỏ @COLORS để dùng -c, '@all' giữ nguyên mọi màu. "
+            "Mỗi phiên bản được lưu thành <tên>_pixelated_<hệ số>x_<số màu>c.png."
+        ),
+    )
+
+    batch_group = parser.add_argument_group("Tùy chọn xử lý hàng loạt")
+    batch_group.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=None,
+        help="Số tiến trình xử lý song song (mặc định: số lõi CPU).",
+    )
+    batch_group.add_argument(
+        "--skip-existing",
+        dest="skip_existing",
+        choices=SKIP_MODES,
+        default=None,
+        help=(
+            "Bỏ qua các ảnh có kết quả đã cập nhật. 'mtime': kết quả mới hơn tệp nguồn; "
+            "'hash': kết quả được tạo từ đúng nội dung nguồn và tham số này."
+        ),
+    )
+
+    batch_group.add_argument(
+        "--lock-palette",
+        dest="lock_palette",
+        action="store_true",
+        default=False,
+        help=(
+            "Tạo một bảng -c màu chung cho cả lô từ kết quả của tối đa "
+            f"{PALETTE_SAMPLE_SIZE} ảnh mẫu (chọn theo mã băm đường dẫn), rồi dùng "
+            "nó cho mọi ảnh để các sprite cùng bộ có màu giống nhau."
+        ),
+    )
+    batch_group.add_argument(
+        "--save-palette",
+        dest="save_palette",
+        type=Path,
+        default=None,
+        metavar="PALETTE.gpl|.hex",
+        help="Lưu bảng màu tạo bởi --lock-palette để dùng lại với --palette.",
+    )
+
+    sheet_group = parser.add_argument_group("Tùy chọn sprite sheet")
+    sheet_group.add_argument(
+        "--sprite-sheet",
+        dest="sprite_sheet",
+        action="store_true",
+        default=False,
+        help=(
+            "Tách ảnh thành các sprite theo kênh alpha và xử lý song song từng sprite. "
+            "Lưu sheet ghép lại vào -o, từng sprite vào thư mục <tên>_sprites "
+            "và vị trí của chúng vào tệp <tên>.json bên cạnh (chỉ khi xử lý một tệp)."
+        ),
+    )
+    sheet_group.add_argument(
+        "--share-pixel-width",
+        dest="share_pixel_width",
+        action="store_true",
+        default=False,
+        help=(
+            "Với --sprite-sheet: chỉ dò lưới trên sprite lớn nhất "
+            "và dùng cùng độ rộng pixel đó cho mọi sprite."
+        ),
+    )
+
+    animation_group = parser.add_argument_group("Tùy chọn ảnh động")
+    animation_group.add_argument(
+        "--frames",
+        dest="frames",
+        action="store_true",
+        default=False,
+        help=(
+            "Xem mọi tệp đầu vào là các khung hình của một ảnh động, theo thứ tự tên tệp "
+            "(ví dụ 'frames/*.png'), và lưu kết quả thành một ảnh động vào -o. "
+            "GIF, APNG và WebP động được nhận ra tự động."
+        ),
+    )
+    animation_group.add_argument(
+        "--frame-duration",
+        dest="frame_duration",
+        type=int,
+        default=animation.DEFAULT_DURATION,
+        help="Thời gian hiển thị mỗi khung hình (ms) với --frames (mặc định: %(default)s).",
+    )
+
+    parser.add_argument(
+        client.SERVER_FLAG,
+        dest="server",
+        action="store_true",
+        default=False,
+        help=(
+            "Gửi việc đến máy chủ 'ppa serve' tại địa chỉ trong biến môi trường "
+            f"{client.ADDRESS_VARIABLE} (mặc định: {client.DEFAULT_ADDRESS}) để khỏi "
+            "nạp lại thư viện mỗi lần chạy. Nếu máy chủ không chạy, bận hoặc không "
+            "nhận việc này (chỉ nhận một ảnh tĩnh), ảnh được xử lý ngay tại đây."
+        ),
+    )
+    parser.add_argument(
+        "--save-mesh",
+        dest="save_mesh",
+        type=Path,
+        default=None,
+        metavar="MESH.json",
+        help="Lưu lưới đã dùng vào tệp JSON để dùng lại với --grid (chỉ khi xử lý một tệp).",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        type=Path,
+        default=None,
+        metavar="TRACE.jsonl",
+        help=(
+            "Ghi thời gian, thời gian CPU, kích thước mảng và bộ nhớ đỉnh của từng bước "
+            "vào tệp JSON lines này và in bảng tóm tắt ra stderr."
+        ),
+    )
+
+    cache_group = parser.add_argument_group("Tùy chọn bộ nhớ đệm")
+    cache_group.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        type=Path,
+        default=None,
+        help=(
+            "Thư mục lưu đệm lưới và ảnh thu nhỏ. Chạy lại với số màu, hệ số phóng to "
+            "hoặc trim khác sẽ dùng lại kết quả này thay vì dò lưới lại."
+        ),
+    )
+    cache_group.add_argument(
+        "--cache-size",
+        dest="cache_size",
+        type=int,
+        default=DEFAULT_MAX_BYTES // 2**20,
+        help="Dung lượng tối đa của bộ nhớ đệm tính bằng MB (mặc định: %(default)s).",
     )
 
     # Add common pixelation arguments
     add_pixelation_args(parser)
 
-    args = parser.parse_args()
+    token = _working_dir.set(cwd)
+    try:
+        args = parser.parse_args(argv)
+    except argparse.ArgumentError as error:
+        raise CommandLineError(str(error)) from error
+    finally:
+        _working_dir.reset(token)
 
     # Either take the input as the first argument or use the -i flag
-    if args.input_path is None and args.input_path_flag is None:
+    if args.input_path_flag is not None:
+        args.input_paths.append(args.input_path_flag)
+    if cwd is not None:
+        args.input_paths = [
+            f"@{cwd / Path(item[1:]).expanduser()}"
+            if item.startswith("@")
+            else str(cwd / Path(item).expanduser())
+            for item in args.input_paths
+        ]
+        for name in ("out_path", "save_mesh", "profile", "cache_dir", "save_palette"):
+            if getattr(args, name) is not None:
+                setattr(args, name, cwd / getattr(args, name).expanduser())
+    if not args.input_paths:
         parser.error("Bạn phải cung cấp đường dẫn đầu vào (đối số hoặc qua flag -i).")
-    args.input_path = (
-        args.input_path if args.input_path is not None else args.input_path_flag
-    )
+    if args.frames and (args.sprite_sheet or args.save_mesh is not None):
+        parser.error("--frames không dùng được cùng --sprite-sheet hoặc --save-mesh.")
+    if args.lock_palette and (
+        not isinstance(args.num_colors, int) or args.palette is not None
+    ):
+        parser.error("--lock-palette cần -c là một số và không dùng cùng --palette.")
+    if args.save_palette is not None and not args.lock_palette:
+        parser.error("--save-palette chỉ dùng được cùng --lock-palette.")
+    if args.variants is not None:
+        # A palette replaces the colors, so the variants only differ in scale
+        mapped = args.palette is not None or args.lock_palette
+        try:
+            args.variants = variants.parse_variants(
+                args.variants, None if mapped else args.num_colors
+            )
+        except ValueError as error:
+            parser.error(f"--variants: {error}")
+        if (
+            args.frames
+            or args.sprite_sheet
+            or args.save_mesh is not None
+            or args.scale_result != 1
+        ):
+            parser.error(
+                "--variants không dùng được cùng --frames, --sprite-sheet, "
+                "--save-mesh hoặc -s."
+            )
+        if mapped and any(variant.num_colors is not None for variant in args.variants):
+            parser.error(
+                "Với --palette hoặc --lock-palette, --variants không đặt số màu."
+            )
+    if args.frames:
+        if args.lock_palette:
+            parser.error("Các khung hình của --frames đã dùng chung một bảng màu.")
+        return args
+    if is_batch(args.input_paths) and args.out_path.suffix:
+        parser.error("Khi xử lý hàng loạt, -o phải là một thư mục.")
+    if is_batch(args.input_paths) and args.sprite_sheet:
+        parser.error("--sprite-sheet chỉ dùng được khi xử lý một tệp.")
+    if is_batch(args.input_paths) and args.save_mesh is not None:
+        parser.error("--save-mesh chỉ dùng được khi xử lý một tệp.")
+    if not is_batch(args.input_paths) and args.lock_palette:
+        parser.error("--lock-palette chỉ dùng được khi xử lý hàng loạt.")
 
     return args
 
 
+def pixelation_params(args: argparse.Namespace) -> dict:
+    """Keyword arguments for pixelate from the parsed pixelation arguments."""
+    return {
+        "num_colors": args.num_colors,
+        "scale_result": args.scale_result,
+        "transparent_background": args.transparent,
+        "pixel_width": args.pixel_width,
+        "initial_upscale_factor": args.initial_upscale,
+        "remove_watermark": args.remove_watermark,
+        "trim": args.trim,
+        "mesh_method": args.mesh_method,
+        "grid": args.grid,
+        "cell_color": args.cell_color,
+        "exact_upscale": args.exact_upscale,
+        "background_mode": args.background_mode,
+        "palette": args.palette,
+        "quantize_method": args.quantize_method,
+    }
+
+
+def stage_cache(args: argparse.Namespace) -> StageCache | None:
+    """The stage cache requested with --cache-dir, or None."""
+    if args.cache_dir is None:
+        return None
+    return StageCache(args.cache_dir.expanduser(), max_bytes=args.cache_size * 2**20)
+
+
+def write_profile(args: argparse.Namespace, tracer: profiling.Tracer) -> None:
+    """
+    Write the stage records of tracer to the --profile path, replacing the file,
+    and print their summary. Does nothing without --profile.
+    """
+    if args.profile is None:
+        return
+    args.profile.parent.mkdir(exist_ok=True, parents=True)
+    args.profile.unlink(missing_ok=True)
+    tracer.write_jsonl(args.profile)
+    print(tracer.summary(), file=sys.stderr)
+
+
 def resolve_output_path(
-    out_path: Path, input_path: Path, suffix: str = "_pixelated"
+    out_path: Path,
+    input_path: Path,
+    suffix: str = "_pixelated",
+    extension: str = ".png",
 ) -> Path:
     """
     If outpath is a directory, make it a file path
@@ -129,28 +586,396 @@ def resolve_output_path(
     """
     if out_path.suffix:
         return out_path
-    filename = f"{input_path.stem}{suffix}.png"
+    filename = f"{input_path.stem}{suffix}{extension}"
     return out_path / filename
 
 
-def main() -> None:
-    args = parse_args()
-    input_path = Path(args.input_path).expanduser()
+def _is_glob(pattern: str) -> bool:
+    return any(char in pattern for char in "*?[")
+
+
+def is_batch(inputs: list[str]) -> bool:
+    """
+    Inputs are processed as a batch unless they are a single plain file path.
+    """
+    if len(inputs) != 1:
+        return True
+    (single,) = inputs
+    if single.startswith("@") or _is_glob(single):
+        return True
+    return Path(single).expanduser().is_dir()
+
+
+def expand_inputs(inputs: list[str]) -> list[tuple[Path, Path]]:
+    """
+    Expand the batch inputs into (source path, path relative to the output directory).
+    - Directories are searched recursively for images, and mirrored below the output.
+    - Glob patterns are mirrored below the output from the part before the first wildcard.
+    - @file reads one input per line, blank lines and lines starting with # are skipped.
+    - Plain files go straight into the output directory.
+    """
+    expanded = []
+    for item in inputs:
+        if item.startswith("@"):
+            lines = Path(item[1:]).expanduser().read_text().splitlines()
+            entries = [line.strip() for line in lines]
+            entries = [
+                entry for entry in entries if entry and not entry.startswith("#")
+            ]
+            expanded.extend(expand_inputs(entries))
+        elif _is_glob(item):
+            pattern = str(Path(item).expanduser())
+            parts = Path(pattern).parts
+            plain_parts = []
+            for part in parts:
+                if _is_glob(part):
+                    break
+                plain_parts.append(part)
+            root = Path(*plain_parts) if plain_parts else Path(".")
+            for match in sorted(glob.glob(pattern, recursive=True)):
+                path = Path(match)
+                if path.is_file() and path.suffix.lower() in IMAGE_SUFFIXES:
+                    expanded.append((path, path.relative_to(root)))
+        elif Path(item).expanduser().is_dir():
+            root = Path(item).expanduser()
+            for path in sorted(root.rglob("*")):
+                if path.is_file() and path.suffix.lower() in IMAGE_SUFFIXES:
+                    expanded.append((path, path.relative_to(root)))
+        else:
+            path = Path(item).expanduser()
+            expanded.append((path, Path(path.name)))
+    return expanded
+
+
+def source_digest(input_path: Path, params: dict) -> str:
+    """Hash of the source file contents and the pixelation parameters."""
+    digest = hashlib.sha256(input_path.read_bytes())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def is_up_to_date(
+    input_path: Path, out_path: Path, mode: str, digest: str | None = None
+) -> bool:
+    """
+    Whether out_path is already the result for input_path.
+    - mtime: The output is at least as new as the input.
+    - hash: The digest stored in the output PNG matches the given digest.
+    """
+    if not out_path.exists():
+        return False
+    if mode == "mtime":
+        return out_path.stat().st_mtime >= input_path.stat().st_mtime
+    try:
+        with Image.open(out_path) as existing:
+            return existing.info.get(DIGEST_KEY) == digest
+    except OSError:
+        return False
+
+
+def palette_sample(sources: list[tuple[Path, Path]]) -> list[Path]:
+    """
+    Up to PALETTE_SAMPLE_SIZE existing sources of expand_inputs to fit the palette
+    of --lock-palette to, the first ones ordered by a hash of their relative path.
+    Adding files to a batch only changes the sample if one of them sorts first.
+    """
+    files = [(path, relative) for path, relative in sources if path.is_file()]
+    files.sort(key=lambda item: hashlib.sha256(item[1].as_posix().encode()).digest())
+    return [path for path, _ in files[:PALETTE_SAMPLE_SIZE]]
+
+
+def sample_digest(sample: list[Path]) -> str:
+    """
+    Hash of the contents of the palette sample. The palette is fitted to the sample
+    with the other parameters, so this stands for it in the digests of the outputs.
+    """
+    digest = hashlib.sha256()
+    for path in sample:
+        digest.update(hashlib.sha256(path.read_bytes()).digest())
+    return digest.hexdigest()
+
+
+def fit_batch_palette(args: argparse.Namespace, sample: list[Path]) -> Palette:
+    """
+    One palette of args.num_colors colors for a whole batch, fitted to the
+    unquantized results of the sources of palette_sample.
+    """
+    params = pixelation_params(args)
+    params.update(num_colors=None, trim=False, scale_result=None)
+    results = batch.pixelate_many(
+        sample, workers=args.jobs, cache=stage_cache(args), **params
+    )
+    palette = Palette.fit(
+        [result.image for result in results if result.ok],
+        args.num_colors,
+        quantize_method=args.quantize_method,
+    )
+    print(
+        f"Đã tạo bảng {len(palette)} màu chung từ {len(sample)} ảnh mẫu.",
+        file=sys.stderr,
+    )
+    return palette
+
+
+def run_batch(args: argparse.Namespace) -> int:
+    """
+    Pixelate every input in parallel into a mirrored tree below args.out_path.
+    Prints progress and a summary to stderr.
+    Returns the exit status, non-zero if any input failed.
+    """
+    params = pixelation_params(args)
+    if args.variants:
+        params.update(num_colors=None, scale_result=None)
+    out_dir = Path(args.out_path).expanduser()
+    sources = expand_inputs(args.input_paths)
+    digest_params = {**params, "variants": args.variants}
+    sample = palette_sample(sources) if args.lock_palette else []
+    if sample:
+        # The palette is only fitted once there is something to do,
+        # so the outputs are checked against the sample it will be fitted to
+        digest_params["palette"] = sample_digest(sample)
+    jobs: list[tuple[Path, Path, str | None]] = []
+    skipped = 0
+    failed: list[tuple[Path, BaseException]] = []
+    out_paths: dict[Path, Path] = {}
+    for input_path, relative_path in sources:
+        out_path = resolve_output_path(out_dir / relative_path.parent, relative_path)
+        if out_path in out_paths:
+            error = ValueError(
+                f"trùng tệp kết quả {out_path} với {out_paths[out_path]}"
+            )
+            failed.append((input_path, error))
+            print(f"{input_path}: LỖI {error}", file=sys.stderr)
+            continue
+        out_paths[out_path] = input_path
+        if not input_path.is_file():
+            # Let the worker report the missing file like any other failure
+            jobs.append((input_path, out_path, None))
+            continue
+        # Hashing reads the whole source, so only do it up front when it decides
+        # what to skip, otherwise once the item is done, for the PNG tag
+        digest = None
+        if args.skip_existing == "hash":
+            digest = source_digest(input_path, digest_params)
+        if args.skip_existing and all(
+            is_up_to_date(input_path, path, args.skip_existing, digest)
+            for path in output_paths(args, out_path)
+        ):
+            skipped += 1
+            continue
+        jobs.append((input_path, out_path, digest))
+
+    if sample and (jobs or args.save_palette is not None):
+        params["palette"] = fit_batch_palette(args, sample)
+        if args.save_palette is not None:
+            params["palette"].save(args.save_palette)
+
+    total = len(jobs) + len(failed)
+    start = time.perf_counter()
+    cache = stage_cache(args)
+    trace_rows: list[dict] = []
+    results = batch.pixelate_many(
+        [input_path for input_path, _, _ in jobs],
+        workers=args.jobs,
+        cache=cache,
+        profile=args.profile is not None,
+        variants=args.variants,
+        **params,
+    )
+    for done, result in enumerate(results, start=len(failed) + 1):
+        input_path, out_path, digest = jobs[result.index]
+        for row in result.trace or []:
+            trace_rows.append({"source": str(input_path), **row})
+        if result.ok:
+            try:
+                out_path.parent.mkdir(exist_ok=True, parents=True)
+                png_info = PngInfo()
+                png_info.add_text(
+                    DIGEST_KEY, digest or source_digest(input_path, digest_params)
+                )
+                if result.variants is not None:
+                    variants.save_variants(result.variants, out_path, pnginfo=png_info)
+                else:
+                    result.image.save(out_path, pnginfo=png_info)
+            except OSError as error:
+                result.error = error
+        if result.ok:
+            written = ", ".join(map(str, output_paths(args, out_path)))
+            print(f"[{done}/{total}] {input_path} -> {written}", file=sys.stderr)
+        else:
+            failed.append((input_path, result.error))
+            print(f"[{done}/{total}] {input_path}: LỖI {result.error}", file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    succeeded = total - len(failed)
+    throughput = succeeded / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Đã xử lý {succeeded}/{total} ảnh trong {elapsed:.1f}s "
+        f"({throughput:.2f} ảnh/s), bỏ qua {skipped} ảnh đã cập nhật.",
+        file=sys.stderr,
+    )
+    if args.profile is not None:
+        args.profile.parent.mkdir(exist_ok=True, parents=True)
+        with open(args.profile, "w", encoding="utf-8") as profile_file:
+            for row in trace_rows:
+                profile_file.write(json.dumps(row, default=str) + "\n")
+        print(f"Đã ghi hồ sơ hiệu năng vào {args.profile}.", file=sys.stderr)
+    if cache is not None:
+        for stage, counts in cache.stats().items():
+            print(
+                f"Bộ nhớ đệm {stage}: {counts['hits']} lần trúng, "
+                f"{counts['misses']} lần trượt.",
+                file=sys.stderr,
+            )
+    if failed:
+        print(f"{len(failed)} ảnh bị lỗi:", file=sys.stderr)
+        for input_path, error in failed:
+            print(f"  {input_path}: {type(error).__name__}: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def output_paths(args: argparse.Namespace, out_path: Path) -> list[Path]:
+    """The files written for out_path: one per variant with --variants, else out_path."""
+    if not args.variants:
+        return [out_path]
+    return [variants.variant_path(out_path, variant) for variant in args.variants]
+
+
+def run_variants(args: argparse.Namespace, input_path: Path, out_path: Path) -> None:
+    """
+    Pixelate input_path once for every variant of args.variants, sharing the mesh,
+    and save them in parallel next to out_path.
+    """
+    params = pixelation_params(args)
+    params.update(num_colors=None, scale_result=None, cache=stage_cache(args))
+    tracer = profiling.Tracer(source=str(input_path))
+    with Image.open(input_path) as img:
+        with tracer if args.profile is not None else contextlib.nullcontext():
+            results = variants.pixelate_variants(img, args.variants, **params)
+            paths = variants.save_variants(results, out_path, workers=args.jobs)
+    write_profile(args, tracer)
+    for path in paths.values():
+        print(f"{input_path} -> {path}", file=sys.stderr)
+
+
+def run_sprite_sheet(
+    args: argparse.Namespace, input_path: Path, out_path: Path
+) -> None:
+    """
+    Pixelate the sprites of the sheet at input_path in parallel. Saves the reassembled
+    sheet to out_path, the sprites to a <stem>_sprites directory next to it
+    and their offsets in the sheet to <stem>.json.
+    """
+    params = pixelation_params(args)
+    params["cache"] = stage_cache(args)
+    tracer = profiling.Tracer(source=str(input_path))
+    with Image.open(input_path) as img:
+        with tracer if args.profile is not None else contextlib.nullcontext():
+            result = spritesheet.pixelate_sheet(
+                img,
+                workers=args.jobs,
+                share_pixel_width=args.share_pixel_width,
+                **params,
+            )
+    write_profile(args, tracer)
+
+    sprites_dir = out_path.parent / f"{out_path.stem}_sprites"
+    sprites_dir.mkdir(exist_ok=True)
+    for sprite in result.sprites:
+        if sprite.ok:
+            sprite.image.save(sprites_dir / f"{sprite.index:03d}.png")
+        else:
+            print(
+                f"Sprite {sprite.index} {sprite.box}: LỖI {sprite.error}",
+                file=sys.stderr,
+            )
+    result.write_manifest(out_path.with_suffix(".json"))
+    result.image.save(out_path)
+    print(
+        f"Đã xử lý {sum(sprite.ok for sprite in result.sprites)}/{len(result.sprites)} "
+        f"sprite vào {out_path}.",
+        file=sys.stderr,
+    )
+
+
+def run_animation(
+    args: argparse.Namespace, source: Path | list[Path], out_path: Path
+) -> None:
+    """
+    Pixelate an animated image, or the sequence of frame files in source,
+    with one mesh and one palette, and save the result as an animation to out_path.
+    """
+    params = pixelation_params(args)
+    params["cache"] = stage_cache(args)
+    frames = animation.load_animation(source)
+    if isinstance(source, list):
+        frames.durations = [args.frame_duration] * len(frames.frames)
+    tracer = profiling.Tracer(source=str(source))
+    with tracer if args.profile is not None else contextlib.nullcontext():
+        result = animation.pixelate_animation(frames, workers=args.jobs, **params)
+    write_profile(args, tracer)
+
+    animation.save_animation(result, out_path)
+    print(
+        f"Đã xử lý {len(result.frames)} khung hình vào {out_path}, "
+        f"dò lưới trên {len(result.keyframes)} khung hình.",
+        file=sys.stderr,
+    )
+
+
+def main(argv: list[str] | None = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["serve"] or client.SERVER_FLAG in argv:
+        client.main(argv)
+        return
+    args = parse_args(argv)
+    if args.frames:
+        sources = [path for path, _ in expand_inputs(args.input_paths)]
+        if not sources:
+            sys.exit("Không tìm thấy khung hình nào.")
+        out_path = resolve_output_path(
+            Path(args.out_path), sources[0], extension=".gif"
+        )
+        out_path.parent.mkdir(exist_ok=True, parents=True)
+        run_animation(args, sources, out_path)
+        return
+    if is_batch(args.input_paths):
+        sys.exit(run_batch(args))
+
+    input_path = Path(args.input_paths[0]).expanduser()
+
+    if not args.sprite_sheet and animation.is_animated(input_path):
+        if args.save_mesh is not None:
+            sys.exit("--save-mesh không dùng được với ảnh động.")
+        if args.variants:
+            sys.exit("--variants không dùng được với ảnh động.")
+        out_path = resolve_output_path(
+            Path(args.out_path), input_path, extension=input_path.suffix.lower()
+        )
+        out_path.parent.mkdir(exist_ok=True, parents=True)
+        run_animation(args, input_path, out_path)
+        return
 
     out_path = resolve_output_path(Path(args.out_path), input_path)
     out_path.parent.mkdir(exist_ok=True, parents=True)
+    if args.sprite_sheet:
+        run_sprite_sheet(args, input_path, out_path)
+        return
+    if args.variants:
+        run_variants(args, input_path, out_path)
+        return
 
     img = Image.open(input_path)
-    pixelated = pixelate.pixelate(
-        img,
-        num_colors=args.num_colors,
-        scale_result=args.scale_result,
-        transparent_background=args.transparent,
-        pixel_width=args.pixel_width,
-        initial_upscale_factor=args.initial_upscale,
-        remove_watermark=args.remove_watermark,
-        trim=args.trim,
-    )
+    tracer = profiling.Tracer(source=str(input_path))
+    session = PixelationSession(img, cache=stage_cache(args), **pixelation_params(args))
+    with tracer if args.profile is not None else contextlib.nullcontext():
+        pixelated = session.result
+        if args.save_mesh is not None:
+            mesh.save_mesh(args.save_mesh, session.mesh, session.upscale_factor)
+    write_profile(args, tracer)
+    if args.num_colors == quantizers.AUTO_COLORS and args.palette is None:
+        print(f"Đã tự chọn {session.num_colors} màu.", file=sys.stderr)
 
     pixelated.save(out_path)
 
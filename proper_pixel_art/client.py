@@ -0,0 +1,189 @@
+"""
+Thin client of the ppa serve pixelation server, and the ppa entry point.
+Only the standard library is imported here, so forwarding a job to a running server
+skips the numpy, cv2 and PIL import time that dominates for small sprites.
+"""
+
+import http.client
+import json
+import os
+import socket
+import sys
+
+
+def _default_address() -> str:
+    """
+    A Unix socket in the runtime directory of the user, or in ~/.cache/ppa,
+    so only the user can reach the server. A TCP port where there are no Unix sockets.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return "127.0.0.1:8765"
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache", "ppa"
+    )
+    return f"unix:{os.path.join(runtime_dir, 'ppa.sock')}"
+
+
+# host:port, or unix:PATH for a Unix socket
+DEFAULT_ADDRESS = _default_address()
+# Environment variable with the address of the server, for ppa serve and ppa --server
+ADDRESS_VARIABLE = "PPA_SERVER"
+SERVER_FLAG = "--server"
+# Seconds to wait for a response, the server enforces its own shorter job timeout
+CLIENT_TIMEOUT = 600.0
+# Responses the client cannot act on, so the job runs in-process instead:
+# /run refused over TCP, not a single image, and busy
+FALLBACK_STATUSES = (403, 422, 503)
+
+
+def server_address() -> str:
+    """The address of the server from PPA_SERVER, or DEFAULT_ADDRESS."""
+    return os.environ.get(ADDRESS_VARIABLE) or DEFAULT_ADDRESS
+
+
+def parse_address(address: str) -> tuple[str, int] | str:
+    """
+    (host, port) for 'host:port' or 'http://host:port', or the socket path
+    for 'unix:PATH' or any address containing a '/'.
+    """
+    if address.startswith("unix:"):
+        return address.removeprefix("unix:")
+    address = address.removeprefix("http://").rstrip("/")
+    if "/" in address:
+        return address
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(
+            f"Invalid server address {address!r}, expected host:port or unix:PATH"
+        )
+    return host.strip("[]"), int(port)
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    """An HTTP connection over a Unix socket."""
+
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self._path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+def request(
+    method: str,
+    path: str,
+    body: bytes | None = None,
+    headers: dict[str, str] | None = None,
+    address: str | None = None,
+    timeout: float = CLIENT_TIMEOUT,
+) -> tuple[int, bytes]:
+    """
+    Send one request to the server. Returns the status and body of the response.
+    Raises OSError if no server listens at the address.
+    """
+    target = parse_address(address or server_address())
+    if isinstance(target, str):
+        connection = _UnixConnection(target, timeout)
+    else:
+        connection = http.client.HTTPConnection(*target, timeout=timeout)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def health(address: str | None = None, timeout: float = 1.0) -> dict | None:
+    """The health report of the server, or None if it is not running."""
+    try:
+        status, body = request("GET", "/health", address=address, timeout=timeout)
+    except OSError:
+        return None
+    return json.loads(body) if status == 200 else None
+
+
+def stats(address: str | None = None) -> dict:
+    """The request counters and limits of the server."""
+    status, body = request("GET", "/stats", address=address)
+    return json.loads(body)
+
+
+def pixelate_bytes(data: bytes, params: dict, address: str | None = None) -> bytes:
+    """
+    The PNG bytes of the image file data pixelated by the server with params,
+    the keyword arguments of pixelate. A grid is given as 'WxH+X+Y' and a palette
+    as a list of [r, g, b]. Raises RuntimeError if the server rejects the job.
+    """
+    status, body = request(
+        "POST",
+        "/pixelate",
+        body=data,
+        headers={"X-PPA-Params": json.dumps(params)},
+        address=address,
+    )
+    if status != 200:
+        raise RuntimeError(f"{status}: {json.loads(body).get('error', '')}")
+    return body
+
+
+def run(argv: list[str], address: str | None = None) -> int | None:
+    """
+    Run the ppa command line argv on the server, relative to the current directory.
+    Returns its exit status, or None if no server is running or it cannot take the
+    job, e.g. because it is busy or the options need more than pixelating one file.
+    """
+    payload = json.dumps({"argv": argv, "cwd": os.getcwd()}).encode()
+    try:
+        status, body = request(
+            "POST",
+            "/run",
+            body=payload,
+            headers={"Content-Type": "application/json"},
+            address=address,
+        )
+    except OSError:
+        return None
+    if status in FALLBACK_STATUSES:
+        return None
+    reply = json.loads(body)
+    for message in reply.get("messages", []):
+        print(message, file=sys.stderr)
+    if status != 200:
+        print(f"Máy chủ báo lỗi: {reply.get('error', status)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    Entry point for the ppa command.
+    'ppa serve ...' starts the server. With --server the job is forwarded to the
+    server at PPA_SERVER, falling back to running in this process, which only then
+    imports the pixelation modules.
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] == ["serve"]:
+        from proper_pixel_art import server
+
+        server.main(argv[1:])
+        return
+    if SERVER_FLAG in argv:
+        argv = [arg for arg in argv if arg != SERVER_FLAG]
+        status = run(argv)
+        if status is not None:
+            sys.exit(status)
+        print(
+            f"Không dùng được máy chủ tại {server_address()}, xử lý trong tiến trình này.",
+            file=sys.stderr,
+        )
+    from proper_pixel_art import cli
+
+    cli.main(argv)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,14 @@
 """Handles image colors logic"""
 
-from collections import Counter
 from pathlib import Path
 
+import cv2
 import numpy as np
 from PIL import Image, ImageColor
 from PIL.Image import Quantize
 
+from proper_pixel_art import profiling
+
 RGB = tuple[int, int, int]
 RGBA = tuple[int, int, int, int]
 
@@ -14,6 +16,19 @@ RGBA = tuple[int, int, int, int]
 # Pixels with alpha >= this value are considered opaque
 ALPHA_THRESHOLD = 128
 
+# Statistics for the color of a cell, see cell_colors
+CELL_COLORS = ("mean", "median", "mode", "dominant")
+# Bin size of the offset binning in _dominant_rgb_by_binning and cell_colors
+DOMINANT_BIN_SIZE = 52
+# Longest side of the thumbnail _top_opaque_colors counts colors in
+TOP_COLORS_SAMPLE_SIZE = 160
+# Weights of PIL's RGB to L conversion, in 16 bit fixed point
+GREY_WEIGHTS = (19595, 38470, 7471)
+# How make_background_transparent picks the pixels to key out
+BACKGROUND_MODES = ("global", "connected")
+# Pixels per band of rows of the array versions of the preprocessing stages
+PIXELS_PER_CHUNK = 2**16
+
 
 def _is_majority_transparent(opaque_count: int, total_count: int) -> bool:
     return opaque_count <= total_count / 2
@@ -25,17 +40,63 @@ def _rgb_dist(a: RGB, b: RGB) -> int:
     return dr**2 + dg**2 + db**2
 
 
+def _rows_per_chunk(width: int) -> int:
+    return max(1, PIXELS_PER_CHUNK // max(width, 1))
+
+
 def _top_opaque_colors(
     img: Image.Image, alpha_threshold: int, limit: int = 8
 ) -> list[RGB]:
     """Return the most common opaque colors (RGB) up to limit."""
-    rgba = img.convert("RGBA").copy()
-    rgba.thumbnail((160, 160))  # speed and de-noise tiny details
-    counts = Counter()
-    for r, g, b, a in rgba.getdata():
-        if a >= alpha_threshold:
-            counts[(r, g, b)] += 1
-    return [c for c, _ in counts.most_common(limit)]
+    return _top_opaque_colors_array(
+        np.asarray(img.convert("RGBA")), alpha_threshold, limit
+    )
+
+
+def _top_opaque_colors_array(
+    rgba: np.ndarray, alpha_threshold: int, limit: int = 8
+) -> list[RGB]:
+    """
+    _top_opaque_colors of an (height, width, 4) array.
+    Colors are counted with one histogram over a PIL thumbnail of at most
+    TOP_COLORS_SAMPLE_SIZE pixels a side, which evens out tiny details,
+    ties going to the color seen first.
+    """
+    if max(rgba.shape[:2]) > TOP_COLORS_SAMPLE_SIZE:
+        thumbnail = Image.fromarray(rgba, mode="RGBA")
+        thumbnail.thumbnail((TOP_COLORS_SAMPLE_SIZE, TOP_COLORS_SAMPLE_SIZE))
+        rgba = np.asarray(thumbnail)
+    sample = rgba.reshape(-1, 4)
+    opaque = sample[sample[:, 3] >= alpha_threshold, :3].astype(np.int32)
+    if len(opaque) == 0:
+        return []
+    packed = (opaque[:, 0] << 16) | (opaque[:, 1] << 8) | opaque[:, 2]
+    values, first_seen, counts = np.unique(
+        packed, return_index=True, return_counts=True
+    )
+    order = np.lexsort((first_seen, -counts))[:limit]
+    return [
+        (int(value) >> 16, (int(value) >> 8) & 0xFF, int(value) & 0xFF)
+        for value in values[order]
+    ]
+
+
+def _grey(pixels: np.ndarray) -> np.ndarray:
+    """
+    Greyscale of an (height, width, 4) or (height, width, 3) uint8 array,
+    converted by PIL, which is several times faster than weighting in numpy.
+    """
+    pixels = np.ascontiguousarray(pixels)
+    height, width, channels = pixels.shape
+    mode = "RGBA" if channels == 4 else "RGB"
+    image = Image.frombuffer(mode, (width, height), pixels, "raw", mode, 0, 1)
+    return np.asarray(image.convert("L"))
+
+
+def _grey_value(rgb: RGB) -> int:
+    """Greyscale of one color, exactly as PIL converts RGB to L."""
+    weighted = sum(value * weight for value, weight in zip(rgb, GREY_WEIGHTS))
+    return (weighted + 0x8000) >> 16
 
 
 def _pick_background(colors: list[RGB]) -> RGB:
@@ -69,6 +130,7 @@ def _pick_background(colors: list[RGB]) -> RGB:
     return best
 
 
+@profiling.traced
 def clamp_alpha(
     image: Image.Image,
     alpha_threshold: int = ALPHA_THRESHOLD,
@@ -80,22 +142,48 @@ def clamp_alpha(
     If background_hex is None, choose a color far from the most common image colors.
     mode: 'RGB' or 'L'
     """
+    clamped = clamp_alpha_array(
+        np.asarray(image.convert("RGBA")), alpha_threshold, mode, background_hex
+    )
+    return Image.fromarray(clamped, mode=mode)
+
+
+@profiling.traced
+def clamp_alpha_array(
+    rgba: np.ndarray,
+    alpha_threshold: int = ALPHA_THRESHOLD,
+    mode: str = "RGB",
+    background_hex: str | None = None,
+) -> np.ndarray:
+    """
+    clamp_alpha of an (height, width, 4) uint8 array, which is only read.
+    Returns a new (height, width, 3) array for mode 'RGB', (height, width) for 'L',
+    filled a band of rows at a time.
+    """
     if mode not in ("RGB", "L"):
         raise ValueError("mode must be 'RGB' or 'L'")
 
     if background_hex is None:
-        common = _top_opaque_colors(image, alpha_threshold)
+        common = _top_opaque_colors_array(rgba, alpha_threshold)
         bg_rgb = _pick_background(common)
     else:
-        bg_rgb = ImageColor.getrgb(background_hex)
+        bg_rgb = ImageColor.getrgb(background_hex)[:3]
 
-    base = image.convert(mode)
-    alpha = image.getchannel("A")
-    mask = alpha.point(lambda p: 255 if p >= alpha_threshold else 0)
-
-    background = Image.new("RGB", image.size, bg_rgb).convert(mode)
+    height, width = rgba.shape[:2]
+    if mode == "L":
+        out = np.empty((height, width), dtype=np.uint8)
+        background = _grey_value(bg_rgb)
+    else:
+        out = np.empty((height, width, 3), dtype=np.uint8)
+        background = np.array(bg_rgb, dtype=np.uint8)
 
-    return Image.composite(base, background, mask)
+    rows_per_chunk = _rows_per_chunk(width)
+    for start in range(0, height, rows_per_chunk):
+        block = rgba[start : start + rows_per_chunk]
+        out_block = out[start : start + rows_per_chunk]
+        out_block[:] = _grey(block) if mode == "L" else block[:, :, :3]
+        out_block[block[:, :, 3] < alpha_threshold] = background
+    return out
 
 
 def extract_and_scale_alpha(image: Image.Image, scale_factor: int = 1) -> np.ndarray:
@@ -193,7 +281,9 @@ def _dominant_rgb_by_binning(rgb_pixels: np.ndarray) -> RGB:
         median = np.median(rgb_pixels, axis=0).astype(np.uint8)
         return (int(median[0]), int(median[1]), int(median[2]))
 
-    bin_size = 52
+    bin_size = DOMINANT_BIN_SIZE
+    # Widen so adding the offset below cannot wrap around
+    rgb_pixels = rgb_pixels.astype(np.int16)
 
     # Grid 1: standard binning (boundaries at 0, 52, 104...)
     bins1 = rgb_pixels // bin_size
@@ -220,7 +310,130 @@ def _dominant_rgb_by_binning(rgb_pixels: np.ndarray) -> RGB:
     dominant_pixels = rgb_pixels[mask]
 
     # Return median of dominant bin (robust to outliers within bin)
-    return tuple(np.median(dominant_pixels, axis=0).astype(np.uint8))
+    median = np.median(dominant_pixels, axis=0).astype(np.uint8)
+    return (int(median[0]), int(median[1]), int(median[2]))
+
+
+def _segment_medians(
+    rgb: np.ndarray, labels: np.ndarray, weights: np.ndarray, num_cells: int
+) -> np.ndarray:
+    """
+    Per channel weighted median of the rgb values with each label,
+    from a 256 bin histogram per label and channel instead of sorting.
+    As with np.median, an even count averages the two middle values,
+    rounded down like a cast to uint8. Labels without weight get 0.
+    """
+    totals = np.bincount(labels, weights=weights, minlength=num_cells)
+    # Positions of the two middle values in the sorted values of each label
+    lower = np.floor((totals - 1) / 2)[:, np.newaxis]
+    upper = np.floor(totals / 2)[:, np.newaxis]
+    medians = np.zeros((num_cells, 3), dtype=np.uint8)
+    for channel in range(3):
+        keys = labels * 256 + rgb[:, channel]
+        histogram = np.bincount(keys, weights=weights, minlength=num_cells * 256)
+        cumulative = histogram.reshape(num_cells, 256).cumsum(axis=1)
+        low = np.argmax(cumulative > lower, axis=1)
+        high = np.argmax(cumulative > upper, axis=1)
+        medians[:, channel] = (low + high) // 2
+    medians[totals == 0] = 0
+    return medians
+
+
+def _segment_modes(
+    rgb: np.ndarray, labels: np.ndarray, weights: np.ndarray, num_cells: int
+) -> np.ndarray:
+    """
+    Most frequent exact rgb value with each label, by weight.
+    Ties go to the smallest packed color. Labels without weight get 0.
+    """
+    rgb_wide = rgb.astype(np.int64)
+    packed = (rgb_wide[:, 0] << 16) | (rgb_wide[:, 1] << 8) | rgb_wide[:, 2]
+    keys, inverse = np.unique(
+        labels.astype(np.int64) << 24 | packed, return_inverse=True
+    )
+    modes = np.zeros((num_cells, 3), dtype=np.uint8)
+    if len(keys) == 0:
+        return modes
+    counts = np.bincount(inverse.ravel(), weights=weights, minlength=len(keys))
+    key_labels = keys >> 24
+    # Sort by label, then by descending count, and keep the first key of each label
+    order = np.lexsort((-counts, key_labels))
+    first = order[np.r_[True, np.diff(key_labels[order]) != 0]]
+    first = first[counts[first] > 0]
+    mode_colors = keys[first] & 0xFFFFFF
+    modes[key_labels[first], 0] = mode_colors >> 16
+    modes[key_labels[first], 1] = (mode_colors >> 8) & 0xFF
+    modes[key_labels[first], 2] = mode_colors & 0xFF
+    return modes
+
+
+def _segment_dominant(
+    rgb: np.ndarray, labels: np.ndarray, weights: np.ndarray, num_cells: int
+) -> np.ndarray:
+    """
+    _dominant_rgb_by_binning of the rgb values with each label, for all labels at once.
+    The bins of both grids are counted per label with one bincount each.
+    """
+    rgb_wide = rgb.astype(np.int16)
+    place = np.array([25, 5, 1], dtype=np.int16)
+    bin_size = DOMINANT_BIN_SIZE
+    indices1 = (rgb_wide // bin_size) @ place
+    indices2 = (np.minimum(rgb_wide + bin_size // 2, 255) // bin_size) @ place
+
+    dominant = []
+    for indices in (indices1, indices2):
+        counts = np.bincount(
+            labels * 125 + indices, weights=weights, minlength=num_cells * 125
+        ).reshape(num_cells, 125)
+        bins = np.argmax(counts, axis=1)
+        dominant.append((bins, counts[np.arange(num_cells), bins]))
+    (bins1, max_count1), (bins2, max_count2) = dominant
+
+    use_grid1 = (max_count1 >= max_count2)[labels]
+    in_bin = np.where(use_grid1, indices1 == bins1[labels], indices2 == bins2[labels])
+    # Cells of 3 pixels or fewer take the median of all of them
+    totals = np.bincount(labels, weights=weights, minlength=num_cells)
+    in_bin |= (totals <= 3)[labels]
+    return _segment_medians(rgb, labels, weights * in_bin, num_cells)
+
+
+_SEGMENT_STATISTICS = {
+    "median": _segment_medians,
+    "mode": _segment_modes,
+    "dominant": _segment_dominant,
+}
+
+
+def cell_colors(
+    rgb: np.ndarray,
+    labels: np.ndarray,
+    weights: np.ndarray,
+    num_cells: int,
+    cell_color: str = "median",
+) -> np.ndarray:
+    """
+    Representative color of every cell at once, from pixels labeled with their cell.
+    Every statistic is computed with a few bincounts over all the pixels,
+    rather than a Python call per cell.
+
+    Args:
+        rgb: shape (N, 3), dtype=uint8 - RGB values of the pixels
+        labels: shape (N,) - index of the cell of each pixel, below num_cells
+        weights: shape (N,) - non-negative integer weight of each pixel,
+            e.g. 0 for transparent pixels
+        num_cells: Number of cells
+        cell_color: 'median' per channel, 'mode' for the most frequent exact color,
+            or 'dominant' for the offset binning of _dominant_rgb_by_binning.
+            The 'mean' is computed from segment sums by pixelate.downsample instead.
+
+    Returns:
+        shape (num_cells, 3), dtype=uint8 - color of each cell, 0 for cells without weight
+    """
+    if cell_color not in _SEGMENT_STATISTICS:
+        raise ValueError(f"cell_color must be one of {tuple(_SEGMENT_STATISTICS)}")
+    labels = np.asarray(labels, dtype=np.intp)
+    weights = np.asarray(weights, dtype=np.float64)
+    return _SEGMENT_STATISTICS[cell_color](rgb, labels, weights, num_cells)
 
 
 def get_cell_color_skip_quantization(
@@ -268,6 +481,7 @@ def get_cell_color_skip_quantization(
     return (int(mean_color[0]), int(mean_color[1]), int(mean_color[2]), 255)
 
 
+@profiling.traced
 def palette_img(
     image: Image.Image,
     num_colors: int = 16,
@@ -300,42 +514,114 @@ def most_common_boundary_color(image: Image.Image) -> RGB:
     """
     Return the exact RGB color that occurs most on the image boundary.
     """
-    image_rgb = image.convert("RGB")
-    w, h = image_rgb.size
+    return _most_common_boundary_color_array(np.asarray(image.convert("RGB")))
 
-    # top and bottom rows
-    top = list(image_rgb.crop((0, 0, w, 1)).getdata())
-    bottom = list(image_rgb.crop((0, h - 1, w, h)).getdata())
-    # left and right columns (excluding corners)
-    left = [image_rgb.getpixel((0, y)) for y in range(1, h - 1)]
-    right = [image_rgb.getpixel((w - 1, y)) for y in range(1, h - 1)]
 
-    counts = Counter(top + bottom + left + right)
-    mode_color = counts.most_common(1)[0][0]
-    return mode_color  # (R, G, B)
+def _most_common_boundary_color_array(pixels: np.ndarray) -> RGB:
+    """
+    most_common_boundary_color of an (height, width, channels) array.
+    Ties go to the color seen first going along the top row, the bottom row,
+    then the left and right columns.
+    """
+    boundary = np.concatenate(
+        [pixels[0], pixels[-1], pixels[1:-1, 0], pixels[1:-1, -1]]
+    )[:, :3].astype(np.int32)
+    packed = (boundary[:, 0] << 16) | (boundary[:, 1] << 8) | boundary[:, 2]
+    values, first_seen, counts = np.unique(
+        packed, return_index=True, return_counts=True
+    )
+    most_common = counts == counts.max()
+    mode_color = int(values[most_common][np.argmin(first_seen[most_common])])
+    return (mode_color >> 16, (mode_color >> 8) & 0xFF, mode_color & 0xFF)
 
 
-def make_background_transparent(image: Image.Image, tolerance: int = 40) -> Image.Image:
+@profiling.traced
+def make_background_transparent(
+    image: Image.Image, tolerance: int = 40, background_mode: str = "global"
+) -> Image.Image:
     """
     Make the background fully transparent by:
       1) Identifying the most common color on the image boundary
-      2) Setting alpha=0 for all pixels matching that color (within a noise tolerance)
+      2) Setting alpha=0 for pixels matching that color (within a noise tolerance)
 
-    Note: This sets transparency for ALL pixels matching the boundary color,
-    not just boundary pixels.
+    background_mode:
+      'global' keys out ALL pixels matching the boundary color, not just boundary pixels.
+      'connected' keys out only the matching pixels connected to the boundary
+        through other matching pixels, so sprites reusing the color keep it.
     """
-    background_color = most_common_boundary_color(image)
-    image_rgba = image.convert("RGBA")
-    arr = np.array(image_rgba)
-
-    bg_arr = np.array(background_color)
-    diff = np.linalg.norm(arr[:, :, :3].astype(np.float32) - bg_arr, axis=2)
+    arr = np.array(image if image.mode == "RGBA" else image.convert("RGBA"))
+    make_background_transparent_array(arr, tolerance, background_mode=background_mode)
+    return Image.fromarray(arr, mode="RGBA")
 
-    # Where diff is within tolerance, make alpha 0
-    bg_mask = diff < tolerance
-    arr[bg_mask, 3] = 0
 
-    return Image.fromarray(arr, mode="RGBA")
+@profiling.traced
+def make_background_transparent_array(
+    rgba: np.ndarray,
+    tolerance: int = 40,
+    rows_per_chunk: int | None = None,
+    background_mode: str = "global",
+) -> np.ndarray:
+    """
+    make_background_transparent of a writable (height, width, 4) uint8 array, in place.
+    Squared color distances are looked up per channel from tables of integers
+    a band of rows at a time, so no frame sized temporary is allocated. Returns rgba.
+    The 'connected' mode keeps a one byte per pixel map of the matching pixels,
+    filled from the boundary with OpenCV's scanline flood fill.
+    """
+    if background_mode not in BACKGROUND_MODES:
+        raise ValueError(f"background_mode must be one of {BACKGROUND_MODES}")
+    background_color = _most_common_boundary_color_array(rgba)
+    # Squared difference to the background of every value of each channel,
+    # capped at the threshold so the sums fit in 16 bits for usual tolerances
+    dtype = np.uint16 if 3 * tolerance**2 < 2**16 else np.uint32
+    values = np.arange(256, dtype=np.int32)
+    squares = [
+        np.minimum((values - channel) ** 2, tolerance**2).astype(dtype)
+        for channel in background_color
+    ]
+    height, width = rgba.shape[:2]
+    rows_per_chunk = rows_per_chunk or _rows_per_chunk(width)
+    connected = background_mode == "connected"
+    if connected:
+        matches = np.empty((height, width), dtype=np.uint8)
+    for start in range(0, height, rows_per_chunk):
+        block = rgba[start : start + rows_per_chunk]
+        distance_sq = np.take(squares[0], block[:, :, 0])
+        distance_sq += np.take(squares[1], block[:, :, 1])
+        distance_sq += np.take(squares[2], block[:, :, 2])
+        if connected:
+            matches[start : start + rows_per_chunk] = distance_sq < tolerance**2
+        else:
+            # Where diff is within tolerance, make alpha 0
+            block[:, :, 3][distance_sq < tolerance**2] = 0
+    if not connected:
+        return rgba
+
+    _fill_from_boundary(matches)
+    for start in range(0, height, rows_per_chunk):
+        block = rgba[start : start + rows_per_chunk]
+        block[:, :, 3][matches[start : start + rows_per_chunk] == 2] = 0
+    return rgba
+
+
+def _fill_from_boundary(matches: np.ndarray) -> None:
+    """
+    Set the 1s of a (height, width) uint8 map of 0s and 1s that are 4-connected
+    to the boundary through other 1s to 2, in place.
+    """
+    height, width = matches.shape
+    rows, columns = np.arange(height), np.arange(width)
+    ys = np.concatenate(
+        [np.zeros_like(columns), np.full_like(columns, height - 1), rows, rows]
+    )
+    xs = np.concatenate(
+        [columns, columns, np.zeros_like(rows), np.full_like(rows, width - 1)]
+    )
+    seeds = matches[ys, xs] == 1
+    for y, x in zip(ys[seeds].tolist(), xs[seeds].tolist()):
+        # Each fill turns its whole region to 2, so most seeds are skipped
+        if matches[y, x] == 1:
+            cv2.floodFill(matches, None, (x, y), 2, 0, 0, 4)
 
 
 def main():
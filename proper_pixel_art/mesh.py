@@ -1,15 +1,35 @@
 """Handles mesh detection from pixel art style images"""
 
+import json
+import math
+import re
+from dataclasses import dataclass
 from pathlib import Path
 
 import cv2
 import numpy as np
 from PIL import Image
 
-from proper_pixel_art import colors, utils
+from proper_pixel_art import colors, profiling, utils
 from proper_pixel_art.utils import Lines, Mesh
 
-
+MESH_METHODS = ("hough", "spectral", "pyramid")
+# The pyramid method detects the mesh on a copy decimated to about this size
+PYRAMID_TARGET_SIZE = 1024
+# Below this pixel width, in image pixels, the pyramid method uses the upscaled image instead
+PYRAMID_MIN_PIXEL_WIDTH = 8
+# Upscale factor that chooses the factor from the estimated pixel width
+AUTO_UPSCALE = "auto"
+# With AUTO_UPSCALE, pixels at least this wide, in image pixels, are detected without upscaling
+AUTO_UPSCALE_MIN_PIXEL_WIDTH = 48
+# With AUTO_UPSCALE, images whose color changes repeat less regularly than this
+# have no grid for upscaling to help find
+AUTO_UPSCALE_MIN_PERIODICITY = 0.02
+# Narrowest cell, in image pixels, of an image detect_exact_upscale accepts
+EXACT_MIN_PIXEL_WIDTH = 2
+
+
+@profiling.traced
 def close_edges(edges: np.ndarray, kernel_size: int = 10) -> np.ndarray:
     """
     Apply a morphological closing to fill small gaps in edge map.
@@ -35,6 +55,7 @@ def cluster_lines(lines: Lines, threshold: int = 4) -> Lines:
     return [int(np.median(cluster)) for cluster in clusters]
 
 
+@profiling.traced
 def detect_grid_lines(
     edges: np.ndarray,
     hough_rho: float = 1.0,
@@ -82,6 +103,7 @@ def detect_grid_lines(
     return clustered_lines_x, clustered_lines_y
 
 
+@profiling.traced
 def get_pixel_width(
     line_collection: list[Lines], trim_outlier_fraction: float = 0.2
 ) -> int:
@@ -115,6 +137,7 @@ def get_pixel_width(
     return np.median(middle)
 
 
+@profiling.traced
 def homogenize_lines(lines: Lines, pixel_width: int) -> Lines:
     """
     Given sorted line coords and pixel width,
@@ -144,6 +167,19 @@ def homogenize_lines(lines: Lines, pixel_width: int) -> Lines:
     return complete_lines
 
 
+def clamped_grey(img: Image.Image, border: int = 2) -> np.ndarray:
+    """
+    The greyscale of img with border pixels cropped from each side and
+    transparent pixels clamped to a background color, as in utils.crop_border
+    followed by colors.clamp_alpha, but read from a single RGBA array.
+    """
+    rgba = np.asarray(img if img.mode == "RGBA" else img.convert("RGBA"))
+    height, width = rgba.shape[:2]
+    cropped = rgba[border : height - border, border : width - border]
+    return colors.clamp_alpha_array(cropped, mode="L")
+
+
+@profiling.traced
 def compute_mesh(
     img: Image.Image,
     canny_thresholds: tuple[int] = (50, 200),
@@ -174,11 +210,11 @@ def compute_mesh(
     have been distorted via linear transformation.
     """
     # Crop border and zero out mostly transparent pixels from alpha
-    cropped_img = utils.crop_border(img, num_pixels=2)
-    grey_img = colors.clamp_alpha(cropped_img, mode="L")
+    grey = clamped_grey(img, border=2)
 
     # Find edges using Canny edge detection
-    edges = cv2.Canny(np.array(grey_img), *canny_thresholds)
+    with profiling.stage("canny", input_size=list(grey.shape)):
+        edges = cv2.Canny(grey, *canny_thresholds)
 
     # Close small gaps in edges with morphological closing
     closed_edges = close_edges(edges, kernel_size=closure_kernel_size)
@@ -210,33 +246,485 @@ def compute_mesh(
     return mesh_final
 
 
+def gradient_profile(grey: np.ndarray, axis: int) -> np.ndarray:
+    """
+    Project the absolute gradient of a greyscale image onto one axis.
+    With axis=1 the result has one entry per column, where entry i is the
+    total edge strength between columns i - 1 and i (entry 0 is zero).
+    axis=0 does the same for rows.
+    """
+    steps = np.abs(np.diff(grey.astype(np.int16), axis=axis))
+    profile = np.zeros(grey.shape[axis], dtype=np.float64)
+    profile[1:] = steps.sum(axis=1 - axis, dtype=np.int64)
+    return profile
+
+
+def estimate_period(
+    profile: np.ndarray,
+    min_period: float = 2.0,
+    peak_fraction: float = 0.3,
+    min_correlation: float = 0.05,
+    max_candidates: int = 6,
+) -> float | None:
+    """
+    Estimate the spacing of the repeating edges in a gradient profile.
+    - The autocorrelation of the profile is computed with an FFT,
+      grid edges show up as peaks near multiples of the pixel width.
+    - The first max_candidates peaks that are at least peak_fraction of the
+      highest one are refined to sub-pixel accuracy with refine_period.
+    - The refined period with the strongest Fourier coefficient wins. Multiples
+      of the true width score low because their coefficient cancels out,
+      which matters when a non-integer width splits the first peak in two.
+    Returns None if the profile has no clear periodic structure.
+    """
+    n = len(profile)
+    centered = profile - profile.mean()
+    spectrum = np.fft.rfft(centered, n=2 * n)
+    autocorrelation = np.fft.irfft(np.abs(spectrum) ** 2)[: n // 2]
+    if len(autocorrelation) <= min_period + 1 or autocorrelation[0] <= 0:
+        return None
+
+    lags = np.arange(1, len(autocorrelation) - 1)
+    inner = autocorrelation[1:-1]
+    is_peak = (inner > autocorrelation[:-2]) & (inner >= autocorrelation[2:])
+    peak_lags = lags[is_peak & (lags >= min_period)]
+    if len(peak_lags) == 0:
+        return None
+    peak_values = autocorrelation[peak_lags]
+    if peak_values.max() < min_correlation * autocorrelation[0]:
+        return None
+
+    candidates = peak_lags[peak_values >= peak_fraction * peak_values.max()]
+    candidates = candidates[:max_candidates]
+    periods = np.array([refine_period(profile, lag) for lag in candidates])
+    strengths = np.abs(_comb_response(profile, periods))
+    # Prefer the smallest period among those about as strong as the best one
+    return float(periods[np.argmax(strengths >= 0.9 * strengths.max())])
+
+
+def _comb_response(profile: np.ndarray, periods: np.ndarray) -> np.ndarray:
+    """Fourier coefficient of the profile at the frequency of each period."""
+    positions = np.arange(len(profile))
+    phases = np.exp(-2j * np.pi * positions[np.newaxis, :] / periods[:, np.newaxis])
+    return phases @ profile
+
+
+def refine_period(
+    profile: np.ndarray, period: float, search_radius: float = 1.0, steps: int = 81
+) -> float:
+    """
+    Refine an integer period estimate by finding the period within search_radius
+    whose Fourier coefficient in the profile has the largest magnitude.
+    """
+    low = max(period - search_radius, 1.5)
+    periods = np.linspace(low, period + search_radius, steps)
+    response = np.abs(_comb_response(profile, periods))
+    return float(periods[np.argmax(response)])
+
+
+def spectral_lines(profile: np.ndarray, period: float) -> Lines:
+    """
+    Place grid lines with the given period on a gradient profile.
+    The phase of the grid comes from the Fourier coefficient at the period,
+    then each line is snapped to the strongest edge within a quarter period.
+    The ends of the profile are included if the cell they close is at least half a period.
+    """
+    n = len(profile)
+    response = _comb_response(profile, np.array([period]))[0]
+    phase = (-np.angle(response) * period / (2 * np.pi)) % period
+
+    radius = max(1, int(period / 4))
+    lines = []
+    for center in np.arange(phase, n, period):
+        low = max(1, int(round(center)) - radius)
+        high = min(n, int(round(center)) + radius + 1)
+        if low >= high:
+            continue
+        line = low + int(np.argmax(profile[low:high]))
+        if not lines or line - lines[-1] >= period / 2:
+            lines.append(line)
+
+    if not lines:
+        return [0, n - 1]
+    if lines[0] >= period / 2:
+        lines.insert(0, 0)
+    if n - 1 - lines[-1] >= period / 2:
+        lines.append(n - 1)
+    return lines
+
+
+@profiling.traced
+def compute_mesh_spectral(
+    img: Image.Image,
+    output_dir: Path | None = None,
+    pixel_width: float | None = None,
+    border: int = 2,
+) -> Mesh:
+    """
+    Finds grid lines from the periodicity of the image gradients,
+    without edge detection, the Hough transform, or upscaling.
+    - Projects the absolute gradient onto each axis
+    - Estimates the pixel width of each axis from the autocorrelation of its projection
+    - Places lines at the estimated width and phase, snapped to local gradient peaks
+    The cost is linear in the number of pixels.
+    inputs:
+        img: The image to compute the mesh
+        output_dir (optional): If set, saves an image of the mesh to dir
+        pixel_width (optional): Width of the pixels in the image, skips estimating it
+        border: Number of pixels cropped from each side before projecting,
+            lines are returned in the coordinates of the uncropped image
+
+    output:
+        Returns The pixel mesh: mesh_x, mesh_y
+    """
+    # Crop border and zero out mostly transparent pixels from alpha
+    grey = clamped_grey(img, border=border)
+
+    mesh_lines = []
+    for axis in (1, 0):
+        profile = gradient_profile(grey, axis)
+        period = pixel_width
+        if period is None:
+            period = estimate_period(profile)
+        if period is None:
+            lines = [0, len(profile) - 1]
+        else:
+            lines = spectral_lines(profile, period)
+        mesh_lines.append([line + border for line in lines])
+    mesh_final = tuple(mesh_lines)
+
+    if output_dir is not None:
+        img_with_completed_lines = utils.overlay_grid_lines(img, mesh_final)
+        img_with_completed_lines.save(output_dir / "mesh.png")
+
+    return mesh_final
+
+
+@profiling.traced
 def compute_mesh_with_scaling(
     img: Image.Image,
-    upscale_factor: int,
+    upscale_factor: int | str,
     output_dir: Path | None = None,
     pixel_width: int | None = None,
+    mesh_method: str = "hough",
 ) -> tuple[Mesh, int]:
     """
     Try to compute the mesh on on the image.
     First upscale the image with a given upscale factor
     If that yields only the trivial mesh lines, try to compute the mesh on
     the original image instead.
+    mesh_method: 'hough', 'spectral' or 'pyramid'. The spectral method needs no upscaling,
+    so it always runs on the original image. The pyramid method only upscales
+    when the pixels are too small to detect on the original image.
+    upscale_factor: An integer, or AUTO_UPSCALE to choose it with choose_upscale_factor.
     Returns the mesh line coordinates and the scale factor used
     """
-    upscaled_img = utils.scale_img(img, upscale_factor)
+    if mesh_method not in MESH_METHODS:
+        raise ValueError(f"mesh_method must be one of {MESH_METHODS}")
+    if isinstance(upscale_factor, str) and upscale_factor != AUTO_UPSCALE:
+        raise ValueError(f"upscale_factor must be an integer or {AUTO_UPSCALE!r}")
+
+    if mesh_method == "spectral":
+        mesh_lines = compute_mesh_spectral(
+            img, output_dir=output_dir, pixel_width=pixel_width
+        )
+        return mesh_lines, 1
+
+    if mesh_method == "pyramid":
+        return compute_mesh_pyramid(
+            img, upscale_factor, output_dir=output_dir, pixel_width=pixel_width
+        )
+
+    return _compute_mesh_upscaled(
+        img, upscale_factor, output_dir=output_dir, pixel_width=pixel_width
+    )
+
+
+def _compute_mesh_upscaled(
+    img: Image.Image,
+    upscale_factor: int | str,
+    output_dir: Path | None = None,
+    pixel_width: int | None = None,
+) -> tuple[Mesh, int]:
+    """The Hough mesh of the upscaled image, or of the original if that finds none."""
+    if upscale_factor == AUTO_UPSCALE:
+        upscale_factor = choose_upscale_factor(img)
+    upscaled_img = utils.scale_img(img, upscale_factor) if upscale_factor != 1 else img
     mesh_lines = compute_mesh(
         upscaled_img, output_dir=output_dir, pixel_width=pixel_width
     )
-    if not _is_trivial_mesh(mesh_lines):
+    # Running again on the original image only helps if it differs from the upscaled one
+    if upscale_factor == 1 or not _is_trivial_mesh(mesh_lines):
+        profiling.note(upscale_fallback=False)
         return mesh_lines, upscale_factor
 
     # If no mesh is found, then use the original image instead.
+    profiling.note(upscale_fallback=True)
     fallback_mesh_lines = compute_mesh(
         img, output_dir=output_dir, pixel_width=pixel_width
     )
     return fallback_mesh_lines, 1
 
 
+def _boundary_strength(strip: np.ndarray, alpha_threshold: int) -> np.ndarray:
+    """
+    Color change between consecutive columns of an RGBA (rows, width, 4) strip,
+    summed over the rows and channels. Entry i is the strength of a line at
+    column i, that is between columns i - 1 and i. The ends are zero.
+    """
+    opaque = strip[:, :, 3:] >= alpha_threshold
+    rgb = np.where(opaque, strip[:, :, :3], 0).astype(np.int16)
+    steps = np.abs(np.diff(rgb, axis=1)).sum(axis=(0, 2), dtype=np.int64)
+    strength = np.zeros(strip.shape[1] + 1, dtype=np.int64)
+    strength[1:-1] = steps
+    return strength
+
+
+def refine_lines(
+    strength: np.ndarray, approx_lines: np.ndarray, radius: int
+) -> np.ndarray:
+    """
+    Move every line to the strongest boundary within radius of it.
+    A line with no boundary nearby, e.g. between two cells of the same color,
+    keeps its position.
+    """
+    offsets = np.arange(-radius, radius + 1)
+    windows = np.clip(approx_lines[:, np.newaxis] + offsets, 0, len(strength) - 1)
+    window_strength = strength[windows]
+    best = np.argmax(window_strength, axis=1)
+    refined = windows[np.arange(len(windows)), best]
+    flat = window_strength.max(axis=1) == 0
+    refined[flat] = approx_lines[flat]
+    return refined
+
+
+def _fill_gaps(
+    lines: np.ndarray, strength: np.ndarray, pixel_width: float, radius: int
+) -> np.ndarray:
+    """
+    Split gaps spanning several pixel widths with evenly spaced lines, each refined.
+    The decimated mesh can miss lines when the pixels are only a few decimated pixels wide.
+    """
+    lines = np.unique(lines)
+    counts = np.round(np.diff(lines) / pixel_width).astype(np.intp)
+    guesses = [
+        round(start + step * (end - start) / count)
+        for start, end, count in zip(lines[:-1], lines[1:], counts)
+        if count > 1
+        for step in range(1, count)
+    ]
+    if not guesses:
+        return lines
+    refined = refine_lines(strength, np.array(guesses, dtype=np.intp), radius)
+    return np.unique(np.concatenate([lines, refined]))
+
+
+def _extend_to_edges(
+    lines: np.ndarray,
+    strength: np.ndarray,
+    size: int,
+    pixel_width: float,
+    radius: int,
+) -> Lines:
+    """
+    Add lines a pixel width apart, each refined, from the outermost lines
+    towards the image edges. Then add the edges themselves where the cell
+    next to them is at least half a pixel wide.
+    """
+    lines = np.unique(lines).tolist()
+    if not lines:
+        return [0, size]
+    while lines[0] - pixel_width > radius:
+        guess = np.array([round(lines[0] - pixel_width)])
+        lines.insert(0, int(refine_lines(strength, guess, radius)[0]))
+    while size - lines[-1] - pixel_width > radius:
+        guess = np.array([round(lines[-1] + pixel_width)])
+        lines.append(int(refine_lines(strength, guess, radius)[0]))
+    if lines[0] >= pixel_width / 2:
+        lines.insert(0, 0)
+    if size - lines[-1] >= pixel_width / 2:
+        lines.append(size)
+    return lines
+
+
+def _sample_strips(
+    img: Image.Image | np.ndarray, positions: np.ndarray, axis: int
+) -> np.ndarray:
+    """
+    RGBA pixels of the rows (axis 0) or columns (axis 1) of img at positions,
+    as an array of shape (len(positions), length, 4). Only the strips are read.
+    img may also be an (height, width, 4) array.
+    """
+    if isinstance(img, np.ndarray):
+        return img[positions] if axis == 0 else img[:, positions].swapaxes(0, 1)
+    width, height = img.size
+    strips = []
+    for position in positions.tolist():
+        if axis == 0:
+            strip = img.crop((0, position, width, position + 1))
+        else:
+            strip = img.crop((position, 0, position + 1, height))
+        strips.append(np.asarray(strip.convert("RGBA")).reshape(-1, 4))
+    return np.stack(strips)
+
+
+@profiling.traced
+def estimate_pixel_width(
+    img: Image.Image, num_samples: int = 32, min_periodicity: float = 0.0
+) -> float | None:
+    """
+    Estimate the width of the pixels of img, in image pixels, from the color
+    changes along num_samples rows and columns.
+    Only the sampled strips are read, and only a window of each of them is used,
+    so the cost is independent of the image size.
+    The periodicity of an axis is the fraction of its color change that falls
+    on a grid with the estimated width, about 1 for clean pixel art and
+    close to 0 for noise.
+    Returns None if no period is found along either axis,
+    or if either is less periodic than min_periodicity.
+    """
+    width, height = img.size
+    periods = []
+    for axis, size, other_size in ((0, width, height), (1, height, width)):
+        positions = np.linspace(0, other_size - 1, num_samples).astype(np.intp)
+        strips = _sample_strips(img, np.unique(positions), axis)
+        strength = _boundary_strength(strips, colors.ALPHA_THRESHOLD)
+        start = max(0, (size - PYRAMID_TARGET_SIZE * 2) // 2)
+        window = strength[start : start + PYRAMID_TARGET_SIZE * 2].astype(np.float64)
+        period = estimate_period(window)
+        if period is None:
+            return None
+        if min_periodicity > 0:
+            response = _comb_response(window - window.mean(), np.array([period]))
+            periodicity = float(np.abs(response[0]) / window.sum())
+            profiling.note(**{f"periodicity_{'xy'[axis]}": periodicity})
+            if periodicity < min_periodicity:
+                return None
+        periods.append(period)
+    return min(periods)
+
+
+@profiling.traced
+def choose_upscale_factor(
+    img: Image.Image, default_factor: int = 2, num_samples: int = 32
+) -> int:
+    """
+    Choose the upscale factor for Hough mesh detection from a pre-pass over
+    num_samples rows and columns of img, which costs a fraction of upscaling.
+    - Images with no regular grid get 1: the upscaled image would only
+      yield the trivial mesh and detection would run again on the original.
+    - Pixels at least AUTO_UPSCALE_MIN_PIXEL_WIDTH wide get 1,
+      they are wide enough to detect on the original image.
+    - Smaller pixels get default_factor.
+    """
+    pixel_width = estimate_pixel_width(
+        img, num_samples, min_periodicity=AUTO_UPSCALE_MIN_PERIODICITY
+    )
+    if pixel_width is None:
+        factor, reason = 1, "no_grid"
+    elif pixel_width >= AUTO_UPSCALE_MIN_PIXEL_WIDTH:
+        factor, reason = 1, "large_pixels"
+    else:
+        factor, reason = default_factor, "small_pixels"
+    profiling.note(
+        estimated_pixel_width=pixel_width, upscale_factor=factor, upscale_reason=reason
+    )
+    return factor
+
+
+@profiling.traced
+def compute_mesh_pyramid(
+    img: Image.Image,
+    upscale_factor: int | str = 2,
+    output_dir: Path | None = None,
+    pixel_width: float | None = None,
+    target_size: int = PYRAMID_TARGET_SIZE,
+    min_pixel_width: float = PYRAMID_MIN_PIXEL_WIDTH,
+    num_samples: int = 32,
+) -> tuple[Mesh, int]:
+    """
+    Coarse to fine mesh detection for large images, without reading every pixel.
+    - Estimates a lower bound of the pixel width from the color boundaries along
+      num_samples rows and columns at full resolution
+    - If it is below min_pixel_width, or no period is found, uses the
+      upscaled image like the hough method instead
+    - Detects an approximate mesh with the spectral method on a nearest neighbor
+      copy decimated to about target_size, keeping at least 4 pixels per cell,
+      and takes the pixel width from its line spacing
+    - Moves every line to the strongest color boundary within a narrow band
+      around it at full resolution, measured on the middle row (or column) of
+      every cell. Lines the coarse mesh missed are filled in and refined the same way.
+    The cost is about (number of lines) x (image side) instead of the number of pixels.
+    inputs:
+        img: The image to compute the mesh
+        upscale_factor: Upscale factor of the fallback for small pixels, or AUTO_UPSCALE
+        output_dir (optional): If set, saves an image of the mesh to dir
+        pixel_width (optional): Width of the pixels in image pixels, skips estimating it
+    Returns the mesh line coordinates and the scale factor used,
+    1 unless the fallback ran.
+    """
+    width, height = img.size
+    user_pixel_width = pixel_width is not None
+    if pixel_width is None:
+        pixel_width = estimate_pixel_width(img, num_samples)
+    profiling.note(pixel_width=pixel_width)
+
+    if pixel_width is None or pixel_width < min_pixel_width:
+        profiling.note(pyramid_fallback=True)
+        return _compute_mesh_upscaled(
+            img,
+            upscale_factor,
+            output_dir=output_dir,
+            pixel_width=pixel_width if user_pixel_width else None,
+        )
+    profiling.note(pyramid_fallback=False)
+
+    # Nearest neighbor decimation only reads the sampled pixels
+    factor = max(1, min(max(width, height) // target_size, int(pixel_width // 4)))
+    profiling.note(pyramid_factor=factor)
+    coarse_img = img
+    if factor > 1:
+        coarse_img = img.resize(
+            (width // factor, height // factor), resample=Image.Resampling.NEAREST
+        )
+    coarse_lines = compute_mesh_spectral(coarse_img.convert("RGBA"))
+    if not user_pixel_width:
+        # The coarse mesh sees whole cells rather than a few rows of them,
+        # so its mean line spacing is the better estimate
+        spacings = [
+            (lines[-2] - lines[1]) / (len(lines) - 3)
+            for lines in coarse_lines
+            if len(lines) > 3
+        ]
+        if spacings:
+            pixel_width = max(float(np.mean(spacings)) * factor, pixel_width)
+            profiling.note(pixel_width=pixel_width)
+
+    radius = max(1, min(int(1.5 * factor), int(pixel_width / 3)))
+    mesh_lines = []
+    for axis, size, other_size in ((0, width, height), (1, height, width)):
+        # The outermost lines may only mark the image edges, so they are
+        # found again from their neighbors after refining
+        lines = np.asarray(coarse_lines[axis][1:-1], dtype=np.intp) * factor
+        # Measure the boundaries on the middle row (or column) of every cell
+        other = np.asarray(coarse_lines[1 - axis], dtype=np.intp) * factor
+        samples = np.clip((other[:-1] + other[1:]) // 2, 0, other_size - 1)
+        strips = _sample_strips(img, np.unique(samples), axis)
+        strength = _boundary_strength(strips, colors.ALPHA_THRESHOLD)
+        refined = refine_lines(strength, lines, radius)
+        refined = _fill_gaps(refined, strength, pixel_width, radius)
+        mesh_lines.append(
+            _extend_to_edges(refined, strength, size, pixel_width, radius)
+        )
+    mesh_final = tuple(mesh_lines)
+
+    if output_dir is not None:
+        img_with_completed_lines = utils.overlay_grid_lines(img, mesh_final)
+        img_with_completed_lines.save(output_dir / "pyramid_lines.png")
+
+    return mesh_final, 1
+
+
 def _is_trivial_mesh(img_mesh: Mesh) -> bool:
     """
     Returns True if no lines have been identified when computing the mesh.
@@ -246,3 +734,248 @@ def _is_trivial_mesh(img_mesh: Mesh) -> bool:
     x_num = len(img_mesh[0])
     y_num = len(img_mesh[1])
     return x_num in (2, 3) and y_num in (2, 3)
+
+
+@profiling.traced
+def mesh_fit(
+    img: Image.Image, mesh_lines: Mesh, mesh_scale: int = 1, tolerance: int = 1
+) -> float:
+    """
+    How well img fits a mesh: the share of its edge strength on each axis that lies
+    within tolerance pixels of a mesh line, the smaller of the two axes.
+    A frame that still fits the mesh of an earlier frame of the same animation
+    keeps a similar score, while a moved or rescaled grid scores much lower.
+    mesh_lines are in the coordinates of img upscaled by mesh_scale.
+    An image without edges fits any mesh and scores 1.
+    """
+    grey = clamped_grey(img, border=0)
+    scores = []
+    for axis, lines in ((1, mesh_lines[0]), (0, mesh_lines[1])):
+        profile = gradient_profile(grey, axis)
+        total = profile.sum()
+        if total == 0:
+            scores.append(1.0)
+            continue
+        positions = np.rint(np.asarray(lines) / mesh_scale).astype(np.intp)
+        positions = np.clip(positions, 0, len(profile))
+        # near[i + tolerance] is set for every i within tolerance of a line
+        near = np.zeros(len(profile) + 2 * tolerance + 1, dtype=bool)
+        for shift in range(2 * tolerance + 1):
+            near[positions + shift] = True
+        scores.append(
+            float(profile[near[tolerance : tolerance + len(profile)]].sum() / total)
+        )
+    score = min(scores)
+    profiling.note(mesh_fit=round(score, 3))
+    return score
+
+
+def _keyed_pixels(rgba: np.ndarray, alpha_threshold: int) -> np.ndarray:
+    """
+    One uint32 per pixel of an RGBA array, equal for pixels downsampling
+    cannot tell apart: transparent pixels are all 0 and opaque ones have alpha 255.
+    """
+    pixels = np.ascontiguousarray(rgba).view(np.uint32)[:, :, 0]
+    alpha = rgba[:, :, 3]
+    if alpha.min() == 255:
+        return pixels
+    opaque_alpha = np.array([0, 0, 0, 255], dtype=np.uint8).view(np.uint32)
+    return np.where(alpha >= alpha_threshold, pixels | opaque_alpha, 0)
+
+
+def _exact_lines(changes: np.ndarray, min_pixel_width: int) -> Lines | None:
+    """
+    The cell lines along one axis from the positions where a row (or column)
+    differs from the one before it, or None if they are not those of an upscale.
+    Runs of equal rows between changes are one or more cells, of a width found
+    from the runs. A run of cells of equal color is split evenly, and partial
+    cells at the edges shorter than half a cell are dropped.
+    """
+    size = len(changes)
+    bounds = np.concatenate([[0], np.flatnonzero(changes), [size]])
+    runs = np.diff(bounds)
+    inner = runs[1:-1]
+    if len(inner) == 0 or inner.min() < min_pixel_width:
+        return None
+
+    # The narrowest run is one cell, refine the width over all of them
+    pixel_width = float(inner.min())
+    for _ in range(3):
+        pixel_width = inner.sum() / np.maximum(np.round(inner / pixel_width), 1).sum()
+    counts = np.maximum(np.round(inner / pixel_width), 1).astype(np.intp)
+    # A nearest neighbor upscale rounds every line to the pixel,
+    # so runs of n cells are n pixel widths to within a pixel
+    if np.any(np.abs(inner - counts * pixel_width) > 1):
+        return None
+
+    first_count, last_count = (round(run / pixel_width) for run in runs[[0, -1]])
+    counts = [first_count, *counts.tolist(), last_count]
+    lines = []
+    for start, run, count in zip(bounds[:-1].tolist(), runs.tolist(), counts):
+        lines.extend(start + (step * run) // count for step in range(count))
+    lines.append(size if last_count else int(bounds[-2]))
+    return lines
+
+
+@profiling.traced
+def detect_exact_upscale(
+    img: Image.Image | np.ndarray,
+    alpha_threshold: int = colors.ALPHA_THRESHOLD,
+    min_pixel_width: int = EXACT_MIN_PIXEL_WIDTH,
+    num_samples: int = 32,
+) -> Mesh | None:
+    """
+    The mesh of img if it is a clean nearest neighbor upscale, None otherwise.
+    Every cell of the mesh is then a block of identical pixels, which is proven
+    rather than estimated: the lines are where a row or column differs from the
+    one before it. The scale need not be an integer, cells may differ in width by a pixel.
+    - num_samples rows and columns are compared first, any change between adjacent
+      pixels of them rejects the image without reading all of it, as for noisy inputs.
+    - Otherwise all rows and columns are compared in one pass over the pixels.
+    Pixels that downsampling treats the same, like transparent pixels of any color,
+    count as identical. The lines are in image coordinates, at scale 1.
+    img may also be an (height, width, 4) uint8 array, which is only read.
+    """
+    is_array = isinstance(img, np.ndarray)
+    height, width = img.shape[:2] if is_array else (img.height, img.width)
+    for axis, other_size in ((0, height), (1, width)):
+        positions = np.unique(
+            np.linspace(0, other_size - 1, num_samples).astype(np.intp)
+        )
+        strips = _keyed_pixels(_sample_strips(img, positions, axis), alpha_threshold)
+        changes = np.flatnonzero(np.any(strips[:, 1:] != strips[:, :-1], axis=0))
+        if np.any(np.diff(changes) < min_pixel_width):
+            profiling.note(exact_upscale=False)
+            return None
+
+    if not is_array:
+        img = np.asarray(img if img.mode == "RGBA" else img.convert("RGBA"))
+    keyed = _keyed_pixels(img, alpha_threshold)
+    column_changes = np.zeros(width, dtype=bool)
+    column_changes[1:] = np.any(keyed[:, 1:] != keyed[:, :-1], axis=0)
+    row_changes = np.zeros(height, dtype=bool)
+    row_changes[1:] = np.any(keyed[1:] != keyed[:-1], axis=1)
+
+    lines_x = _exact_lines(column_changes, min_pixel_width)
+    lines_y = _exact_lines(row_changes, min_pixel_width)
+    exact = lines_x is not None and lines_y is not None
+    profiling.note(exact_upscale=exact)
+    return (lines_x, lines_y) if exact else None
+
+
+def _grid_lines(size: int, cell: float, offset: float) -> Lines:
+    """
+    Lines of a regular grid along an axis of the given size.
+    Partial cells at either end are kept if they are at least half a cell wide.
+    """
+    if cell >= size:
+        return [0, size]
+    offset %= cell
+    count = math.floor((size - offset) / cell)
+    lines = [round(offset + n * cell) for n in range(count + 1)]
+    if lines[0] >= cell / 2:
+        lines.insert(0, 0)
+    if size - lines[-1] >= cell / 2:
+        lines.append(size)
+    return lines
+
+
+_GRID_SPEC_PATTERN = re.compile(
+    r"^(?P<w>\d+(?:\.\d+)?)x(?P<h>\d+(?:\.\d+)?)"
+    r"(?:\+(?P<x>\d+(?:\.\d+)?)\+(?P<y>\d+(?:\.\d+)?))?$"
+)
+
+
+@dataclass(frozen=True)
+class GridSpec:
+    """
+    A regular grid known in advance, e.g. from the settings of the generator.
+    - cell_width, cell_height: Size of one pixel art pixel in image pixels,
+        may be fractional
+    - offset_x, offset_y: Position of a grid line on each axis
+    """
+
+    cell_width: float
+    cell_height: float
+    offset_x: float = 0
+    offset_y: float = 0
+
+    def __post_init__(self):
+        if self.cell_width <= 0 or self.cell_height <= 0:
+            raise ValueError("Grid cells must have a positive width and height")
+
+    @classmethod
+    def parse(cls, spec: str) -> "GridSpec":
+        """Parse 'WxH' or 'WxH+X+Y', e.g. '16x16+4+0'."""
+        match = _GRID_SPEC_PATTERN.match(spec.strip())
+        if match is None:
+            raise ValueError(f"Invalid grid {spec!r}, expected WxH or WxH+X+Y")
+        return cls(
+            float(match["w"]),
+            float(match["h"]),
+            float(match["x"] or 0),
+            float(match["y"] or 0),
+        )
+
+    def mesh_for(self, width: int, height: int) -> tuple[Mesh, int]:
+        """The mesh of the grid on an image of the given size, with scale 1."""
+        lines_x = _grid_lines(width, self.cell_width, self.offset_x)
+        lines_y = _grid_lines(height, self.cell_height, self.offset_y)
+        return (lines_x, lines_y), 1
+
+
+@dataclass(frozen=True)
+class FixedMesh:
+    """
+    Mesh lines known in advance, e.g. saved from an earlier run with save_mesh.
+    The lines are coordinates on the image upscaled by scale.
+    """
+
+    lines_x: tuple[int, ...]
+    lines_y: tuple[int, ...]
+    scale: int = 1
+
+    def mesh_for(self, width: int, height: int) -> tuple[Mesh, int]:
+        """The mesh lines and their scale, checked against the image size."""
+        lines_x, lines_y = list(self.lines_x), list(self.lines_y)
+        if (
+            len(lines_x) < 2
+            or len(lines_y) < 2
+            or lines_x != sorted(lines_x)
+            or lines_y != sorted(lines_y)
+            or lines_x[0] < 0
+            or lines_y[0] < 0
+            or lines_x[-1] > width * self.scale
+            or lines_y[-1] > height * self.scale
+        ):
+            raise ValueError(f"The mesh does not fit an image of size {width}x{height}")
+        return (lines_x, lines_y), self.scale
+
+
+KnownGrid = GridSpec | FixedMesh
+
+
+def save_mesh(path: Path | str, mesh_lines: Mesh, scale: int = 1) -> None:
+    """Save mesh lines on the image upscaled by scale as JSON."""
+    lines_x, lines_y = mesh_lines
+    data = {
+        "lines_x": [int(line) for line in lines_x],
+        "lines_y": [int(line) for line in lines_y],
+        "scale": int(scale),
+    }
+    Path(path).write_text(json.dumps(data))
+
+
+def load_mesh(path: Path | str) -> FixedMesh:
+    """Load a mesh saved with save_mesh."""
+    data = json.loads(Path(path).read_text())
+    return FixedMesh(
+        tuple(data["lines_x"]), tuple(data["lines_y"]), data.get("scale", 1)
+    )
+
+
+def parse_grid(spec: str) -> KnownGrid:
+    """A GridSpec from 'WxH+X+Y', or the mesh saved in the JSON file at the path spec."""
+    if spec.lower().endswith(".json"):
+        return load_mesh(Path(spec).expanduser())
+    return GridSpec.parse(spec)
@@ -0,0 +1,260 @@
+"""Fixed palettes shared by many images, mapped through a precomputed color lookup table"""
+
+import functools
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageColor
+
+from proper_pixel_art import colors, profiling, quantizers
+from proper_pixel_art.colors import RGB
+
+MAX_COLORS = 256
+# Bits kept of each channel to index the lookup table, 5 gives 32x32x32 bins
+LUT_BITS = 5
+# Opaque pixels sampled from all images together when fitting a palette
+FIT_SAMPLE_SIZE = 2**18
+# Pixels compared with every palette color at once when resolving ambiguous bins
+PIXELS_PER_CHUNK = 2**14
+
+
+@dataclass(frozen=True)
+class Palette:
+    """
+    A fixed list of at most 256 colors to map images to.
+    Build one with Palette.fit from sample images or Palette.load from a file, then
+    palette.apply(image) replaces every color with the nearest palette color.
+
+    Mapping goes through a lookup table from the top LUT_BITS bits of each channel
+    to the few palette colors that can be nearest to a color in that bin, computed
+    once per palette. Pixels are only compared with those candidates, so mapping
+    costs O(pixels) and still gives exactly the nearest color.
+    """
+
+    colors: tuple[RGB, ...]
+
+    def __post_init__(self):
+        if not 1 <= len(self.colors) <= MAX_COLORS:
+            raise ValueError(f"A palette has 1 to {MAX_COLORS} colors")
+
+    def __len__(self) -> int:
+        return len(self.colors)
+
+    @functools.cached_property
+    def array(self) -> np.ndarray:
+        """The colors as a (colors, 3) uint8 array."""
+        return np.array(self.colors, dtype=np.uint8).reshape(-1, 3)
+
+    @property
+    def lookup_table(self) -> np.ndarray:
+        """
+        The palette colors that can be nearest to a color, indexed by the packed
+        top LUT_BITS bits of its red, green and blue, nearest to the bin center first.
+        Built once per process for each palette, and not pickled with it.
+        """
+        return _lookup_table(self.colors, LUT_BITS)
+
+    def indices(self, rgb: np.ndarray) -> np.ndarray:
+        """The index of the nearest palette color of each color of an (..., 3) uint8 array."""
+        flat = np.ascontiguousarray(rgb[..., :3]).reshape(-1, 3)
+        table = self.lookup_table
+        shift = 8 - LUT_BITS
+        bins = (flat[:, 0] >> shift).astype(np.intp) << (2 * LUT_BITS)
+        bins |= (flat[:, 1] >> shift).astype(np.intp) << LUT_BITS
+        bins |= flat[:, 2] >> shift
+        result = table[bins, 0]
+        if table.shape[1] == 1:
+            return result.reshape(rgb.shape[:-1])
+        # Only bins with several candidates need their colors compared
+        (refine,) = np.nonzero(table[bins, 1] != result)
+        palette = self.array.astype(np.int32)
+        for start in range(0, len(refine), PIXELS_PER_CHUNK):
+            chunk = refine[start : start + PIXELS_PER_CHUNK]
+            candidates = table[bins[chunk]]
+            diff = flat[chunk, None, :].astype(np.int32) - palette[candidates]
+            best = np.argmin((diff * diff).sum(axis=2), axis=1)
+            result[chunk] = candidates[np.arange(len(chunk)), best]
+        return result.reshape(rgb.shape[:-1])
+
+    @profiling.traced
+    def apply(self, image: Image.Image) -> Image.Image:
+        """image with every color replaced by the nearest palette color, keeping its alpha."""
+        rgba = np.array(image.convert("RGBA"))
+        rgba[:, :, :3] = self.array[self.indices(rgba)]
+        return Image.fromarray(rgba, mode="RGBA")
+
+    @classmethod
+    @profiling.traced
+    def fit(
+        cls,
+        images: list[Image.Image],
+        num_colors: int,
+        alpha_threshold: int = colors.ALPHA_THRESHOLD,
+        quantize_method: str = "maxcoverage",
+    ) -> "Palette":
+        """
+        A palette of at most num_colors colors for all images together, e.g. the
+        downsampled results of a sample of a batch. The opaque pixels of every image,
+        evenly subsampled to FIT_SAMPLE_SIZE in total, are quantized together
+        with quantize_method, see pixelate. Colors are ordered by use.
+        """
+        opaque = []
+        for image in images:
+            rgba = np.asarray(image.convert("RGBA")).reshape(-1, 4)
+            opaque.append(rgba[rgba[:, 3] >= alpha_threshold, :3])
+        pixels = np.concatenate(opaque) if opaque else np.zeros((0, 3), np.uint8)
+        if len(pixels) == 0:
+            raise ValueError("The images have no opaque pixels to fit a palette to")
+        step = -(-len(pixels) // FIT_SAMPLE_SIZE)
+        pixels = np.ascontiguousarray(pixels[::step])
+        if quantize_method not in quantizers.PIL_METHODS:
+            fitted, _ = quantizers.fit_colors(pixels, num_colors, quantize_method)
+            return cls(tuple(map(tuple, fitted.tolist())))
+        sample = Image.frombuffer("RGB", (1, len(pixels)), pixels, "raw", "RGB", 0, 1)
+        quantized = sample.quantize(
+            colors=num_colors,
+            method=quantizers.PIL_METHODS[quantize_method],
+            dither=Image.Dither.NONE,
+        )
+        entries = quantized.getpalette()
+        used = sorted(quantized.getcolors(), key=lambda item: -item[0])
+        return cls(
+            tuple(tuple(entries[3 * index : 3 * index + 3]) for _, index in used)
+        )
+
+    @classmethod
+    def from_image(cls, image: Image.Image) -> "Palette":
+        """The opaque colors of an image, e.g. a palette swatch, most used first."""
+        rgba = np.asarray(image.convert("RGBA")).reshape(-1, 4)
+        rgb = rgba[rgba[:, 3] >= colors.ALPHA_THRESHOLD, :3].astype(np.int32)
+        packed = (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+        values, first_seen, counts = np.unique(
+            packed, return_index=True, return_counts=True
+        )
+        if len(values) > MAX_COLORS:
+            raise ValueError(
+                f"The image has {len(values)} colors, a palette at most {MAX_COLORS}"
+            )
+        order = np.lexsort((first_seen, -counts))
+        return cls(
+            tuple(
+                (value >> 16, (value >> 8) & 0xFF, value & 0xFF)
+                for value in values[order].tolist()
+            )
+        )
+
+    @classmethod
+    def load(cls, path: Path | str) -> "Palette":
+        """
+        Read a palette from a GIMP .gpl file, a .hex file with one RRGGBB color
+        per line as exported by Lospec, or the colors of any image file.
+        """
+        path = Path(path)
+        suffix = path.suffix.lower()
+        if suffix == ".gpl":
+            return cls(_parse_gpl(path.read_text(encoding="utf-8")))
+        if suffix == ".hex":
+            lines = path.read_text(encoding="utf-8").splitlines()
+            return cls(
+                tuple(
+                    ImageColor.getrgb("#" + line.strip().lstrip("#"))[:3]
+                    for line in lines
+                    if line.strip() and not line.strip().startswith(";")
+                )
+            )
+        with Image.open(path) as image:
+            return cls.from_image(image)
+
+    def save(self, path: Path | str) -> None:
+        """Write the palette to a .gpl file, or a .hex file for any other suffix."""
+        path = Path(path)
+        if path.suffix.lower() == ".gpl":
+            lines = ["GIMP Palette", f"Name: {path.stem}", "#"]
+            lines += [
+                f"{red:3d} {green:3d} {blue:3d}" for red, green, blue in self.colors
+            ]
+        else:
+            lines = [
+                f"{red:02x}{green:02x}{blue:02x}" for red, green, blue in self.colors
+            ]
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def _parse_gpl(text: str) -> tuple[RGB, ...]:
+    """The colors of a GIMP palette, skipping its header and comments."""
+    lines = text.splitlines()
+    if not lines or lines[0].strip() != "GIMP Palette":
+        raise ValueError("Not a GIMP palette, the first line must be 'GIMP Palette'")
+    result = []
+    for line in lines[1:]:
+        line = line.strip()
+        if not line or line.startswith("#") or ":" in line.split()[0]:
+            continue
+        red, green, blue = (int(value) for value in line.split()[:3])
+        result.append((red, green, blue))
+    return tuple(result)
+
+
+@functools.lru_cache(maxsize=8)
+def _lookup_table(
+    palette_colors: tuple[RGB, ...], bits: int, bins_per_chunk: int = 4096
+) -> np.ndarray:
+    """
+    The palette colors that can be nearest to some color of each bin, as a
+    (bins, candidates) array of indices with the color nearest the bin center first,
+    padded by repeating it. Every color of a bin is within half the bin diagonal
+    of its center, so only palette colors at most a full diagonal further from
+    the center than the nearest one can be nearest.
+    """
+    palette = np.array(palette_colors, dtype=np.float32).reshape(-1, 3)
+    # Bins rarely have more candidates than this, the others are sorted in full
+    num_sorted = min(len(palette), 16)
+    width = 1 << (8 - bits)
+    diagonal = np.sqrt(3) * (width - 1)
+    axis = np.arange(1 << bits, dtype=np.float32) * width + (width - 1) / 2
+    red, green, blue = np.meshgrid(axis, axis, axis, indexing="ij")
+    centers = np.stack([red.ravel(), green.ravel(), blue.ravel()], axis=1)
+
+    chunks = []
+    for start in range(0, len(centers), bins_per_chunk):
+        chunk = centers[start : start + bins_per_chunk]
+        diff = chunk[:, None, :] - palette[None, :, :]
+        distances = np.sqrt((diff * diff).sum(axis=2))
+        nearest = distances.min(axis=1, keepdims=True)
+        order = np.argpartition(distances, num_sorted - 1, axis=1)[:, :num_sorted]
+        if num_sorted < len(palette):
+            crowded = (distances <= nearest + diagonal).sum(axis=1) > num_sorted
+            if crowded.any():
+                return _sorted_lookup_table(palette, centers, diagonal)
+        ordered = np.take_along_axis(distances, order, axis=1)
+        by_distance = np.argsort(ordered, axis=1, kind="stable")
+        order = np.take_along_axis(order, by_distance, axis=1)
+        ordered = np.take_along_axis(ordered, by_distance, axis=1)
+        within = ordered <= nearest + diagonal
+        # Candidates come first in order, replace the rest by the nearest color
+        chunks.append(np.where(within, order, order[:, :1]).astype(np.uint8))
+    return _trim_candidates(np.concatenate(chunks))
+
+
+def _sorted_lookup_table(
+    palette: np.ndarray, centers: np.ndarray, diagonal: float
+) -> np.ndarray:
+    """_lookup_table sorting all palette colors for each bin, for crowded palettes."""
+    chunks = []
+    for start in range(0, len(centers), 1024):
+        chunk = centers[start : start + 1024]
+        diff = chunk[:, None, :] - palette[None, :, :]
+        distances = np.sqrt((diff * diff).sum(axis=2))
+        order = np.argsort(distances, axis=1, kind="stable")
+        ordered = np.take_along_axis(distances, order, axis=1)
+        within = ordered <= ordered[:, :1] + diagonal
+        chunks.append(np.where(within, order, order[:, :1]).astype(np.uint8))
+    return _trim_candidates(np.concatenate(chunks))
+
+
+def _trim_candidates(table: np.ndarray) -> np.ndarray:
+    """table without the trailing columns that only repeat the nearest color."""
+    used = np.flatnonzero((table != table[:, :1]).any(axis=0))
+    num_candidates = int(used[-1]) + 1 if len(used) else 1
+    return np.ascontiguousarray(table[:, :num_candidates])
@@ -1,24 +1,260 @@
 """Main functions for pixelating an image with the pixelate function"""
 
-from itertools import product
 from pathlib import Path
 
 import numpy as np
 from PIL import Image
 
-from proper_pixel_art import colors, mesh, utils
-from proper_pixel_art.utils import Mesh
+from proper_pixel_art import colors, mesh, profiling, quantizers, utils
+from proper_pixel_art.cache import StageCache
+from proper_pixel_art.palette import Palette
+from proper_pixel_art.utils import Lines, Mesh
 
+# Cells labeled at a time for the statistics of colors.cell_colors,
+# bounding the size of their per cell histograms
+CELLS_PER_CHUNK = 4096
 
+
+def _split_lines(lines: Lines, mesh_scale: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Map line coordinates found on an image upscaled by mesh_scale back to the
+    original image. Returns the index of the original pixel each line falls in
+    and how far into that pixel the line is, in upscaled pixels.
+    """
+    return np.divmod(np.asarray(lines, dtype=np.intp), mesh_scale)
+
+
+def _opaque_values(rgba: np.ndarray) -> np.ndarray:
+    """
+    Copy of RGBA pixels with the transparent ones zeroed
+    and the alpha channel replaced by 1 for opaque pixels and 0 otherwise.
+    """
+    opaque = rgba[..., 3:] >= colors.ALPHA_THRESHOLD
+    values = rgba * opaque
+    values[..., 3:] = opaque
+    return values
+
+
+def _row_band_sums(
+    values: np.ndarray, lines_y: Lines, mesh_scale: int, opaque_only: bool = False
+) -> np.ndarray:
+    """
+    Sum an (height, width, channels) array over the row bands between
+    consecutive y lines. Returns an int64 array of shape (len(lines_y) - 1, width, channels).
+    Slicing whole bands keeps the reduction over the full frame contiguous.
+
+    The lines are coordinates on the array upscaled by mesh_scale, so each row
+    counts mesh_scale times, and a row split by a line counts once for every
+    upscaled row on each side of it.
+    With opaque_only, values is RGBA and the sums are those of _opaque_values,
+    computed one band at a time rather than on a masked copy of the whole frame.
+    """
+    prepare = _opaque_values if opaque_only else np.asarray
+    rows, offsets = _split_lines(lines_y, mesh_scale)
+    sums = np.zeros((len(lines_y) - 1, *values.shape[1:]), dtype=np.int64)
+    for index, (y0, y1, r0, r1) in enumerate(
+        zip(rows[:-1], rows[1:], offsets[:-1], offsets[1:])
+    ):
+        band = sums[index]
+        np.sum(prepare(values[y0:y1]), axis=0, dtype=np.int64, out=band)
+        band *= mesh_scale
+        if r0:
+            band -= r0 * prepare(values[y0]).astype(np.int64)
+        if r1:
+            band += r1 * prepare(values[y1]).astype(np.int64)
+    return sums
+
+
+def _column_segment_sums(
+    values: np.ndarray, lines_x: Lines, mesh_scale: int
+) -> np.ndarray:
+    """
+    Sum an int64 (rows, width, channels) array over the column segments
+    [lines_x[i], lines_x[i+1]), weighting columns split by a line like _row_band_sums.
+    Empty segments sum to zero.
+    """
+    columns, offsets = _split_lines(lines_x, mesh_scale)
+    starts, ends = columns[:-1], columns[1:]
+    sums = np.zeros((values.shape[0], len(starts), values.shape[2]), dtype=np.int64)
+
+    nonempty = ends > starts
+    if np.any(nonempty):
+        # Restrict to the covered span so the last segment ends at the last column
+        span = values[:, columns[0] : columns[-1]]
+        sums[:, nonempty] = np.add.reduceat(span, starts[nonempty] - columns[0], axis=1)
+        sums *= mesh_scale
+
+    # Partial columns at the segment borders. A zero offset never reads past the edge.
+    last_column = values.shape[1] - 1
+    sums -= offsets[:-1, np.newaxis] * values[:, np.minimum(starts, last_column)]
+    sums += offsets[1:, np.newaxis] * values[:, np.minimum(ends, last_column)]
+    return sums
+
+
+def _cell_sums(
+    values: np.ndarray, mesh_lines: Mesh, mesh_scale: int = 1, opaque_only: bool = False
+) -> np.ndarray:
+    """
+    Sum an (height, width, channels) array over every cell of the mesh.
+    Returns an int64 array of shape (len(lines_y) - 1, len(lines_x) - 1, channels).
+    Lines must be non-decreasing coordinates on the array upscaled by mesh_scale.
+    The sums are those of the nearest neighbor upscaled array,
+    without ever allocating it. See _row_band_sums for opaque_only.
+    """
+    lines_x, lines_y = mesh_lines
+    row_sums = _row_band_sums(values, lines_y, mesh_scale, opaque_only)
+    return _column_segment_sums(row_sums, lines_x, mesh_scale)
+
+
+def _cell_sizes(mesh_lines: Mesh) -> np.ndarray:
+    """Number of pixels in every cell of the mesh, shape (rows, columns)."""
+    lines_x, lines_y = mesh_lines
+    return np.outer(np.diff(lines_y), np.diff(lines_x))
+
+
+def _axis_segments(
+    lines: Lines, mesh_scale: int, size: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The overlaps of the pixels along one axis of an image with the segments
+    between consecutive lines on the image upscaled by mesh_scale.
+    Returns the pixel, the segment and the overlap in upscaled pixels of each,
+    sorted by segment. A pixel split by a line appears once for each side.
+    """
+    lines = np.asarray(lines, dtype=np.intp)
+    starts, ends = lines[:-1], lines[1:]
+    first_pixels = starts // mesh_scale
+    counts = np.maximum(-(-ends // mesh_scale) - first_pixels, 0)
+    segments = np.repeat(np.arange(len(counts)), counts)
+    steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pixels = first_pixels[segments] + steps
+    overlaps = np.minimum((pixels + 1) * mesh_scale, ends[segments]) - np.maximum(
+        pixels * mesh_scale, starts[segments]
+    )
+    keep = (pixels < size) & (overlaps > 0)
+    return pixels[keep], segments[keep], overlaps[keep]
+
+
+def _robust_cell_colors(
+    img_array: np.ndarray,
+    mesh_lines: Mesh,
+    mesh_scale: int,
+    cell_color: str,
+    alpha: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    colors.cell_colors of every cell of the mesh, shape (rows, columns, 3).
+    Each pixel is labeled with its cell and weighted by how many pixels of the
+    upscaled image it stands for, so the statistics are those of the upscaled image.
+    If alpha, a (height, width) array, is given, its transparent pixels are left out.
+    Runs of whole cell rows are labeled at a time to bound the memory used.
+    """
+    lines_x, lines_y = mesh_lines
+    num_rows, num_columns = len(lines_y) - 1, len(lines_x) - 1
+    height, width = img_array.shape[:2]
+    pixels_x, cells_x, weights_x = _axis_segments(lines_x, mesh_scale, width)
+    pixels_y, cells_y, weights_y = _axis_segments(lines_y, mesh_scale, height)
+
+    out = np.zeros((num_rows, num_columns, 3), dtype=np.uint8)
+    rows_per_chunk = max(1, CELLS_PER_CHUNK // max(num_columns, 1))
+    for first_row in range(0, num_rows, rows_per_chunk):
+        last_row = min(first_row + rows_per_chunk, num_rows)
+        lo, hi = np.searchsorted(cells_y, [first_row, last_row])
+        pixels = img_array[np.ix_(pixels_y[lo:hi], pixels_x)]
+        labels = (cells_y[lo:hi, np.newaxis] - first_row) * num_columns + cells_x
+        weights = weights_y[lo:hi, np.newaxis] * weights_x
+        if alpha is not None:
+            opaque = alpha[np.ix_(pixels_y[lo:hi], pixels_x)] >= colors.ALPHA_THRESHOLD
+            weights = weights * opaque
+        chunk = colors.cell_colors(
+            pixels[:, :, :3].reshape(-1, 3),
+            labels.ravel(),
+            weights.ravel(),
+            (last_row - first_row) * num_columns,
+            cell_color,
+        )
+        out[first_row:last_row] = chunk.reshape(-1, num_columns, 3)
+    return out
+
+
+def _uniform_cell_colors(
+    img_array: np.ndarray,
+    alpha: np.ndarray | None,
+    mesh_lines: Mesh,
+    mesh_scale: int,
+) -> np.ndarray:
+    """
+    RGBA color of every cell of the mesh when each cell is one color,
+    reading one pixel per cell. Cells whose alpha is below the threshold,
+    or empty ones, are transparent. alpha None means every pixel is opaque.
+    """
+    lines_x, lines_y = (np.asarray(lines, dtype=np.intp) for lines in mesh_lines)
+    cells = np.ix_(lines_y[:-1] // mesh_scale, lines_x[:-1] // mesh_scale)
+    visible = np.outer(np.diff(lines_y) > 0, np.diff(lines_x) > 0)
+    if alpha is not None:
+        visible &= alpha[cells] >= colors.ALPHA_THRESHOLD
+
+    out = np.zeros((*visible.shape, 4), dtype=np.uint8)
+    out[:, :, :3] = img_array[cells][:, :, :3]
+    out[visible, 3] = 255
+    out[~visible] = 0
+    return out
+
+
+@profiling.traced
+def downsample_array(
+    rgba: np.ndarray,
+    mesh_lines: Mesh,
+    mesh_scale: int = 1,
+    cell_color: str = "mean",
+    uniform_cells: bool = False,
+) -> np.ndarray:
+    """
+    downsample with skip_quantization=True of an (height, width, 4) uint8 array,
+    returning a (rows, columns, 4) uint8 array.
+    rgba is only read, so it may be a read-only view. Transparent pixels are
+    masked one band of cell rows at a time, so besides the output the memory
+    used is a few bands and the (rows, width, 4) int64 band sums.
+    """
+    if cell_color not in colors.CELL_COLORS:
+        raise ValueError(f"cell_color must be one of {colors.CELL_COLORS}")
+    if uniform_cells:
+        return _uniform_cell_colors(rgba, rgba[:, :, 3], mesh_lines, mesh_scale)
+
+    sums = _cell_sums(rgba, mesh_lines, mesh_scale, opaque_only=True)
+    color_sums, counts = sums[:, :, :3], sums[:, :, 3]
+    visible = ~colors._is_majority_transparent(counts, _cell_sizes(mesh_lines))
+
+    out = np.zeros((*counts.shape, 4), dtype=np.uint8)
+    if cell_color == "mean":
+        mean_colors = color_sums[visible] / counts[visible][:, np.newaxis]
+        out[visible, :3] = mean_colors.astype(np.uint8)
+    else:
+        cell_rgb = _robust_cell_colors(
+            rgba, mesh_lines, mesh_scale, cell_color, alpha=rgba[:, :, 3]
+        )
+        out[visible, :3] = cell_rgb[visible]
+    out[visible, 3] = 255
+    return out
+
+
+@profiling.traced
 def downsample(
     image: Image.Image,
     mesh_lines: Mesh,
     skip_quantization: bool = False,
     original_alpha: np.ndarray | None = None,
+    mesh_scale: int = 1,
+    cell_color: str = "mean",
+    uniform_cells: bool = False,
 ) -> Image.Image:
     """
-    Downsample the image by looping over each cell in mesh and
-    selecting a representative color for each cell.
+    Downsample the image by selecting a representative color for each cell in mesh.
+
+    Rather than looping over the cells, the color and opaque pixel sums of
+    every cell are computed at once with segment sums over the mesh lines,
+    then each cell's mean color and transparency are decided in one batch.
+    The result is identical to applying the per cell functions in colors.
 
     Transparency handling:
     - If >=50% of pixels in a cell are transparent, the entire cell becomes transparent (0,0,0,0)
@@ -29,55 +265,313 @@ def downsample(
     Args:
         image: The image to downsample (RGB if quantized, RGBA if not)
         mesh_lines: Tuple of (x_lines, y_lines) defining the pixel grid
-        skip_quantization: If True, use histogram-based color selection for RGBA
+        skip_quantization: If True, use the mean of the opaque pixels of the RGBA image
         original_alpha: Optional numpy array of alpha channel values from original
                        image. Used to preserve transparency through quantization.
                        Only used when skip_quantization=False.
+        mesh_scale: Factor of the upscaled image the mesh was computed on.
+                    Cells are read from the original image, with pixels split by a
+                    cell border weighted by how much of them falls in the cell,
+                    giving the same result as downsampling the upscaled image.
+        cell_color: Statistic of the pixels giving the color of a cell, one of
+                    colors.CELL_COLORS. 'mean' is exact and fastest, 'median', 'mode'
+                    and 'dominant' resist noise such as JPEG artifacts, and are
+                    computed for all cells at once by colors.cell_colors.
+        uniform_cells: If True, every cell is known to be a block of one color,
+                    as for a mesh from mesh.detect_exact_upscale. The color of each
+                    cell is read from its first pixel and cell_color is ignored.
 
     Returns:
         RGBA image with downsampled pixels
     """
-    lines_x, lines_y = mesh_lines
-    height_result, width_result = len(lines_y) - 1, len(lines_x) - 1
-
-    # Single conversion at start
+    if cell_color not in colors.CELL_COLORS:
+        raise ValueError(f"cell_color must be one of {colors.CELL_COLORS}")
     if skip_quantization:
-        img_array = np.array(image.convert("RGBA"))
+        rgba = image if image.mode == "RGBA" else image.convert("RGBA")
+        out = downsample_array(
+            np.asarray(rgba), mesh_lines, mesh_scale, cell_color, uniform_cells
+        )
+        return Image.fromarray(out, mode="RGBA")
+
+    img_array = np.asarray(image.convert("RGB"))
+    if uniform_cells:
+        out = _uniform_cell_colors(img_array, original_alpha, mesh_lines, mesh_scale)
+        return Image.fromarray(out, mode="RGBA")
+
+    sizes = _cell_sizes(mesh_lines)
+    color_sums = _cell_sums(img_array, mesh_lines, mesh_scale)
+    if original_alpha is not None:
+        opaque = (original_alpha >= colors.ALPHA_THRESHOLD)[:, :, np.newaxis]
+        opaque_counts = _cell_sums(opaque, mesh_lines, mesh_scale)[:, :, 0]
+        transparent = colors._is_majority_transparent(opaque_counts, sizes)
     else:
-        img_array = np.array(image.convert("RGB"))
+        transparent = sizes == 0
 
     # Output is RGBA to support transparency
-    out = np.zeros((height_result, width_result, 4), dtype=np.uint8)
-
-    for j, i in product(range(height_result), range(width_result)):
-        x0, x1 = lines_x[i], lines_x[i + 1]
-        y0, y1 = lines_y[j], lines_y[j + 1]
-        cell = img_array[y0:y1, x0:x1]
-
-        if skip_quantization:
-            # Skip quantization and use original colros
-            out[j, i] = colors.get_cell_color_skip_quantization(cell)
-        else:
-            # Get color from quantized cell, considering alpha from original
-            if original_alpha is not None:
-                cell_alpha = original_alpha[y0:y1, x0:x1]
-                out[j, i] = colors.get_cell_color_with_alpha(cell, cell_alpha)
-            else:
-                out[j, i] = colors.get_opaque_cell_color(cell)
+    out = np.zeros((*sizes.shape, 4), dtype=np.uint8)
+    visible = ~transparent
+    if cell_color == "mean":
+        mean_colors = color_sums[visible] / sizes[visible][:, np.newaxis]
+        out[visible, :3] = mean_colors.astype(np.uint8)
+    else:
+        # The transparent pixels would pull the color towards the background
+        cell_rgb = _robust_cell_colors(
+            img_array, mesh_lines, mesh_scale, cell_color, alpha=original_alpha
+        )
+        out[visible, :3] = cell_rgb[visible]
+    out[visible, 3] = 255
 
     return Image.fromarray(out, mode="RGBA")
 
 
+@profiling.traced
+def compute_mesh_cached(
+    image_rgba: Image.Image,
+    initial_upscale_factor: int | str,
+    pixel_width: int | None = None,
+    mesh_method: str = "hough",
+    intermediate_dir: Path | None = None,
+    cache: StageCache | None = None,
+    cache_key: str | None = None,
+    grid: mesh.KnownGrid | None = None,
+) -> tuple[Mesh, int]:
+    """
+    compute_mesh_with_scaling, looked up in and stored to the cache if one is given.
+    cache_key is computed from the image and parameters if not given.
+    With a known grid, its mesh is used as is and nothing is detected or cached.
+    Returns the mesh line coordinates and the scale factor used.
+    """
+    if grid is not None:
+        profiling.note(known_grid=True)
+        return grid.mesh_for(*image_rgba.size)
+
+    mesh_params = {
+        "initial_upscale_factor": initial_upscale_factor,
+        "pixel_width": pixel_width,
+        "mesh_method": mesh_method,
+    }
+    if cache is not None:
+        cache_key = cache_key or cache.key(image_rgba, **mesh_params)
+        stored = cache.get("mesh", cache_key)
+        profiling.note(cache_hit=stored is not None)
+        if stored is not None:
+            mesh_lines = stored["lines_x"].tolist(), stored["lines_y"].tolist()
+            return mesh_lines, int(stored["upscale_factor"])
+
+    mesh_lines, upscale_factor = mesh.compute_mesh_with_scaling(
+        image_rgba,
+        initial_upscale_factor,
+        output_dir=intermediate_dir,
+        pixel_width=pixel_width,
+        mesh_method=mesh_method,
+    )
+
+    if cache is not None:
+        lines_x, lines_y = mesh_lines
+        cache.put(
+            "mesh",
+            cache_key,
+            {
+                "lines_x": np.asarray(lines_x, dtype=np.int64),
+                "lines_y": np.asarray(lines_y, dtype=np.int64),
+                "upscale_factor": np.asarray(upscale_factor),
+            },
+        )
+    return mesh_lines, upscale_factor
+
+
+@profiling.traced
+def mesh_and_downsample(
+    image_rgba: Image.Image,
+    initial_upscale_factor: int | str,
+    pixel_width: int | None = None,
+    mesh_method: str = "hough",
+    intermediate_dir: Path | None = None,
+    cache: StageCache | None = None,
+    grid: mesh.KnownGrid | None = None,
+    cell_color: str = "mean",
+    exact_upscale: bool = True,
+) -> Image.Image:
+    """
+    Computes the mesh of image_rgba and downsamples it to one pixel per cell
+    with the cell_color statistic of the opaque pixels, before any quantization.
+    With a cache, a stored downsampled image skips both stages,
+    and a stored mesh skips mesh detection.
+    A known grid skips mesh detection, and the cache, altogether.
+    With exact_upscale, an exact nearest neighbor upscale is sliced back to its
+    cells without mesh detection, color selection or the cache.
+    """
+    if grid is None and exact_upscale:
+        exact_mesh = mesh.detect_exact_upscale(image_rgba)
+        if exact_mesh is not None:
+            return downsample(
+                image_rgba, exact_mesh, skip_quantization=True, uniform_cells=True
+            )
+
+    cache_key = downsample_key = None
+    if cache is not None and grid is None:
+        cache_key = cache.key(
+            image_rgba,
+            initial_upscale_factor=initial_upscale_factor,
+            pixel_width=pixel_width,
+            mesh_method=mesh_method,
+        )
+        # The mesh does not depend on cell_color, so only the downsample key does
+        downsample_key = (
+            cache_key if cell_color == "mean" else f"{cache_key}-{cell_color}"
+        )
+        stored = cache.get("downsample", downsample_key)
+        profiling.note(cache_hit=stored is not None)
+        if stored is not None:
+            return Image.fromarray(stored["pixels"], mode="RGBA")
+
+    mesh_lines, upscale_factor = compute_mesh_cached(
+        image_rgba,
+        initial_upscale_factor,
+        pixel_width=pixel_width,
+        mesh_method=mesh_method,
+        intermediate_dir=intermediate_dir,
+        cache=cache,
+        cache_key=cache_key,
+        grid=grid,
+    )
+
+    # Use the mean color to perfectly resemble original from afar
+    # The mesh is mapped back onto the original image rather than upscaling it
+    result = downsample(
+        image_rgba,
+        mesh_lines,
+        skip_quantization=True,
+        mesh_scale=upscale_factor,
+        cell_color=cell_color,
+    )
+
+    if downsample_key is not None:
+        cache.put("downsample", downsample_key, {"pixels": np.asarray(result)})
+    return result
+
+
+@profiling.traced
+def preprocess(
+    image: Image.Image,
+    transparent_background: bool = False,
+    remove_watermark: bool = False,
+    background_mode: str = "global",
+) -> Image.Image:
+    """
+    The RGBA image the mesh is detected in, see pixelate for the parameters.
+    The watermark and the background are removed in place in one RGBA array.
+    """
+    if not (transparent_background or remove_watermark):
+        return image.convert("RGBA")
+    rgba = np.array(image if image.mode == "RGBA" else image.convert("RGBA"))
+    _preprocess_in_place(
+        rgba, transparent_background, remove_watermark, background_mode
+    )
+    return Image.fromarray(rgba, mode="RGBA")
+
+
+def _preprocess_in_place(
+    rgba: np.ndarray,
+    transparent_background: bool,
+    remove_watermark: bool,
+    background_mode: str = "global",
+) -> None:
+    """The work of preprocess on a writable (height, width, 4) uint8 array."""
+    if remove_watermark:
+        utils.remove_generative_watermark_array(rgba)
+    if transparent_background:
+        # Pre-process transparency so background colors are excluded from mean downsampling
+        colors.make_background_transparent_array(
+            rgba, tolerance=40, background_mode=background_mode
+        )
+
+
+@profiling.traced
+def quantize(
+    result: Image.Image,
+    num_colors: int | str | None,
+    intermediate_dir: Path | None = None,
+    palette: Palette | None = None,
+    quantize_method: str = "maxcoverage",
+    sweep: quantizers.PaletteSweep | None = None,
+) -> Image.Image:
+    """
+    Quantize the tiny downsampled image to num_colors, keeping its alpha.
+    With a palette, its colors are mapped to the nearest palette color instead.
+    quantize_method is one of quantizers.QUANTIZE_METHODS.
+    num_colors 'auto' picks the elbow of the error curve of a quantizers.PaletteSweep,
+    the given sweep of result if any. The numpy methods then return the image of
+    the sweep, so the colors are clustered once, by its variance split median cut.
+    The PIL methods quantize again to the number picked, a second cheap pass.
+    """
+    if palette is not None:
+        return palette.apply(result)
+    if num_colors is None:
+        return result
+    if num_colors == quantizers.AUTO_COLORS:
+        sweep = sweep or quantizers.PaletteSweep(result)
+        num_colors = sweep.best_num_colors()
+        profiling.note(num_colors=num_colors)
+        if quantize_method not in quantizers.PIL_METHODS:
+            result = sweep.image(num_colors)
+            if intermediate_dir is not None:
+                result.save(intermediate_dir / "quantized_original.png")
+            return result
+    if quantize_method not in quantizers.PIL_METHODS:
+        quantized = quantizers.quantize_array(
+            np.asarray(result.convert("RGBA")), num_colors, quantize_method
+        )
+        result = Image.fromarray(quantized, mode="RGBA")
+        if intermediate_dir is not None:
+            result.save(intermediate_dir / "quantized_original.png")
+        return result
+    # Save alpha of the tiny image
+    small_alpha = result.split()[3]
+    result = colors.palette_img(
+        result,
+        num_colors=num_colors,
+        quantize_method=quantizers.PIL_METHODS[quantize_method],
+        output_dir=intermediate_dir,
+    )
+    result = result.convert("RGBA")
+    result.putalpha(small_alpha)
+    return result
+
+
+@profiling.traced
+def finish(
+    result: Image.Image, trim: bool = False, scale_result: int | None = None
+) -> Image.Image:
+    """Trim transparent borders and upscale the final image if requested."""
+    if trim:
+        result = utils.trim_transparent(result)
+
+    if scale_result is not None:
+        result = utils.scale_img(result, int(scale_result))
+
+    return result
+
+
+@profiling.traced
 def pixelate(
     image: Image.Image,
-    num_colors: int | None = None,
-    initial_upscale_factor: int = 2,
+    num_colors: int | str | None = None,
+    initial_upscale_factor: int | str = 2,
     scale_result: int | None = None,
     transparent_background: bool = False,
     intermediate_dir: Path | None = None,
     pixel_width: int | None = None,
     remove_watermark: bool = False,
     trim: bool = False,
+    mesh_method: str = "hough",
+    cache: StageCache | None = None,
+    grid: mesh.KnownGrid | None = None,
+    cell_color: str = "mean",
+    exact_upscale: bool = True,
+    background_mode: str = "global",
+    palette: Palette | None = None,
+    quantize_method: str = "maxcoverage",
 ) -> Image.Image:
     """
     Computes the true resolution pixel art image.
@@ -90,61 +584,203 @@ def pixelate(
         This is an important parameter to tune,
         if it is too high, pixels that should be the same color will be different colors
         if it is too low, pixels that should be different colors will be the same color
+        'auto' picks it at the elbow of the quantization error, see quantizers.PaletteSweep.
     - scale_result:
         Upsample result by scale_result factor after algorithm is complete if not None.
     - initial_upscale_factor:
         Upsample original image by this factor. It may help detect lines.
+        'auto' chooses it from a quick estimate of the pixel width,
+        skipping the upscale when the pixels are wide or there is no grid.
     - transparent_background:
         If True, makes pixels matching the most common boundary color transparent.
         Applied after preserving original image transparency.
+    - background_mode:
+        Which matching pixels transparent_background keys out. 'global' keys out
+        every one of them, 'connected' only those connected to the boundary through
+        other matching pixels, keeping the background color inside sprites.
     - intermediate_dir:
         directory to save images visualizing intermediate steps.
     - pixel_width:
         If set, skips the step to automatically identify pixel width and uses this value.
+    - mesh_method:
+        'hough' detects the mesh with Canny edges and the Hough transform on the upscaled image.
+        'spectral' estimates the pixel width and phase from the periodicity of the image
+        gradients, which is faster and needs no upscaling.
+    - cache:
+        If set, the mesh and the downsampled image are stored in and reused from this
+        on disk cache. They do not depend on num_colors, trim or scale_result,
+        so changing only those skips mesh detection and downsampling.
+    - grid:
+        If set, a mesh.GridSpec of the known cell size and offset, or a mesh.FixedMesh
+        e.g. from mesh.load_mesh, used instead of detecting the mesh.
+        pixel_width, initial_upscale_factor and mesh_method are then ignored.
+    - cell_color:
+        How the color of each cell is chosen from its opaque pixels.
+        'mean' resembles the original best from afar. 'median', 'mode' (the most
+        frequent exact color) and 'dominant' (the median of the densest color
+        cluster) ignore outliers, for noisy inputs such as JPEGs.
+    - exact_upscale:
+        If True, first check whether the image is a clean nearest neighbor upscale,
+        such as a re-uploaded sprite, where every cell is a block of identical pixels.
+        Its cells are then read directly, skipping mesh detection. Images with any
+        noise are rejected after comparing a few rows and columns.
+    - palette:
+        If set, a palette.Palette the colors are mapped to instead of quantizing
+        to num_colors, e.g. one fitted to a whole batch so all results share it.
+    - quantize_method:
+        How the colors are reduced to num_colors. 'maxcoverage' and 'fastoctree'
+        use PIL on the image with its transparent pixels filled in. 'median_cut' and
+        'kmeans' cluster only the opaque colors in the Oklab color space with numpy,
+        'kmeans' refining the median cut boxes with a few k-means iterations.
 
     Returns the true pixelated image.
     """
-    if remove_watermark:
-        image = utils.remove_generative_watermark(image)
-
-    image_rgba = image.convert("RGBA")
-
-    if transparent_background:
-        # Pre-process transparency so background colors are excluded from mean downsampling
-        image_rgba = colors.make_background_transparent(image_rgba, tolerance=40)
+    image_rgba = preprocess(
+        image, transparent_background, remove_watermark, background_mode
+    )
 
-    # Calculate the pixel mesh lines
-    mesh_lines, upscale_factor = mesh.compute_mesh_with_scaling(
+    # Calculate the pixel mesh lines and downsample the image to 1 pixel per cell in the mesh
+    result = mesh_and_downsample(
         image_rgba,
         initial_upscale_factor,
-        output_dir=intermediate_dir,
         pixel_width=pixel_width,
+        mesh_method=mesh_method,
+        intermediate_dir=intermediate_dir,
+        cache=cache,
+        grid=grid,
+        cell_color=cell_color,
+        exact_upscale=exact_upscale,
     )
 
-    # Scale the original image up to match the dimensions for the calculated mesh
-    scaled_img = utils.scale_img(image_rgba, upscale_factor)
-
-    # Downsample the image to 1 pixel per cell in the mesh using Mean color to perfectly resemble original from afar
-    result = downsample(
-        scaled_img,
-        mesh_lines,
-        skip_quantization=True,
+    # Process colors: Quantize the tiny downscaled image if requested
+    result = quantize(
+        result,
+        num_colors,
+        intermediate_dir=intermediate_dir,
+        palette=palette,
+        quantize_method=quantize_method,
     )
+    return finish(result, trim, scale_result)
 
-    # Process colors: Quantize the tiny downscaled image if requested
-    if num_colors is not None:
-        # Save alpha of the tiny image
-        small_alpha = result.split()[3]
-        result = colors.palette_img(
-            result, num_colors=num_colors, output_dir=intermediate_dir
+
+def _rgba_array(array: np.ndarray | memoryview) -> np.ndarray:
+    """
+    An (height, width, 4) uint8 array of the pixels of array, without copying them
+    unless array is (height, width, 3), which gets an opaque alpha channel.
+    """
+    rgba = np.asarray(array)
+    if rgba.dtype != np.uint8 or rgba.ndim != 3 or rgba.shape[2] not in (3, 4):
+        raise ValueError(
+            "Expected an (height, width, 4) or (height, width, 3) uint8 array, "
+            f"got a {rgba.dtype} array of shape {rgba.shape}"
         )
-        result = result.convert("RGBA")
-        result.putalpha(small_alpha)
+    if rgba.shape[2] == 3:
+        rgb = rgba
+        rgba = np.empty((*rgb.shape[:2], 4), dtype=np.uint8)
+        rgba[:, :, :3] = rgb
+        rgba[:, :, 3] = 255
+    return rgba
 
-    if trim:
-        result = utils.trim_transparent(result)
 
-    if scale_result is not None:
-        result = utils.scale_img(result, int(scale_result))
+def _image_view(rgba: np.ndarray) -> Image.Image:
+    """An RGBA PIL image sharing the memory of rgba, which is copied only if not contiguous."""
+    rgba = np.ascontiguousarray(rgba)
+    height, width = rgba.shape[:2]
+    return Image.frombuffer("RGBA", (width, height), rgba, "raw", "RGBA", 0, 1)
 
-    return result
+
+@profiling.traced
+def preprocess_array(
+    array: np.ndarray | memoryview,
+    transparent_background: bool = False,
+    remove_watermark: bool = False,
+    background_mode: str = "global",
+) -> np.ndarray:
+    """
+    preprocess for an (height, width, 4) or (height, width, 3) uint8 array.
+    The pixels are only copied if they are changed, once, and then changed in place,
+    so the result is either a view of array or a single new frame.
+    """
+    rgba = _rgba_array(array)
+    if not (transparent_background or remove_watermark):
+        return rgba
+    # RGB input already has a new frame from adding the alpha channel
+    working = rgba.copy() if np.may_share_memory(rgba, np.asarray(array)) else rgba
+    _preprocess_in_place(
+        working, transparent_background, remove_watermark, background_mode
+    )
+    return working
+
+
+@profiling.traced
+def pixelate_array(
+    array: np.ndarray | memoryview,
+    num_colors: int | str | None = None,
+    initial_upscale_factor: int | str = 2,
+    scale_result: int | None = None,
+    transparent_background: bool = False,
+    pixel_width: int | None = None,
+    remove_watermark: bool = False,
+    trim: bool = False,
+    mesh_method: str = "hough",
+    grid: mesh.KnownGrid | None = None,
+    cell_color: str = "mean",
+    exact_upscale: bool = True,
+    background_mode: str = "global",
+    palette: Palette | None = None,
+    quantize_method: str = "maxcoverage",
+) -> np.ndarray:
+    """
+    pixelate for pixels in an array rather than a PIL image, with the same parameters.
+    inputs:
+    - array:
+        An (height, width, 4) uint8 RGBA array, or (height, width, 3) for RGB.
+        Any object numpy can view as one works, including read-only arrays and
+        memoryviews of shared memory. It is never written to.
+
+    Returns the true pixelated image as a new (rows, columns, 4) uint8 array.
+
+    The frame is never converted or copied for mesh detection or downsampling:
+    mesh detection reads it through a PIL image sharing its memory, and downsampling
+    masks transparent pixels one band of cells at a time. Measured in frames of
+    the input (4 bytes per pixel), the peak of numpy buffers beyond the input is:
+    - about 1 for the pipeline itself, the one copy made if transparent_background
+      or remove_watermark change the pixels, or for RGB and non-contiguous input
+    - about 2 more while the Hough method runs at initial_upscale_factor 2,
+      for its greyscale and edge images of the upscaled frame
+    - about 1 more for the spectral method, for its greyscale image and gradients
+    - under 1 more for the pyramid method, and for exact upscales or a known grid
+      with mean cell colors, which skip mesh detection
+    So a 2 frame budget holds whenever the pixels are not copied, and with a
+    known grid or an exact upscale either way.
+    PIL temporaries of mesh detection are not counted.
+    Use the pixelate function for the cache and intermediate_dir.
+    """
+    rgba = preprocess_array(
+        array, transparent_background, remove_watermark, background_mode
+    )
+    height, width = rgba.shape[:2]
+
+    uniform_cells = False
+    if grid is not None:
+        mesh_lines, upscale_factor = grid.mesh_for(width, height)
+    elif exact_upscale and (exact_mesh := mesh.detect_exact_upscale(rgba)) is not None:
+        mesh_lines, upscale_factor, uniform_cells = exact_mesh, 1, True
+    else:
+        mesh_lines, upscale_factor = mesh.compute_mesh_with_scaling(
+            _image_view(rgba),
+            initial_upscale_factor,
+            pixel_width=pixel_width,
+            mesh_method=mesh_method,
+        )
+
+    small = downsample_array(
+        rgba, mesh_lines, upscale_factor, cell_color, uniform_cells
+    )
+    result = quantize(
+        Image.fromarray(small, mode="RGBA"),
+        num_colors,
+        palette=palette,
+        quantize_method=quantize_method,
+    )
+    return np.array(finish(result, trim, scale_result))
@@ -0,0 +1,209 @@
+"""Per-stage timing and memory tracing of the pixelation pipeline"""
+
+import functools
+import json
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import IO, Any
+
+import numpy as np
+from PIL import Image
+
+_active_tracer: ContextVar["Tracer | None"] = ContextVar("tracer", default=None)
+
+
+@dataclass
+class StageRecord:
+    """
+    Measurements of one run of a stage.
+    - stage: Name of the stage
+    - parent: Name of the enclosing stage, None at the top level
+    - depth: Nesting depth, 0 at the top level
+    - wall_s: Elapsed wall clock time in seconds
+    - cpu_s: CPU time of the calling thread in seconds
+    - peak_bytes: Peak memory allocated above the start of the stage,
+        None unless the tracer traces memory
+    - info: Sizes of the stage's input and output and other notes
+    """
+
+    stage: str
+    parent: str | None = None
+    depth: int = 0
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    peak_bytes: int | None = None
+    info: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class _Frame:
+    record: StageRecord
+    start_bytes: int = 0
+    peak_abs: int = 0
+
+
+class Tracer:
+    """
+    Records a StageRecord for every traced stage run while the tracer is active.
+
+    with Tracer() as tracer:
+        pixelate(image)
+    tracer.write_jsonl("trace.jsonl")
+
+    A tracer is active in the context it was entered in, so it also follows
+    into asyncio tasks but not into other threads or processes.
+    With memory=True, peak allocations are measured with tracemalloc, which
+    slows the pipeline down and counts the allocations of every thread.
+    """
+
+    def __init__(self, memory: bool = True, **context):
+        self.memory = memory
+        self.context = context
+        self.records: list[StageRecord] = []
+        self._stack: list[_Frame] = []
+        self._token = None
+        self._started_tracemalloc = False
+
+    def __enter__(self) -> "Tracer":
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._token = _active_tracer.set(self)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        _active_tracer.reset(self._token)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    @contextmanager
+    def stage(self, name: str, **info) -> Iterator[StageRecord]:
+        """Measure the enclosed block as a stage named name."""
+        parent = self._stack[-1] if self._stack else None
+        record = StageRecord(
+            stage=name,
+            parent=parent.record.stage if parent else None,
+            depth=len(self._stack),
+            info=info,
+        )
+        frame = _Frame(record)
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if parent is not None:
+                parent.peak_abs = max(parent.peak_abs, peak)
+            tracemalloc.reset_peak()
+            frame.start_bytes = frame.peak_abs = current
+        self._stack.append(frame)
+        # Records are kept in the order the stages started
+        self.records.append(record)
+
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield record
+        finally:
+            record.cpu_s = time.thread_time() - cpu_start
+            record.wall_s = time.perf_counter() - wall_start
+            self._stack.pop()
+            if self.memory:
+                frame.peak_abs = max(frame.peak_abs, tracemalloc.get_traced_memory()[1])
+                record.peak_bytes = frame.peak_abs - frame.start_bytes
+                tracemalloc.reset_peak()
+                if parent is not None:
+                    parent.peak_abs = max(parent.peak_abs, frame.peak_abs)
+
+    def note(self, **info) -> None:
+        """Add info to the innermost running stage."""
+        if self._stack:
+            self._stack[-1].record.info.update(info)
+
+    def to_dicts(self) -> list[dict]:
+        """The records as flat dicts, with the tracer's context in each."""
+        rows = []
+        for record in self.records:
+            row = {**self.context, **asdict(record)}
+            row.update(row.pop("info"))
+            rows.append(row)
+        return rows
+
+    def write_jsonl(self, file: Path | str | IO[str]) -> None:
+        """Append the records as JSON lines to a path or an open text file."""
+        if isinstance(file, (str, Path)):
+            with open(file, "a", encoding="utf-8") as handle:
+                self.write_jsonl(handle)
+            return
+        for row in self.to_dicts():
+            file.write(json.dumps(row, default=str) + "\n")
+
+    def summary(self) -> str:
+        """A table of the stages in the order they started, indented by depth."""
+        lines = [f"{'stage':<32}{'wall ms':>10}{'cpu ms':>10}{'peak MiB':>10}"]
+        for record in self.records:
+            peak = (
+                f"{record.peak_bytes / 2**20:>10.1f}"
+                if record.peak_bytes is not None
+                else f"{'-':>10}"
+            )
+            name = "  " * record.depth + record.stage
+            lines.append(
+                f"{name:<32}{record.wall_s * 1e3:>10.1f}{record.cpu_s * 1e3:>10.1f}{peak}"
+            )
+        return "\n".join(lines)
+
+
+def active_tracer() -> Tracer | None:
+    """The tracer active in the current context, if any."""
+    return _active_tracer.get()
+
+
+@contextmanager
+def stage(name: str, **info) -> Iterator[StageRecord | None]:
+    """Measure the enclosed block with the active tracer, does nothing without one."""
+    tracer = _active_tracer.get()
+    if tracer is None:
+        yield None
+        return
+    with tracer.stage(name, **info) as record:
+        yield record
+
+
+def note(**info) -> None:
+    """Add info to the innermost running stage of the active tracer, if any."""
+    tracer = _active_tracer.get()
+    if tracer is not None:
+        tracer.note(**info)
+
+
+def size_of(value: Any) -> list[int] | None:
+    """Shape of an array, or height, width and bands of an image, for stage info."""
+    if isinstance(value, np.ndarray):
+        return list(value.shape)
+    if isinstance(value, Image.Image):
+        return [value.height, value.width, len(value.getbands())]
+    return None
+
+
+def traced(func: Callable) -> Callable:
+    """Run func as a stage named after it, with the sizes of its first argument and result."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        tracer = _active_tracer.get()
+        if tracer is None:
+            return func(*args, **kwargs)
+        info = {}
+        if args and (size := size_of(args[0])) is not None:
+            info["input_size"] = size
+        with tracer.stage(func.__name__, **info) as record:
+            result = func(*args, **kwargs)
+            if (size := size_of(result)) is not None:
+                record.info["output_size"] = size
+        return result
+
+    return wrapper
@@ -0,0 +1,360 @@
+"""Vectorized color quantizers for the small downsampled image, working in Oklab"""
+
+import numpy as np
+from PIL import Image
+from PIL.Image import Quantize
+
+from proper_pixel_art import colors, profiling
+
+# PIL methods are run by colors.palette_img, the others in this module
+PIL_METHODS = {"maxcoverage": Quantize.MAXCOVERAGE, "fastoctree": Quantize.FASTOCTREE}
+QUANTIZE_METHODS = (*PIL_METHODS, "median_cut", "kmeans")
+KMEANS_ITERATIONS = 8
+# num_colors that picks the number of colors from a PaletteSweep
+AUTO_COLORS = "auto"
+# Most colors AUTO_COLORS picks, as on the slider of the web interface
+AUTO_MAX_COLORS = 64
+# Colors compared with every centroid at once during k-means
+COLORS_PER_CHUNK = 4096
+
+_LMS_FROM_LINEAR = np.array(
+    [
+        [0.4122214708, 0.5363325363, 0.0514459929],
+        [0.2119034982, 0.6806995451, 0.1073969566],
+        [0.0883024619, 0.2817188376, 0.6299787005],
+    ]
+)
+_OKLAB_FROM_LMS = np.array(
+    [
+        [0.2104542553, 0.7936177850, -0.0040720468],
+        [1.9779984951, -2.4285922050, 0.4505937099],
+        [0.0259040371, 0.7827717662, -0.8086757660],
+    ]
+)
+_LMS_FROM_OKLAB = np.linalg.inv(_OKLAB_FROM_LMS)
+_LINEAR_FROM_LMS = np.linalg.inv(_LMS_FROM_LINEAR)
+
+
+def srgb_to_oklab(rgb: np.ndarray) -> np.ndarray:
+    """Oklab coordinates of an (..., 3) uint8 sRGB array, as float64."""
+    srgb = rgb.astype(np.float64) / 255
+    linear = np.where(srgb <= 0.04045, srgb / 12.92, ((srgb + 0.055) / 1.055) ** 2.4)
+    return np.cbrt(linear @ _LMS_FROM_LINEAR.T) @ _OKLAB_FROM_LMS.T
+
+
+def oklab_to_srgb(lab: np.ndarray) -> np.ndarray:
+    """The (..., 3) uint8 sRGB colors of Oklab coordinates, clipped to the gamut."""
+    linear = (lab @ _LMS_FROM_OKLAB.T) ** 3 @ _LINEAR_FROM_LMS.T
+    linear = np.clip(linear, 0, 1)
+    srgb = np.where(
+        linear <= 0.0031308, 12.92 * linear, 1.055 * linear ** (1 / 2.4) - 0.055
+    )
+    return np.rint(srgb * 255).astype(np.uint8)
+
+
+def _weighted_sse(lab: np.ndarray, weights: np.ndarray) -> tuple[float, int]:
+    """The weighted squared error of colors around their mean, and the axis of most spread."""
+    if len(lab) < 2:
+        return 0.0, 0
+    mean = np.average(lab, axis=0, weights=weights)
+    spread = (weights[:, None] * (lab - mean) ** 2).sum(axis=0)
+    return float(spread.sum()), int(np.argmax(spread))
+
+
+def median_cut(lab: np.ndarray, weights: np.ndarray, num_colors: int) -> np.ndarray:
+    """
+    The box of each color after median cut to at most num_colors boxes.
+    The box with the largest weighted squared error is split at the weighted median
+    of its axis of most spread, until there are num_colors boxes or every box
+    holds a single color.
+    """
+    return median_cut_tree(lab, weights, num_colors)[0]
+
+
+def median_cut_tree(
+    lab: np.ndarray, weights: np.ndarray, num_colors: int, variance_split: bool = False
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    median_cut, also returning the order of its splits: box j was split off box
+    parents[j] by split j, and parents[0] is -1. The boxes after the first k - 1
+    splits are found by merging every box j >= k back into its parent, last first.
+    With variance_split, boxes are split where the two halves have the least total
+    squared error instead of at the median, so clusters are kept whole.
+    """
+    boxes = [np.arange(len(lab))]
+    parents = [-1]
+    errors = [_weighted_sse(lab, weights)]
+    while len(boxes) < num_colors:
+        index = max(range(len(boxes)), key=lambda i: errors[i][0])
+        error, axis = errors[index]
+        if error == 0:
+            break
+        members = boxes[index]
+        members = members[np.argsort(lab[members, axis], kind="stable")]
+        cumulative = np.cumsum(weights[members])
+        if variance_split:
+            cut = _least_squares_cut(lab[members], weights[members])
+        else:
+            cut = int(np.searchsorted(cumulative, cumulative[-1] / 2)) + 1
+        cut = min(max(cut, 1), len(members) - 1)
+        boxes[index] = members[:cut]
+        boxes.append(members[cut:])
+        parents.append(index)
+        errors[index] = _weighted_sse(lab[boxes[index]], weights[boxes[index]])
+        errors.append(_weighted_sse(lab[boxes[-1]], weights[boxes[-1]]))
+    labels = np.empty(len(lab), dtype=np.intp)
+    for label, members in enumerate(boxes):
+        labels[members] = label
+    return labels, np.array(parents, dtype=np.intp)
+
+
+def _least_squares_cut(lab: np.ndarray, weights: np.ndarray) -> int:
+    """
+    The cut of sorted colors into lab[:cut] and lab[cut:] with the least total
+    weighted squared error, from prefix sums of the weights, colors and squares.
+    """
+    weight = np.cumsum(weights)[:-1]
+    sums = np.cumsum(weights[:, None] * lab, axis=0)
+    squares = np.cumsum(weights * (lab * lab).sum(axis=1))
+    left = squares[:-1] - (sums[:-1] ** 2).sum(axis=1) / np.maximum(weight, 1e-12)
+    right_weight = weight[-1] + weights[-1] - weight
+    right_sums = sums[-1] - sums[:-1]
+    right = (squares[-1] - squares[:-1]) - (right_sums**2).sum(axis=1) / np.maximum(
+        right_weight, 1e-12
+    )
+    return int(np.argmin(left + right)) + 1
+
+
+def _nearest(lab: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """The index of the nearest centroid of each color."""
+    # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, where |x|^2 does not change the nearest c
+    scale = -2 * centroids.T
+    offset = (centroids * centroids).sum(axis=1)
+    labels = np.empty(len(lab), dtype=np.intp)
+    for start in range(0, len(lab), COLORS_PER_CHUNK):
+        chunk = lab[start : start + COLORS_PER_CHUNK]
+        labels[start : start + len(chunk)] = np.argmin(chunk @ scale + offset, axis=1)
+    return labels
+
+
+def _centroids(
+    lab: np.ndarray, weights: np.ndarray, labels: np.ndarray, num_labels: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """The weighted mean color of each label, and the total weight of each label."""
+    totals = np.bincount(labels, weights, minlength=num_labels)
+    sums = np.stack(
+        [
+            np.bincount(labels, weights * lab[:, axis], minlength=num_labels)
+            for axis in range(3)
+        ],
+        axis=1,
+    )
+    return sums / np.maximum(totals, 1e-12)[:, None], totals
+
+
+def kmeans(
+    lab: np.ndarray,
+    weights: np.ndarray,
+    num_colors: int,
+    iterations: int = KMEANS_ITERATIONS,
+) -> np.ndarray:
+    """
+    The cluster of each color after weighted k-means, started from the boxes of
+    median_cut so it is deterministic. Stops early once no color changes cluster.
+    """
+    labels = median_cut(lab, weights, num_colors)
+    num_labels = int(labels.max()) + 1
+    centroids, _ = _centroids(lab, weights, labels, num_labels)
+    for _ in range(iterations):
+        new_labels = _nearest(lab, centroids)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        updated, totals = _centroids(lab, weights, labels, num_labels)
+        # Empty clusters keep their centroid
+        centroids = np.where(totals[:, None] > 0, updated, centroids)
+    return labels
+
+
+def _unique_colors(rgb: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The unique colors of an (n, 3) uint8 array, the index of the unique color of
+    each input color, and the number of times each unique color occurs, as float64.
+    """
+    packed = (
+        (rgb[:, 0].astype(np.uint32) << 16)
+        | (rgb[:, 1].astype(np.uint32) << 8)
+        | rgb[:, 2]
+    )
+    values, inverse, counts = np.unique(packed, return_inverse=True, return_counts=True)
+    unique_rgb = np.stack(
+        [(values >> 16) & 0xFF, (values >> 8) & 0xFF, values & 0xFF], axis=1
+    ).astype(np.uint8)
+    return unique_rgb, inverse.ravel(), counts.astype(np.float64)
+
+
+@profiling.traced
+def fit_colors(
+    rgb: np.ndarray, num_colors: int, method: str = "kmeans"
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    At most num_colors colors for an (n, 3) uint8 array of colors, with method
+    'median_cut' or 'kmeans' run on the unique colors in Oklab, weighted by their counts.
+    Returns the (colors, 3) uint8 palette, most used first, and the index of the
+    palette color of each input color. Inputs with few enough colors keep them exactly.
+    """
+    if method not in ("median_cut", "kmeans"):
+        raise ValueError(f"method must be 'median_cut' or 'kmeans', not {method!r}")
+    unique_rgb, inverse, weights = _unique_colors(rgb)
+    if len(unique_rgb) <= num_colors:
+        labels = np.arange(len(unique_rgb))
+        palette = unique_rgb
+    else:
+        lab = srgb_to_oklab(unique_rgb)
+        cluster = median_cut if method == "median_cut" else kmeans
+        labels = cluster(lab, weights, num_colors)
+        centroids, _ = _centroids(lab, weights, labels, int(labels.max()) + 1)
+        palette = oklab_to_srgb(centroids)
+
+    totals = np.bincount(labels, weights, minlength=len(palette))
+    order = np.argsort(-totals, kind="stable")
+    order = order[totals[order] > 0]
+    rank = np.empty(len(palette), dtype=np.intp)
+    rank[order] = np.arange(len(order))
+    profiling.note(unique_colors=len(unique_rgb), num_colors=len(order))
+    return palette[order], rank[labels][inverse]
+
+
+@profiling.traced
+def quantize_array(
+    rgba: np.ndarray,
+    num_colors: int,
+    method: str = "kmeans",
+    alpha_threshold: int = colors.ALPHA_THRESHOLD,
+) -> np.ndarray:
+    """
+    A copy of an RGBA array with its opaque pixels quantized to at most num_colors
+    colors by fit_colors. Pixels with alpha below alpha_threshold are left as they are
+    and do not count, so no background color needs to be chosen for them.
+    """
+    result = np.array(rgba, dtype=np.uint8)
+    opaque = result[:, :, 3] >= alpha_threshold
+    if not opaque.any():
+        return result
+    palette, indices = fit_colors(result[opaque][:, :3], num_colors, method)
+    result[opaque, :3] = palette[indices]
+    return result
+
+
+class PaletteSweep:
+    """
+    The quantized image for every number of colors, from a single clustering.
+    The opaque colors of the image are split once by median_cut_tree in Oklab, with
+    variance_split, into
+    up to max_colors boxes. The boxes for k colors are those of the first k - 1
+    splits, so the palette, the error and the image for any k are read from
+    per box sums in O(pixels), without clustering again.
+
+    sweep = PaletteSweep(downsampled)
+    sweep.image(8), sweep.image(16)  # quantized images
+    sweep.errors[k - 1]              # mean squared Oklab error with k colors
+    sweep.best_num_colors()          # the elbow of the error curve
+    """
+
+    def __init__(
+        self,
+        image: Image.Image,
+        max_colors: int = AUTO_MAX_COLORS,
+        alpha_threshold: int = colors.ALPHA_THRESHOLD,
+    ):
+        self._rgba = np.array(image.convert("RGBA"))
+        self._opaque = self._rgba[:, :, 3] >= alpha_threshold
+        unique_rgb, inverse, weights = _unique_colors(self._rgba[self._opaque][:, :3])
+        if len(unique_rgb) == 0:
+            unique_rgb, weights = np.zeros((1, 3), np.uint8), np.zeros(1)
+        lab = srgb_to_oklab(unique_rgb)
+        with profiling.stage("median_cut_tree", unique_colors=len(unique_rgb)):
+            boxes, self._parents = median_cut_tree(
+                lab, weights, max_colors, variance_split=True
+            )
+        self.max_colors = len(self._parents)
+        self._pixel_boxes = boxes[inverse]
+        self._box_weights = np.bincount(boxes, weights, minlength=self.max_colors)
+        self._box_sums = np.stack(
+            [
+                np.bincount(boxes, weights * lab[:, axis], minlength=self.max_colors)
+                for axis in range(3)
+            ],
+            axis=1,
+        )
+        self._box_squares = np.bincount(
+            boxes, weights * (lab * lab).sum(axis=1), minlength=self.max_colors
+        )
+        total = max(weights.sum(), 1.0)
+        self.errors = np.array(
+            [
+                self._squared_error(self._merged(k)) / total
+                for k in range(1, self.max_colors + 1)
+            ]
+        )
+
+    def _merged(self, num_colors: int) -> np.ndarray:
+        """The box with num_colors boxes that each of the finest boxes belongs to."""
+        merged = np.arange(self.max_colors)
+        for box in range(num_colors, self.max_colors):
+            merged[box] = merged[self._parents[box]]
+        return merged
+
+    def _totals(self, merged: np.ndarray) -> tuple[np.ndarray, ...]:
+        """The total weight, weighted Oklab sum and weighted sum of squares per box."""
+        num_boxes = int(merged.max()) + 1
+        weights = np.bincount(merged, self._box_weights, minlength=num_boxes)
+        sums = np.stack(
+            [
+                np.bincount(merged, self._box_sums[:, axis], minlength=num_boxes)
+                for axis in range(3)
+            ],
+            axis=1,
+        )
+        squares = np.bincount(merged, self._box_squares, minlength=num_boxes)
+        return weights, sums, squares
+
+    def _squared_error(self, merged: np.ndarray) -> float:
+        weights, sums, squares = self._totals(merged)
+        used = weights > 0
+        spread = squares[used] - (sums[used] ** 2).sum(axis=1) / weights[used]
+        return float(max(spread.sum(), 0.0))
+
+    def _centroids(self, num_colors: int) -> tuple[np.ndarray, np.ndarray]:
+        """The merged box of each finest box, and the sRGB mean color of each box."""
+        num_colors = min(max(num_colors, 1), self.max_colors)
+        merged = self._merged(num_colors)
+        weights, sums, _ = self._totals(merged)
+        return merged, oklab_to_srgb(sums / np.maximum(weights, 1e-12)[:, None])
+
+    def palette(self, num_colors: int) -> np.ndarray:
+        """The (colors, 3) uint8 palette with num_colors colors, most used first."""
+        merged, centroids = self._centroids(num_colors)
+        weights = self._totals(merged)[0]
+        return centroids[np.argsort(-weights, kind="stable")]
+
+    def image(self, num_colors: int) -> Image.Image:
+        """The image quantized to num_colors colors, transparent pixels unchanged."""
+        merged, centroids = self._centroids(num_colors)
+        result = self._rgba.copy()
+        result[self._opaque, :3] = centroids[merged[self._pixel_boxes]]
+        return Image.fromarray(result, mode="RGBA")
+
+    def best_num_colors(self) -> int:
+        """
+        The number of colors at the elbow of the error curve: the one furthest below
+        the chord from 1 to max_colors colors, with both axes scaled to [0, 1].
+        Noisy colors around a few distinct ones give a sharp elbow at their number.
+        Many colors that are far apart and used evenly have no elbow, so set a number
+        for those instead.
+        """
+        if self.max_colors <= 2 or self.errors[0] == self.errors[-1]:
+            return self.max_colors
+        x = np.linspace(0, 1, self.max_colors)
+        y = (self.errors - self.errors[-1]) / (self.errors[0] - self.errors[-1])
+        return int(np.argmax(1 - x - y)) + 1
@@ -0,0 +1,473 @@
+"""
+Local pixelation server with a pool of warm worker processes, started by 'ppa serve'.
+Jobs are queued with backpressure: at most max_inflight run in the pool at once,
+at most max_queued wait for a slot, and any more are turned away with 503.
+"""
+
+import argparse
+import contextlib
+import io
+import ipaddress
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import Executor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from PIL import Image
+
+from proper_pixel_art import animation, batch, cli, client, mesh, pixelate
+from proper_pixel_art.palette import Palette
+from proper_pixel_art.session import DEFAULT_PARAMS, PixelationSession
+
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_MAX_QUEUED = 32
+# Largest request body accepted, in bytes
+MAX_BODY_BYTES = 64 * 2**20
+
+
+class ServerBusy(Exception):
+    """The queue of the server is full."""
+
+
+def _warm() -> int:
+    """A no-op task that makes the pool start a worker process."""
+    return os.getpid()
+
+
+def _pixelate_bytes(data: bytes, params: dict) -> bytes:
+    """The PNG bytes of the image file data pixelated with params."""
+    with Image.open(io.BytesIO(data)) as image:
+        result = pixelate.pixelate(image, **params)
+    output = io.BytesIO()
+    result.save(output, format="PNG")
+    return output.getvalue()
+
+
+def _run_file(input_path: Path, out_path: Path, params: dict) -> list[str]:
+    """Pixelate one file like the ppa command does. Returns the messages to print."""
+    messages = []
+    with Image.open(input_path) as image:
+        session = PixelationSession(image, **params)
+        result = session.result
+        if params["num_colors"] == "auto" and params["palette"] is None:
+            messages.append(f"Đã tự chọn {session.num_colors} màu.")
+    out_path.parent.mkdir(exist_ok=True, parents=True)
+    result.save(out_path)
+    return messages
+
+
+def decode_params(params: dict) -> dict:
+    """
+    Keyword arguments for pixelate from their JSON form: a grid as 'WxH+X+Y'
+    and a palette as a list of [r, g, b]. Raises ValueError for unknown names.
+    """
+    unknown = set(params) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+    params = dict(params)
+    if params.get("grid") is not None:
+        params["grid"] = mesh.GridSpec.parse(params["grid"])
+    if params.get("palette") is not None:
+        params["palette"] = Palette(tuple(tuple(color) for color in params["palette"]))
+    return params
+
+
+def plan_run(argv: list[str], cwd: str) -> tuple[Path, Path, dict] | None:
+    """
+    The input file, output file and pixelate parameters of the ppa command line
+    argv run from the directory cwd, with every path made absolute.
+    None if the command is invalid or does more than pixelate one still image,
+    e.g. a batch, a sprite sheet or an animation, which the client then runs itself.
+    Raises ValueError if cwd is not an absolute path.
+    The paths are resolved against cwd, never by changing the directory of the
+    server, and errors are not printed, as every request shares the process.
+    """
+    if not Path(cwd).is_absolute():
+        raise ValueError(f"cwd must be an absolute path, not {cwd!r}")
+    try:
+        args = cli.parse_args(argv, cwd=Path(cwd), exit_on_error=False)
+        if (
+            cli.is_batch(args.input_paths)
+            or args.sprite_sheet
+            or args.frames
+            or args.variants
+            or args.save_mesh is not None
+            or args.profile is not None
+        ):
+            return None
+        input_path = Path(args.input_paths[0])
+        if not input_path.is_file() or animation.is_animated(input_path):
+            return None
+    except (cli.CommandLineError, OSError):
+        return None
+    out_path = cli.resolve_output_path(args.out_path, input_path)
+    params = cli.pixelation_params(args)
+    params["cache"] = cli.stage_cache(args)
+    return input_path, out_path, params
+
+
+class PixelationService:
+    """
+    Runs jobs in a pool of warm workers with bounded concurrency and counts them.
+    - workers: Number of workers, defaults to batch.default_workers of the executor
+    - max_inflight: Jobs running in the pool at once, defaults to the workers
+    - max_queued: Jobs waiting for a free slot before new ones are refused
+    - timeout: Seconds a job may wait and run before its request fails with 504.
+        A job already running keeps its slot until it finishes, so timed out jobs
+        never pile up in the pool.
+    - executor: 'process' or 'thread', see batch.create_executor
+    """
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        max_inflight: int | None = None,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+        timeout: float = DEFAULT_TIMEOUT,
+        executor: str = "process",
+    ):
+        self.workers = workers or batch.default_workers(executor)
+        self.max_inflight = max_inflight or self.workers
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.started = time.time()
+        self.pool: Executor = batch.create_executor(self.workers, executor)
+        for task in [self.pool.submit(_warm) for _ in range(self.workers)]:
+            task.result()
+        self._slots = threading.BoundedSemaphore(self.max_inflight)
+        self._lock = threading.Lock()
+        self._counts = {
+            "queued": 0,
+            "inflight": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "timed_out": 0,
+        }
+        self._seconds: list[float] = []
+
+    def _count(self, name: str, change: int = 1) -> None:
+        with self._lock:
+            self._counts[name] += change
+
+    def _finished(self, _future) -> None:
+        self._count("inflight", -1)
+        self._slots.release()
+
+    def run(self, function, *args):
+        """
+        function(*args) run in the pool, waiting for a slot first.
+        Raises ServerBusy if max_queued jobs are already waiting,
+        and TimeoutError if the job does not finish within the timeout.
+        """
+        start = time.perf_counter()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self._counts["queued"] >= self.max_queued:
+                    self._counts["rejected"] += 1
+                    raise ServerBusy()
+                self._counts["queued"] += 1
+            try:
+                acquired = self._slots.acquire(timeout=self.timeout)
+            finally:
+                self._count("queued", -1)
+            if not acquired:
+                self._count("timed_out")
+                raise TimeoutError()
+        self._count("inflight")
+        try:
+            future = self.pool.submit(function, *args)
+        except BaseException:
+            self._finished(None)
+            raise
+        future.add_done_callback(self._finished)
+        remaining = max(self.timeout - (time.perf_counter() - start), 0)
+        try:
+            result = future.result(timeout=remaining)
+        except TimeoutError:
+            self._count("timed_out")
+            raise
+        except Exception:
+            self._count("failed")
+            raise
+        with self._lock:
+            self._counts["completed"] += 1
+            self._seconds.append(time.perf_counter() - start)
+            del self._seconds[:-1000]
+        return result
+
+    def stats(self) -> dict:
+        """Counters of the jobs, limits of the service, and recent job durations."""
+        with self._lock:
+            seconds = sorted(self._seconds)
+            return {
+                **self._counts,
+                "workers": self.workers,
+                "max_inflight": self.max_inflight,
+                "max_queued": self.max_queued,
+                "timeout": self.timeout,
+                "uptime": time.time() - self.started,
+                "mean_seconds": sum(seconds) / len(seconds) if seconds else None,
+                "p95_seconds": seconds[int(0.95 * (len(seconds) - 1))]
+                if seconds
+                else None,
+            }
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _is_loopback_host(host: str | None) -> bool:
+    """Whether the Host header names the local machine, e.g. 127.0.0.1:8765."""
+    if not host:
+        return False
+    hostname = urlsplit(f"//{host}").hostname
+    if hostname == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(hostname).is_loopback
+    except ValueError:
+        return False
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    GET /health and /stats report on the service as JSON.
+    POST /pixelate takes an image file as the body and the pixelate parameters as
+    JSON in the required X-PPA-Params header, and returns the PNG result.
+    POST /run takes {"argv": [...], "cwd": "..."} as application/json from
+    client.run. It reads and writes files as the user running the server,
+    so it is only served over a Unix socket, which only that user can open.
+    Requests from browsers, which send an Origin header, and requests over TCP
+    naming another host, as a DNS rebinding page would, are refused with 403.
+    """
+
+    server_version = "ppa-serve"
+
+    @property
+    def service(self) -> PixelationService:
+        return self.server.service
+
+    def address_string(self) -> str:
+        # Unix socket peers have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def _reply(self, status: int, body: bytes | dict, content_type: str = "") -> None:
+        if isinstance(body, dict):
+            body = json.dumps(body).encode()
+            content_type = "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError(f"Request body larger than {MAX_BODY_BYTES} bytes")
+        return self.rfile.read(length)
+
+    @property
+    def over_unix_socket(self) -> bool:
+        return self.server.address_family == getattr(socket, "AF_UNIX", None)
+
+    def _refused(self) -> bool:
+        """Reply 403 and return True if the request may come from a web page."""
+        if "Origin" in self.headers:
+            self._reply(403, {"error": "Requests from web pages are not served"})
+            return True
+        if not self.over_unix_socket and not _is_loopback_host(
+            self.headers.get("Host")
+        ):
+            self._reply(403, {"error": "Only requests to a loopback host are served"})
+            return True
+        return False
+
+    def do_GET(self) -> None:
+        if self._refused():
+            return
+        if self.path == "/health":
+            self._reply(200, {"status": "ok", "pid": os.getpid()})
+        elif self.path == "/stats":
+            self._reply(200, self.service.stats())
+        else:
+            self._reply(404, {"error": f"No such endpoint {self.path}"})
+
+    def do_POST(self) -> None:
+        try:
+            # Read the whole body first, so the client is never cut off while sending
+            body = self._body()
+            if self._refused():
+                return
+            if self.path == "/pixelate":
+                # A custom header makes browsers ask for permission first, never given
+                if "X-PPA-Params" not in self.headers:
+                    raise ValueError("Missing the X-PPA-Params header")
+                params = decode_params(json.loads(self.headers["X-PPA-Params"]))
+                png = self.service.run(_pixelate_bytes, body, params)
+                self._reply(200, png, "image/png")
+            elif self.path == "/run":
+                if not self.over_unix_socket:
+                    self._reply(
+                        403, {"error": "/run is only served over a Unix socket"}
+                    )
+                    return
+                if self.headers.get_content_type() != "application/json":
+                    self._reply(415, {"error": "/run takes application/json"})
+                    return
+                request = json.loads(body)
+                job = plan_run(request["argv"], request["cwd"])
+                if job is None:
+                    self._reply(422, {"error": "Not a single image to pixelate"})
+                    return
+                messages = self.service.run(_run_file, *job)
+                self._reply(200, {"messages": messages, "output": str(job[1])})
+            else:
+                self._reply(404, {"error": f"No such endpoint {self.path}"})
+        except ServerBusy:
+            self._reply(503, {"error": "Server busy, try again later"})
+        except TimeoutError:
+            self._reply(504, {"error": f"Timed out after {self.service.timeout}s"})
+        except (ValueError, KeyError, TypeError, Image.UnidentifiedImageError) as error:
+            self._reply(400, {"error": f"{type(error).__name__}: {error}"})
+        except Exception as error:
+            self._reply(500, {"error": f"{type(error).__name__}: {error}"})
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _IPv6HTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_INET6
+
+
+def create_server(address: str, service: PixelationService) -> socketserver.BaseServer:
+    """
+    An HTTP server for service listening at address, a loopback host:port or
+    unix:PATH. A stale socket file left by a server that stopped is replaced.
+    """
+    target = client.parse_address(address)
+    if isinstance(target, str):
+        os.makedirs(os.path.dirname(target) or ".", mode=0o700, exist_ok=True)
+        if os.path.exists(target):
+            if client.health(address) is not None:
+                raise OSError(f"A server is already listening at {address}")
+            os.unlink(target)
+        httpd = _UnixHTTPServer(target, _Handler)
+        # Only the user running the server may send it jobs
+        os.chmod(target, 0o600)
+    else:
+        host, port = target
+        if host != "localhost" and not ipaddress.ip_address(host).is_loopback:
+            raise ValueError(f"Only loopback addresses are served, not {host}")
+        server_class = _IPv6HTTPServer if ":" in host else ThreadingHTTPServer
+        httpd = server_class((host, port), _Handler)
+    httpd.service = service
+    return httpd
+
+
+def serve(
+    address: str,
+    workers: int | None = None,
+    max_inflight: int | None = None,
+    max_queued: int = DEFAULT_MAX_QUEUED,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> None:
+    """Serve at address until interrupted, then stop the workers."""
+    service = PixelationService(workers, max_inflight, max_queued, timeout)
+    try:
+        httpd = create_server(address, service)
+    except BaseException:
+        service.shutdown()
+        raise
+    # Stop cleanly on SIGTERM as on Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(
+        f"Đang phục vụ tại {address} với {service.workers} tiến trình.",
+        file=sys.stderr,
+    )
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        if isinstance(client.parse_address(address), str):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(client.parse_address(address))
+        service.shutdown()
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="ppa serve",
+        description=(
+            "Chạy máy chủ pixelate cục bộ với các tiến trình đã nạp sẵn thư viện. "
+            "Dùng 'ppa --server ...' để gửi việc đến máy chủ."
+        ),
+    )
+    parser.add_argument(
+        "--listen",
+        dest="address",
+        default=client.server_address(),
+        help=(
+            "Địa chỉ lắng nghe: unix:ĐƯỜNG_DẪN cho Unix socket, hoặc host:port trên "
+            "localhost, khi đó chỉ /pixelate được phục vụ, không có 'ppa --server' "
+            f"(mặc định: biến môi trường {client.ADDRESS_VARIABLE} "
+            f"hoặc {client.DEFAULT_ADDRESS})."
+        ),
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=None,
+        help="Số tiến trình xử lý (mặc định: số lõi CPU).",
+    )
+    parser.add_argument(
+        "--max-inflight",
+        dest="max_inflight",
+        type=int,
+        default=None,
+        help="Số việc chạy cùng lúc tối đa (mặc định: bằng số tiến trình).",
+    )
+    parser.add_argument(
+        "--max-queue",
+        dest="max_queued",
+        type=int,
+        default=DEFAULT_MAX_QUEUED,
+        help=(
+            "Số việc chờ tối đa; việc mới hơn bị từ chối với mã 503 "
+            "(mặc định: %(default)s)."
+        ),
+    )
+    parser.add_argument(
+        "--timeout",
+        dest="timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help="Số giây tối đa cho mỗi việc, kể cả thời gian chờ (mặc định: %(default)s).",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Entry point for ppa serve."""
+    args = parse_args(argv)
+    try:
+        serve(args.address, args.jobs, args.max_inflight, args.max_queued, args.timeout)
+    except (OSError, ValueError) as error:
+        sys.exit(f"Không khởi động được máy chủ: {error}")
@@ -0,0 +1,244 @@
+"""Pixelation pipeline with lazily computed stages, for tweaking parameters interactively"""
+
+from pathlib import Path
+
+from PIL import Image
+
+from proper_pixel_art import pixelate
+from proper_pixel_art.cache import StageCache
+from proper_pixel_art.colors import RGB
+from proper_pixel_art.mesh import detect_exact_upscale
+from proper_pixel_art.quantizers import AUTO_COLORS, PaletteSweep
+from proper_pixel_art.utils import Mesh
+
+# Pipeline stages in order, each with the parameters it depends on directly.
+# A stage also depends on every stage before it.
+STAGES: dict[str, tuple[str, ...]] = {
+    "preprocessed": ("transparent_background", "remove_watermark", "background_mode"),
+    "mesh": (
+        "initial_upscale_factor",
+        "pixel_width",
+        "mesh_method",
+        "grid",
+        "exact_upscale",
+    ),
+    "downsampled": ("cell_color",),
+    "sweep": (),
+    "quantized": ("num_colors", "palette", "quantize_method"),
+    "result": ("trim", "scale_result"),
+}
+
+DEFAULT_PARAMS = {
+    "num_colors": None,
+    "initial_upscale_factor": 2,
+    "scale_result": None,
+    "transparent_background": False,
+    "pixel_width": None,
+    "remove_watermark": False,
+    "trim": False,
+    "mesh_method": "hough",
+    "grid": None,
+    "cell_color": "mean",
+    "exact_upscale": True,
+    "background_mode": "global",
+    "palette": None,
+    "quantize_method": "maxcoverage",
+}
+
+
+class PixelationSession:
+    """
+    The stages of pixelate for one image, each computed on first access and kept.
+    Parameters are those of pixelate. Changing them with update discards only the
+    stages that depend on them, so e.g. a new num_colors or scale_result
+    never repeats mesh detection.
+
+    session = PixelationSession(image, num_colors=16)
+    session.mesh         # mesh line coordinates
+    session.downsampled  # one pixel per cell, before quantization
+    session.result       # same as pixelate(image, num_colors=16)
+    session.update(num_colors=8, scale_result=4)
+    session.result       # reuses the mesh and the downsampled image
+    session.sweep        # the downsampled image quantized to any number of colors
+    """
+
+    def __init__(
+        self,
+        image: Image.Image,
+        intermediate_dir: Path | None = None,
+        cache: StageCache | None = None,
+        **params,
+    ):
+        self.image = image
+        self.intermediate_dir = intermediate_dir
+        self.cache = cache
+        self._params = dict(DEFAULT_PARAMS)
+        self._stages: dict[str, object] = {}
+        self.update(**params)
+
+    @property
+    def params(self) -> dict:
+        """The current parameters, as keyword arguments for pixelate."""
+        return dict(self._params)
+
+    @property
+    def computed(self) -> tuple[str, ...]:
+        """Names of the stages currently kept, in pipeline order."""
+        return tuple(stage for stage in STAGES if stage in self._stages)
+
+    def update(self, image: Image.Image | None = None, **params) -> None:
+        """
+        Change the image and/or parameters.
+        Stages downstream of the first stage depending on a changed value are discarded.
+        """
+        unknown = set(params) - set(DEFAULT_PARAMS)
+        if unknown:
+            raise TypeError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+
+        changed = {
+            name for name, value in params.items() if self._params[name] != value
+        }
+        self._params.update(params)
+        if image is not None and image is not self.image:
+            self.image = image
+            self.invalidate("preprocessed")
+            return
+        for stage, stage_params in STAGES.items():
+            if changed.intersection(stage_params):
+                self.invalidate(stage)
+                return
+
+    def invalidate(self, stage: str = "preprocessed") -> None:
+        """Discard stage and every stage after it."""
+        if stage not in STAGES:
+            raise ValueError(f"stage must be one of {tuple(STAGES)}")
+        stages = list(STAGES)
+        for name in stages[stages.index(stage) :]:
+            self._stages.pop(name, None)
+
+    def _stage(self, name: str, compute):
+        if name not in self._stages:
+            self._stages[name] = compute()
+        return self._stages[name]
+
+    @property
+    def preprocessed(self) -> Image.Image:
+        """The RGBA image with the watermark removed and the background keyed out."""
+        return self._stage(
+            "preprocessed",
+            lambda: pixelate.preprocess(
+                self.image,
+                self._params["transparent_background"],
+                self._params["remove_watermark"],
+                self._params["background_mode"],
+            ),
+        )
+
+    def _compute_mesh(self) -> tuple[Mesh, int, bool]:
+        """The mesh, its scale factor, and whether each of its cells is one color."""
+        if self._params["grid"] is None and self._params["exact_upscale"]:
+            exact_mesh = detect_exact_upscale(self.preprocessed)
+            if exact_mesh is not None:
+                return exact_mesh, 1, True
+        mesh_lines, upscale_factor = pixelate.compute_mesh_cached(
+            self.preprocessed,
+            self._params["initial_upscale_factor"],
+            pixel_width=self._params["pixel_width"],
+            mesh_method=self._params["mesh_method"],
+            intermediate_dir=self.intermediate_dir,
+            cache=self.cache,
+            grid=self._params["grid"],
+        )
+        return mesh_lines, upscale_factor, False
+
+    @property
+    def mesh(self) -> Mesh:
+        """The mesh line coordinates, in the coordinates of the upscaled image."""
+        return self._stage("mesh", self._compute_mesh)[0]
+
+    @property
+    def upscale_factor(self) -> int:
+        """The factor the mesh coordinates are scaled by relative to the image."""
+        return self._stage("mesh", self._compute_mesh)[1]
+
+    @property
+    def downsampled(self) -> Image.Image:
+        """One pixel per mesh cell with the cell_color of the cell, before quantization."""
+
+        def compute() -> Image.Image:
+            if (
+                self.cache is not None
+                and self._params["grid"] is None
+                and "mesh" not in self._stages
+            ):
+                # A stored downsampled image skips mesh detection altogether
+                return pixelate.mesh_and_downsample(
+                    self.preprocessed,
+                    self._params["initial_upscale_factor"],
+                    pixel_width=self._params["pixel_width"],
+                    mesh_method=self._params["mesh_method"],
+                    intermediate_dir=self.intermediate_dir,
+                    cache=self.cache,
+                    cell_color=self._params["cell_color"],
+                    exact_upscale=self._params["exact_upscale"],
+                )
+            return pixelate.downsample(
+                self.preprocessed,
+                self.mesh,
+                skip_quantization=True,
+                mesh_scale=self.upscale_factor,
+                cell_color=self._params["cell_color"],
+                uniform_cells=self._stage("mesh", self._compute_mesh)[2],
+            )
+
+        return self._stage("downsampled", compute)
+
+    @property
+    def sweep(self) -> PaletteSweep:
+        """The downsampled image quantized to every number of colors up to 64."""
+        return self._stage("sweep", lambda: PaletteSweep(self.downsampled))
+
+    @property
+    def num_colors(self) -> int | None:
+        """num_colors, with 'auto' replaced by the number of colors the sweep picks."""
+        if self._params["num_colors"] == AUTO_COLORS:
+            return self.sweep.best_num_colors()
+        return self._params["num_colors"]
+
+    @property
+    def quantized(self) -> Image.Image:
+        """
+        The downsampled image quantized to num_colors or mapped to the palette,
+        or unchanged if both are None.
+        """
+        auto = (
+            self._params["num_colors"] == AUTO_COLORS
+            and self._params["palette"] is None
+        )
+        return self._stage(
+            "quantized",
+            lambda: pixelate.quantize(
+                self.downsampled,
+                self._params["num_colors"],
+                intermediate_dir=self.intermediate_dir,
+                palette=self._params["palette"],
+                quantize_method=self._params["quantize_method"],
+                sweep=self.sweep if auto else None,
+            ),
+        )
+
+    @property
+    def palette(self) -> list[RGB]:
+        """The colors of the quantized image, most used first."""
+        counts = self.quantized.convert("RGB").getcolors(maxcolors=2**24)
+        return [color for _, color in sorted(counts, key=lambda item: -item[0])]
+
+    @property
+    def result(self) -> Image.Image:
+        """The final image, as returned by pixelate."""
+        return self._stage(
+            "result",
+            lambda: pixelate.finish(
+                self.quantized, self._params["trim"], self._params["scale_result"]
+            ),
+        )
@@ -0,0 +1,280 @@
+"""Split a sprite sheet into its sprites, pixelate them in parallel and reassemble the sheet"""
+
+import json
+import math
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from proper_pixel_art import batch, colors, pixelate, profiling
+from proper_pixel_art.mesh import GridSpec
+from proper_pixel_art.session import DEFAULT_PARAMS, PixelationSession
+
+Box = tuple[int, int, int, int]  # left, top, right, bottom
+
+
+@dataclass
+class Sprite:
+    """
+    One sprite of a sheet.
+    - index: Position of the sprite in reading order, by top then left edge
+    - box: (left, top, right, bottom) of the opaque pixels of the sprite in the sheet
+    - image: The pixelated sprite, None if pixelating failed
+    - offset: (x, y) of the pixelated sprite in the reassembled sheet
+    - error: The exception raised while pixelating, None on success
+    """
+
+    index: int
+    box: Box
+    image: Image.Image | None = None
+    offset: tuple[int, int] = (0, 0)
+    error: BaseException | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class SpriteSheet:
+    """
+    The result of pixelate_sheet.
+    - image: The pixelated sprites pasted at their offsets, transparent elsewhere
+    - sprites: Every sprite found, including those that failed
+    - cell_size: (width, height) of the pixels of the grid shared by all sprites,
+        in sheet pixels, None unless the pixel width was shared or a grid given
+    """
+
+    image: Image.Image
+    sprites: list[Sprite] = field(default_factory=list)
+    cell_size: tuple[float, float] | None = None
+
+    def manifest(self) -> dict:
+        """The size of the sheet and the source box, offset and size of every sprite."""
+        return {
+            "size": list(self.image.size),
+            "cell_size": list(self.cell_size) if self.cell_size else None,
+            "sprites": [
+                {
+                    "index": sprite.index,
+                    "box": list(sprite.box),
+                    "offset": list(sprite.offset),
+                    "size": list(sprite.image.size) if sprite.ok else None,
+                    "error": None if sprite.ok else repr(sprite.error),
+                }
+                for sprite in self.sprites
+            ],
+        }
+
+    def write_manifest(self, path: Path | str) -> None:
+        """Write the manifest to a JSON file."""
+        Path(path).write_text(json.dumps(self.manifest(), indent=2), encoding="utf-8")
+
+
+@profiling.traced
+def find_sprites(
+    image: Image.Image,
+    alpha_threshold: int = colors.ALPHA_THRESHOLD,
+    downsample: int = 4,
+    min_area: int = 4,
+) -> list[Box]:
+    """
+    Bounding boxes of the sprites of a sheet with a transparent background,
+    in reading order. Sprites are the connected components of the opaque pixels
+    of a mask downsampled by max pooling, so parts of a sprite less than downsample
+    pixels apart stay together. Boxes are then shrunk to the opaque pixels they hold.
+    Components smaller than min_area pixels of the downsampled mask are dropped as noise.
+    """
+    if "A" not in image.getbands():
+        return [(0, 0, image.width, image.height)]
+    opaque = np.asarray(image.getchannel("A")) >= alpha_threshold
+    height, width = opaque.shape
+    small_height, small_width = -(-height // downsample), -(-width // downsample)
+    padded = np.zeros((small_height * downsample, small_width * downsample), bool)
+    padded[:height, :width] = opaque
+    small = padded.reshape(small_height, downsample, small_width, downsample)
+    small = small.any(axis=(1, 3)).astype(np.uint8)
+
+    num_labels, _, stats, _ = cv2.connectedComponentsWithStats(small, connectivity=8)
+    boxes = []
+    for x, y, box_width, box_height, area in stats[1:num_labels].tolist():
+        if area < min_area:
+            continue
+        left, top = x * downsample, y * downsample
+        right = min((x + box_width) * downsample, width)
+        bottom = min((y + box_height) * downsample, height)
+        region = opaque[top:bottom, left:right]
+        columns = np.flatnonzero(region.any(axis=0))
+        rows = np.flatnonzero(region.any(axis=1))
+        boxes.append(
+            (
+                left + int(columns[0]),
+                top + int(rows[0]),
+                left + int(columns[-1]) + 1,
+                top + int(rows[-1]) + 1,
+            )
+        )
+    profiling.note(num_sprites=len(boxes))
+    return sorted(boxes, key=lambda box: (box[1], box[0]))
+
+
+def _padded_box(box: Box, padding: int) -> Box:
+    """box grown by padding on each side, possibly past the sheet."""
+    left, top, right, bottom = box
+    return (left - padding, top - padding, right + padding, bottom + padding)
+
+
+def _grid_box(box: Box, grid: GridSpec, own_phase: bool) -> Box:
+    """
+    box with its top left corner moved out to the nearest line of grid,
+    or kept with own_phase, for a grid through the top left of box.
+    """
+    if own_phase:
+        return box
+    left, top, right, bottom = box
+    corner = [
+        round(offset + math.floor((edge - offset) / cell) * cell)
+        for edge, cell, offset in (
+            (left, grid.cell_width, grid.offset_x),
+            (top, grid.cell_height, grid.offset_y),
+        )
+    ]
+    return (*corner, right, bottom)
+
+
+def _detect_cell_size(crop: Image.Image, params: dict) -> tuple[float, float] | None:
+    """The cell size of the mesh detected in crop, in crop pixels, None if it has none."""
+    session = PixelationSession(
+        crop,
+        cache=params.get("cache"),
+        **{name: value for name, value in params.items() if name in DEFAULT_PARAMS},
+    )
+    lines_x, lines_y = session.mesh
+    if len(lines_x) < 3 or len(lines_y) < 3:
+        return None
+    scale = session.upscale_factor
+    return (
+        float(np.median(np.diff(lines_x))) / scale,
+        float(np.median(np.diff(lines_y))) / scale,
+    )
+
+
+@profiling.traced
+def pixelate_sheet(
+    image: Image.Image,
+    workers: int | None = None,
+    executor: str | Executor = "thread",
+    share_pixel_width: bool = False,
+    padding: int = 4,
+    downsample: int = 4,
+    **params,
+) -> SpriteSheet:
+    """
+    Pixelate every sprite of a sprite sheet on its own, in parallel.
+    inputs:
+    - image:
+        The sheet. Sprites are found in its alpha channel, so a sheet on an opaque
+        background needs transparent_background=True to key the background out first.
+    - workers, executor:
+        As for batch.pixelate_many. Sprites are small, so threads are the default.
+    - share_pixel_width:
+        If True, the mesh is only detected on the largest sprite, and the others
+        are cut on a grid with its cell size, aligned to their own top left edge.
+        Faster, and consistent when every sprite was drawn at the same scale.
+    - padding:
+        Transparent pixels kept around each sprite so its edges can be detected.
+        Unused with a shared grid, where nothing is detected.
+    - downsample:
+        Parts of a sprite closer than this many pixels are kept in one sprite,
+        see find_sprites.
+    - params:
+        Keyword arguments of pixelate. transparent_background, remove_watermark and
+        background_mode apply once to the whole sheet, trim to each sprite.
+        A grid must be a mesh.GridSpec in sheet coordinates, and is shared by all sprites.
+
+    Returns a SpriteSheet with the sprites and the reassembled sheet. Each sprite is
+    placed at its position in the source sheet scaled down by its own cell size,
+    which is its offset in the manifest.
+    """
+    trim = params.pop("trim", False)
+    grid = params.pop("grid", None)
+    if grid is not None and not isinstance(grid, GridSpec):
+        raise ValueError("The grid of a sprite sheet must be a GridSpec")
+    sheet = pixelate.preprocess(
+        image,
+        params.pop("transparent_background", False),
+        params.pop("remove_watermark", False),
+        params.pop("background_mode", "global"),
+    )
+    tight_boxes = find_sprites(sheet, downsample=downsample)
+
+    own_phase = False
+    if grid is None and share_pixel_width and tight_boxes:
+        largest = max(
+            tight_boxes, key=lambda box: (box[2] - box[0]) * (box[3] - box[1])
+        )
+        cell_size = _detect_cell_size(sheet.crop(_padded_box(largest, padding)), params)
+        if cell_size is not None:
+            grid, own_phase = GridSpec(*cell_size), True
+    if grid is None:
+        crops = [_padded_box(box, padding) for box in tight_boxes]
+    else:
+        crops = [_grid_box(box, grid, own_phase) for box in tight_boxes]
+        # Every crop starts on a grid line, so one grid fits all of them
+        params["grid"] = GridSpec(grid.cell_width, grid.cell_height)
+
+    sprites = [Sprite(index, box) for index, box in enumerate(tight_boxes)]
+    results = batch.pixelate_many(
+        [sheet.crop(box) for box in crops],
+        workers=workers,
+        executor=executor,
+        **params,
+    )
+    for result in results:
+        sprite = sprites[result.index]
+        if not result.ok:
+            sprite.error = result.error
+            continue
+        sprite.image, sprite.offset = _place(result.image, sprite.box, trim)
+
+    cell_size = (grid.cell_width, grid.cell_height) if grid is not None else None
+    return SpriteSheet(_assemble(sprites), sprites, cell_size)
+
+
+def _place(
+    pixelated: Image.Image, box: Box, trim: bool
+) -> tuple[Image.Image, tuple[int, int]]:
+    """
+    The sprite, trimmed if trim, and its offset in the pixelated sheet.
+    The opaque part of the pixelated sprite stands for box, so box is scaled
+    by the ratio of their sizes to place it.
+    """
+    left, top, right, bottom = box
+    bbox = pixelated.getchannel("A").getbbox() or (0, 0, *pixelated.size)
+    x = round(left * (bbox[2] - bbox[0]) / (right - left))
+    y = round(top * (bbox[3] - bbox[1]) / (bottom - top))
+    if trim:
+        return pixelated.crop(bbox), (x, y)
+    return pixelated, (x - bbox[0], y - bbox[1])
+
+
+def _assemble(sprites: list[Sprite]) -> Image.Image:
+    """
+    The pixelated sprites pasted at their offsets on a transparent sheet.
+    Offsets are shifted first if padding made any of them negative.
+    """
+    placed = [sprite for sprite in sprites if sprite.ok]
+    shift_x = min([0] + [sprite.offset[0] for sprite in placed])
+    shift_y = min([0] + [sprite.offset[1] for sprite in placed])
+    for sprite in placed:
+        sprite.offset = (sprite.offset[0] - shift_x, sprite.offset[1] - shift_y)
+    width = max((s.offset[0] + s.image.width for s in placed), default=0)
+    height = max((s.offset[1] + s.image.height for s in placed), default=0)
+    sheet = Image.new("RGBA", (max(width, 1), max(height, 1)), (0, 0, 0, 0))
+    for sprite in placed:
+        sheet.alpha_composite(sprite.image.convert("RGBA"), sprite.offset)
+    return sheet
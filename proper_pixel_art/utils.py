@@ -1,6 +1,6 @@
 """Utility functions"""
 
-from proper_pixel_art import colors
+from proper_pixel_art import colors, profiling
 from PIL import Image, ImageDraw
 import numpy as np
 
@@ -10,6 +10,7 @@ Mesh = tuple[
 ]  # A mesh is a tuple of lists of x coordinates and y coordinates for lines
 
 
+@profiling.traced
 def crop_border(image: Image.Image, num_pixels: int = 1) -> Image.Image:
     """
     Crop the boder of an image by a few pixels.
@@ -22,17 +23,29 @@ def crop_border(image: Image.Image, num_pixels: int = 1) -> Image.Image:
     return cropped
 
 
+@profiling.traced
 def remove_generative_watermark(image: Image.Image) -> Image.Image:
     """
     Detects and removes a watermark (like Gemini's) in the bottom right corner
     by filling it with the surrounding background color.
     """
     arr = np.array(image.convert("RGBA"))
+    if remove_generative_watermark_array(arr):
+        return Image.fromarray(arr, image.mode)
+    return image
+
+
+def remove_generative_watermark_array(arr: np.ndarray) -> bool:
+    """
+    remove_generative_watermark of a writable (height, width, 4) uint8 array,
+    in place. Only the bottom right corner is read and written.
+    Returns True if a watermark was removed.
+    """
     h, w = arr.shape[:2]
 
     # Ensure image is large enough
     if h < 300 or w < 300:
-        return image
+        return False
 
     # Look at bottom-right 250x250
     bottom_right = arr[h - 250 : h, w - 250 : w]
@@ -58,13 +71,14 @@ def remove_generative_watermark(image: Image.Image) -> Image.Image:
 
         # If the detected bounding box covers too much area, it might not be a watermark
         if (r_max - r_min) < 180 and (c_max - c_min) < 220:
+            # bottom_right is a view, so this fills the corner of arr
             bottom_right[r_min:r_max, c_min:c_max] = bg_color.astype(np.uint8)
-            arr[h - 250 : h, w - 250 : w] = bottom_right
-            return Image.fromarray(arr, image.mode)
+            return True
 
-    return image
+    return False
 
 
+@profiling.traced
 def trim_transparent(image: Image.Image) -> Image.Image:
     """
     Crop away all fully-transparent rows and columns around the
@@ -120,6 +134,7 @@ def overlay_grid_lines(
     return canvas
 
 
+@profiling.traced
 def scale_img(img: Image.Image, scale: int) -> Image.Image:
     """Scales the image up via nearest neightbor by scale factor."""
     w, h = img.size
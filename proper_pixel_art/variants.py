@@ -0,0 +1,136 @@
+"""Many outputs of one image, at several scales and color counts, from one mesh pass"""
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from PIL import Image
+
+from proper_pixel_art import pixelate, profiling
+from proper_pixel_art.palette import MAX_COLORS
+from proper_pixel_art.quantizers import AUTO_COLORS
+from proper_pixel_art.session import PixelationSession
+
+_VARIANT_PATTERN = re.compile(
+    rf"^(?:(?P<scale>\d+)x)?(?:@(?P<colors>\d+|{AUTO_COLORS}|all))?$"
+)
+
+
+@dataclass(frozen=True)
+class Variant:
+    """
+    One output of pixelate_variants.
+    - scale: Factor the result is upscaled by, 1 keeps one pixel per cell
+    - num_colors: Number of colors of the result, 'auto' to pick it,
+        None to keep every color
+    """
+
+    scale: int = 1
+    num_colors: int | str | None = None
+
+    def __post_init__(self):
+        if self.scale < 1:
+            raise ValueError("A variant scale must be at least 1")
+        if self.num_colors not in (None, AUTO_COLORS) and not (
+            1 <= self.num_colors <= MAX_COLORS
+        ):
+            raise ValueError(f"A variant has 1 to {MAX_COLORS} colors")
+
+    @classmethod
+    def parse(cls, spec: str, num_colors: int | str | None = None) -> "Variant":
+        """
+        Parse 'SCALEx@COLORS', e.g. '4x@16'. Either part may be left out: the scale
+        defaults to 1 and the colors to num_colors. COLORS may be 'auto', or 'all'
+        to keep every color.
+        """
+        match = _VARIANT_PATTERN.match(spec.strip())
+        if match is None or not spec.strip():
+            raise ValueError(
+                f"Invalid variant {spec!r}, expected SCALEx@COLORS, e.g. 4x@16"
+            )
+        colors = match["colors"]
+        if colors == "all":
+            num_colors = None
+        elif colors is not None:
+            num_colors = colors if colors == AUTO_COLORS else int(colors)
+        return cls(int(match["scale"] or 1), num_colors)
+
+    @property
+    def name(self) -> str:
+        """A short name for file names, e.g. '4x_16c', '1x_auto' or '8x'."""
+        if self.num_colors is None:
+            return f"{self.scale}x"
+        if self.num_colors == AUTO_COLORS:
+            return f"{self.scale}x_{AUTO_COLORS}"
+        return f"{self.scale}x_{self.num_colors}c"
+
+
+def parse_variants(
+    specs: str, num_colors: int | str | None = None
+) -> tuple[Variant, ...]:
+    """Parse comma separated variants, e.g. '1x@16,4x@16,8x@32', without duplicates."""
+    variants = [Variant.parse(spec, num_colors) for spec in specs.split(",")]
+    return tuple(dict.fromkeys(variants))
+
+
+def variant_path(out_path: Path, variant: Variant) -> Path:
+    """out_path with the name of variant added to its stem."""
+    return out_path.with_name(f"{out_path.stem}_{variant.name}{out_path.suffix}")
+
+
+@profiling.traced
+def pixelate_variants(
+    image: Image.Image,
+    variants: tuple[Variant, ...] | list[Variant],
+    intermediate_dir: Path | None = None,
+    **params,
+) -> dict[Variant, Image.Image]:
+    """
+    pixelate image once for every variant, in the order given.
+    Preprocessing, mesh detection and downsampling run once for all variants,
+    quantizing and trimming once per number of colors, and only the final
+    upscale once per variant. params are those of pixelate, except num_colors and
+    scale_result which each variant sets.
+    """
+    for name in ("num_colors", "scale_result"):
+        if params.pop(name, None) is not None:
+            raise TypeError(f"{name} is set by each variant, not for all of them")
+    trim = params.pop("trim", False)
+    session = PixelationSession(image, intermediate_dir=intermediate_dir, **params)
+    profiling.note(variants=len(variants))
+
+    by_colors: dict[int | str | None, list[Variant]] = {}
+    for variant in variants:
+        by_colors.setdefault(variant.num_colors, []).append(variant)
+    results = {}
+    for num_colors, group in by_colors.items():
+        session.update(num_colors=num_colors)
+        trimmed = pixelate.finish(session.quantized, trim)
+        for variant in group:
+            scale = variant.scale if variant.scale > 1 else None
+            results[variant] = pixelate.finish(trimmed, scale_result=scale)
+    return {variant: results[variant] for variant in variants}
+
+
+def save_variants(
+    results: dict[Variant, Image.Image],
+    out_path: Path,
+    workers: int | None = None,
+    **save_params,
+) -> dict[Variant, Path]:
+    """
+    Save every result of pixelate_variants next to each other in parallel,
+    named by variant_path. PIL releases the GIL while compressing, so threads
+    encode the images at the same time. save_params are passed to Image.save.
+    Returns the path of each variant.
+    """
+    paths = {variant: variant_path(out_path, variant) for variant in results}
+    with ThreadPoolExecutor(max_workers=workers or len(results) or 1) as pool:
+        futures = [
+            pool.submit(image.save, paths[variant], **save_params)
+            for variant, image in results.items()
+        ]
+        for future in futures:
+            future.result()
+    return paths
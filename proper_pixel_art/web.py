@@ -1,10 +1,48 @@
 """Web interface for Proper Pixel Art using Gradio."""
 
+import hashlib
+import os
+
 from PIL import Image
 
-from proper_pixel_art.pixelate import pixelate
+from proper_pixel_art import pixelate, profiling
+from proper_pixel_art.cache import StageCache
+from proper_pixel_art.colors import BACKGROUND_MODES, CELL_COLORS
+from proper_pixel_art.mesh import AUTO_UPSCALE, MESH_METHODS, GridSpec
+from proper_pixel_art.quantizers import AUTO_COLORS
+from proper_pixel_art.session import PixelationSession
 
 IMG_HEIGHT = 512
+# Numbers of colors shown side by side by the palette preview
+PREVIEW_COLORS = (4, 8, 16, 32)
+
+# Set PPA_CACHE_DIR to keep meshes between conversions and server restarts
+CACHE = (
+    StageCache(os.environ["PPA_CACHE_DIR"]) if os.environ.get("PPA_CACHE_DIR") else None
+)
+# Set PPA_PROFILE to a path to append a trace of the stages run by every conversion
+PROFILE_PATH = os.environ.get("PPA_PROFILE") or None
+
+
+def _image_digest(image: Image.Image) -> str:
+    digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+    digest.update(f"{image.mode} {image.size}".encode())
+    return digest.hexdigest()
+
+
+def _grid_spec(grid: str) -> GridSpec | None:
+    """The grid typed in the UI, None if left empty."""
+    if not grid.strip():
+        return None
+    try:
+        return GridSpec.parse(grid)
+    except ValueError as error:
+        import gradio as gr
+
+        raise gr.Error(
+            f"Lưới {grid.strip()!r} không hợp lệ, cần dạng WxH hoặc WxH+X+Y "
+            "với ô có chiều rộng và chiều cao dương."
+        ) from error
 
 
 def process(
@@ -16,20 +54,80 @@ def process(
     pixel_width: int,
     remove_watermark: bool,
     trim: bool,
+    mesh_method: str = "hough",
+    grid: str = "",
+    cell_color: str = "mean",
+    background_mode: str = "global",
+    state: dict | None = None,
 ) -> Image.Image | None:
-    """Process image through pixelation pipeline."""
+    """
+    Process image through pixelation pipeline.
+    state keeps the PixelationSession of the last image between calls,
+    so changing a parameter recomputes only the stages downstream of it,
+    e.g. changing only the scale skips every other stage.
+    """
     if image is None:
         return None
-    return pixelate(
-        image,
-        num_colors=num_colors if num_colors > 0 else None,
-        transparent_background=transparent,
-        scale_result=scale if scale > 1 else None,
-        initial_upscale_factor=initial_upscale,
-        pixel_width=pixel_width if pixel_width > 0 else None,
-        remove_watermark=remove_watermark,
-        trim=trim,
-    )
+
+    if num_colors < 0:
+        num_colors = AUTO_COLORS
+    params = {
+        "num_colors": num_colors if num_colors != 0 else None,
+        "transparent_background": transparent,
+        "scale_result": scale if scale > 1 else None,
+        "initial_upscale_factor": initial_upscale
+        if initial_upscale > 0
+        else AUTO_UPSCALE,
+        "pixel_width": pixel_width if pixel_width > 0 else None,
+        "remove_watermark": remove_watermark,
+        "trim": trim,
+        "mesh_method": mesh_method,
+        "grid": _grid_spec(grid),
+        "cell_color": cell_color,
+        "background_mode": background_mode,
+    }
+    # Gradio decodes the upload again on every call, so compare the pixels
+    digest = _image_digest(image)
+    state = {} if state is None else state
+    if state.get("digest") == digest:
+        state["session"].update(**params)
+    else:
+        state["digest"] = digest
+        state["session"] = PixelationSession(image, cache=CACHE, **params)
+
+    if PROFILE_PATH is None:
+        return state["session"].result
+    # Only the stages the parameter change made stale appear in the trace
+    with profiling.Tracer(source=digest) as tracer:
+        result = state["session"].result
+    tracer.write_jsonl(PROFILE_PATH)
+    return result
+
+
+def preview_colors(state: dict | None = None) -> list[tuple[Image.Image, str]]:
+    """
+    The last converted image quantized to each of PREVIEW_COLORS colors and to the
+    automatically chosen number, each exactly as converting it with that number of
+    colors would quantize it. The sweep of the session picks the automatic number.
+    """
+    if not state or "session" not in state:
+        return []
+    session = state["session"]
+    sweep = session.sweep
+    best = sweep.best_num_colors()
+    counts = sorted({*(k for k in PREVIEW_COLORS if k <= sweep.max_colors), best})
+    return [
+        (
+            pixelate.quantize(
+                session.downsampled,
+                AUTO_COLORS if k == best else k,
+                quantize_method=session.params["quantize_method"],
+                sweep=sweep,
+            ),
+            f"{k} màu (tự chọn)" if k == best else f"{k} màu",
+        )
+        for k in counts
+    ]
 
 
 def create_demo():
@@ -62,21 +160,53 @@ def create_demo():
 
         with gr.Row():
             num_colors = gr.Slider(
-                0, 64, value=16, step=1, label="Số lượng màu (0 = bỏ qua nén màu)"
+                -1,
+                64,
+                value=16,
+                step=1,
+                label="Số lượng màu (0 = bỏ qua nén màu, -1 = tự chọn)",
             )
             scale = gr.Slider(1, 20, value=1, step=1, label="Phóng to kết quả")
 
         with gr.Row():
-            initial_upscale = gr.Slider(1, 4, value=2, step=1, label="Phóng to ban đầu")
+            initial_upscale = gr.Slider(
+                0, 4, value=2, step=1, label="Phóng to ban đầu (0 = tự động)"
+            )
             pixel_width = gr.Slider(
                 0, 50, value=0, step=1, label="Độ rộng pixel (0=tự động)"
             )
+            mesh_method = gr.Radio(
+                list(MESH_METHODS), value="hough", label="Phương pháp dò lưới"
+            )
+            grid = gr.Textbox(
+                value="",
+                label="Lưới cố định WxH+X+Y (trống = tự dò)",
+                placeholder="16x16+0+0",
+            )
+            cell_color = gr.Radio(
+                list(CELL_COLORS),
+                value="mean",
+                label="Màu của ô (median/mode chống nhiễu)",
+            )
 
         with gr.Row():
             transparent = gr.Checkbox(value=False, label="Nền trong suốt")
+            background_mode = gr.Radio(
+                list(BACKGROUND_MODES),
+                value="global",
+                label="Xóa nền (connected = chỉ vùng nối với viền)",
+            )
             remove_watermark = gr.Checkbox(value=False, label="Xóa Watermark AI")
             trim = gr.Checkbox(value=False, label="Cắt bỏ vùng thừa")
             btn = gr.Button("Chuyển đổi", variant="primary")
+            preview_btn = gr.Button("Xem trước số màu")
+
+        previews = gr.Gallery(
+            label="Xem trước số màu", columns=len(PREVIEW_COLORS) + 1, height="auto"
+        )
+
+        # The session of the last converted image, a separate copy per browser session
+        state = gr.State({})
 
         btn.click(
             fn=process,
@@ -89,9 +219,15 @@ def create_demo():
                 pixel_width,
                 remove_watermark,
                 trim,
+                mesh_method,
+                grid,
+                cell_color,
+                background_mode,
+                state,
             ],
             outputs=output_img,
         )
+        preview_btn.click(fn=preview_colors, inputs=[state], outputs=previews)
 
     return demo
 
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Compare the mesh detection methods on the assets images."""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from proper_pixel_art import mesh
+
+
+def pixel_width(lines: list[int], scale: int) -> float:
+    """Median spacing of the mesh lines in original image pixels."""
+    return float(np.median(np.diff(lines))) / scale
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "paths",
+        type=Path,
+        nargs="*",
+        help="Ảnh cần so sánh (mặc định: ảnh nguồn trong assets/).",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=3,
+        help="Số lần chạy mỗi phương pháp, lấy thời gian nhanh nhất (mặc định: 3).",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    paths = args.paths or sorted(
+        path for path in Path("assets").glob("*/*.png") if path.stem == path.parent.name
+    )
+
+    print("| Ảnh | Phương pháp | Độ rộng pixel (x, y) | Số ô | Thời gian (ms) |")
+    print("| --- | --- | --- | --- | --- |")
+    for path in paths:
+        img = Image.open(path).convert("RGBA")
+        for method in mesh.MESH_METHODS:
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                (lines_x, lines_y), scale = mesh.compute_mesh_with_scaling(
+                    img, 2, mesh_method=method
+                )
+                times.append(time.perf_counter() - start)
+            width_x = pixel_width(lines_x, scale)
+            width_y = pixel_width(lines_y, scale)
+            cells = f"{len(lines_x) - 1}x{len(lines_y) - 1}"
+            print(
+                f"| {path.stem} | {method} | {width_x:.2f}, {width_y:.2f} "
+                f"| {cells} | {1000 * min(times):.0f} |"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Compare the quantization methods on the downsampled assets images."""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from proper_pixel_art import colors, pixelate, quantizers
+
+
+def opaque_colors(image: Image.Image) -> np.ndarray:
+    """The RGB colors of the opaque pixels of an image."""
+    rgba = np.asarray(image.convert("RGBA"))
+    return rgba[rgba[:, :, 3] >= colors.ALPHA_THRESHOLD][:, :3]
+
+
+def oklab_error(original: Image.Image, quantized: Image.Image) -> tuple[float, float]:
+    """Mean and maximum Oklab distance of the opaque pixels, times 100."""
+    distance = np.linalg.norm(
+        quantizers.srgb_to_oklab(opaque_colors(original))
+        - quantizers.srgb_to_oklab(opaque_colors(quantized)),
+        axis=1,
+    )
+    return 100 * float(distance.mean()), 100 * float(distance.max())
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "paths",
+        type=Path,
+        nargs="*",
+        help="Ảnh cần so sánh (mặc định: ảnh nguồn trong assets/).",
+    )
+    parser.add_argument(
+        "-c",
+        "--colors",
+        type=int,
+        nargs="+",
+        default=[8, 16, 32],
+        help="Các số màu cần thử (mặc định: 8 16 32).",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=5,
+        help="Số lần chạy mỗi phương pháp, lấy thời gian nhanh nhất (mặc định: 5).",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    paths = args.paths or sorted(
+        path for path in Path("assets").glob("*/*.png") if path.stem == path.parent.name
+    )
+
+    print(
+        "| Ảnh | Số màu | Phương pháp | Màu dùng | Sai số trung bình (ΔE Oklab) "
+        "| Sai số lớn nhất | Thời gian (ms) |"
+    )
+    print("| --- | --- | --- | --- | --- | --- | --- |")
+    for path in paths:
+        small = pixelate.pixelate(Image.open(path), mesh_method="spectral")
+        for num_colors in args.colors:
+            for method in quantizers.QUANTIZE_METHODS:
+                times = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    result = pixelate.quantize(
+                        small, num_colors, quantize_method=method
+                    )
+                    times.append(time.perf_counter() - start)
+                mean_error, max_error = oklab_error(small, result)
+                used = len(np.unique(opaque_colors(result), axis=0))
+                print(
+                    f"| {path.stem} | {num_colors} | {method} | {used} "
+                    f"| {mean_error:.2f} | {max_error:.1f} | {1000 * min(times):.2f} |"
+                )
+
+
+if __name__ == "__main__":
+    main()
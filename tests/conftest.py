@@ -1,6 +1,9 @@
+from collections.abc import Callable
 from pathlib import Path
 
+import numpy as np
 import pytest
+from PIL import Image
 
 
 @pytest.fixture(name="assets")
@@ -58,3 +61,18 @@ def fixture_pixelate_png_test_params(assets: Path) -> dict[str, dict]:
         },
     }
     return pixelate_png_test_params
+
+
+@pytest.fixture(name="pixel_art")
+def fixture_pixel_art() -> Callable[..., Image.Image]:
+    def pixel_art(seed: int, cells: int = 12, cell_size: int = 10) -> Image.Image:
+        """A random opaque pixel art image upscaled by nearest neighbor."""
+        rng = np.random.default_rng(seed)
+        small = rng.integers(0, 256, size=(cells, cells, 4), dtype=np.uint8)
+        small[:, :, 3] = 255
+        size = cells * cell_size
+        return Image.fromarray(small, mode="RGBA").resize(
+            (size, size), resample=Image.Resampling.NEAREST
+        )
+
+    return pixel_art
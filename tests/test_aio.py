@@ -0,0 +1,136 @@
+"""Tests for the aio module."""
+
+import asyncio
+import os
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from proper_pixel_art import aio, batch, pixelate
+
+
+@pytest.mark.parametrize("executor", batch.EXECUTORS)
+def test_apixelate_matches_pixelate(executor: str, tmp_path: Path, pixel_art) -> None:
+    """Single images and async streams of images come back as pixelate returns them."""
+    params = {"num_colors": 8, "mesh_method": "spectral"}
+    images = [pixel_art(seed) for seed in range(3)]
+    expected = [pixelate.pixelate(image, **params) for image in images]
+
+    async def stream():
+        for image in images:
+            yield image
+        yield tmp_path / "missing.png"
+
+    async def main() -> tuple[Image.Image, list[batch.BatchResult]]:
+        async with aio.AsyncPixelator(workers=2, executor=executor) as pixelator:
+            single = await aio.apixelate(images[0], pixelator=pixelator, **params)
+            results = [
+                result
+                async for result in aio.apixelate_many(
+                    stream(), pixelator=pixelator, **params
+                )
+            ]
+        return single, results
+
+    single, results = asyncio.run(main())
+    np.testing.assert_array_equal(np.array(single), np.array(expected[0]))
+    by_index = {result.index: result for result in results}
+    assert sorted(by_index) == list(range(4))
+    for index, image in enumerate(expected):
+        np.testing.assert_array_equal(np.array(by_index[index].image), np.array(image))
+    assert isinstance(by_index[3].error, FileNotFoundError)
+
+
+def test_concurrency_timeout_and_cancel(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    No more images than the concurrency run at once, a timed out or cancelled
+    image waiting for a slot never runs, and a running one keeps its slot.
+    """
+    release = threading.Event()
+    lock = threading.Lock()
+    running = []
+    started = []
+
+    def fake_pixelate(image: Image.Image, params: dict) -> Image.Image:
+        with lock:
+            running.append(image)
+            started.append(image)
+        release.wait(5)
+        with lock:
+            running.remove(image)
+        return image
+
+    monkeypatch.setattr(batch, "_pixelate", fake_pixelate)
+    images = [Image.new("RGBA", (1, 1), (value, 0, 0, 255)) for value in range(4)]
+
+    async def main() -> None:
+        async with aio.AsyncPixelator(workers=3, concurrency=1) as pixelator:
+            first = asyncio.create_task(pixelator.pixelate(images[0]))
+            await asyncio.sleep(0.05)
+            with pytest.raises(TimeoutError):
+                await pixelator.pixelate(images[1], timeout=0.05)
+            waiting = asyncio.create_task(pixelator.pixelate(images[2]))
+            await asyncio.sleep(0.05)
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+            assert started == [images[0]]
+
+            release.set()
+            assert await first is images[0]
+            assert await pixelator.pixelate(images[3], timeout=5) is images[3]
+
+            release.clear()
+            results = pixelator.pixelate_many(images, timeout=0.05)
+            async for result in results:
+                assert isinstance(result.error, TimeoutError)
+            release.set()
+
+    asyncio.run(main())
+    assert started[:2] == [images[0], images[3]]
+    assert not running
+
+
+def test_opencv_threads_is_opt_in(pixel_art) -> None:
+    """A thread pixelator leaves OpenCV's threads alone unless opencv_threads is set."""
+    threads = cv2.getNumThreads()
+
+    async def main(**options) -> None:
+        async with aio.AsyncPixelator(workers=1, **options) as pixelator:
+            await pixelator.pixelate(pixel_art(0), num_colors=8)
+
+    try:
+        cv2.setNumThreads(3)
+        asyncio.run(main())
+        assert cv2.getNumThreads() == 3
+        asyncio.run(main(opencv_threads=1))
+        assert cv2.getNumThreads() == 1
+    finally:
+        cv2.setNumThreads(threads)
+
+
+def test_default_workers_do_not_oversubscribe(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Default thread pools leave a CPU to each of OpenCV's threads,
+    while worker processes run OpenCV single threaded, one per CPU.
+    """
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    threads = cv2.getNumThreads()
+
+    async def default_workers() -> int:
+        return aio.default_pixelator().workers
+
+    try:
+        cv2.setNumThreads(4)
+        assert asyncio.run(default_workers()) * cv2.getNumThreads() <= 8
+        pool = batch.create_executor(executor="thread")
+        assert pool._max_workers == 2
+        pool.shutdown()
+        assert batch.default_workers("process") == 8
+        assert aio.AsyncPixelator(opencv_threads=1).workers == 8
+    finally:
+        cv2.setNumThreads(threads)
@@ -0,0 +1,111 @@
+"""Tests for the animation module."""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from proper_pixel_art import animation, cli, profiling
+
+COLORS = np.array(
+    [[230, 40, 40], [40, 200, 60], [40, 60, 220], [240, 220, 50], [20, 20, 20]],
+    dtype=np.uint8,
+)
+
+
+def make_frames(
+    num_frames: int, cell: int = 10, cells: tuple[int, int] = (12, 8)
+) -> list[np.ndarray]:
+    """Small sprites of random palette colors, moving one cell per frame."""
+    rng = np.random.default_rng(0)
+    width, height = cells
+    sprite = COLORS[rng.integers(0, len(COLORS), size=(4, 5))]
+    frames = []
+    for index in range(num_frames):
+        small = np.full((height, width, 3), 255, dtype=np.uint8)
+        small[2:6, 1 + index : 6 + index] = sprite
+        frames.append(small)
+    return frames
+
+
+def upscale(small: np.ndarray, cell: int) -> Image.Image:
+    return Image.fromarray(small.repeat(cell, axis=0).repeat(cell, axis=1), mode="RGB")
+
+
+def test_pixelate_animation_reuses_mesh() -> None:
+    """The mesh is detected once, and every frame comes back at its true resolution."""
+    smalls = make_frames(4)
+    source = animation.Animation([upscale(small, 10) for small in smalls])
+    tracer = profiling.Tracer()
+    with tracer:
+        result = animation.pixelate_animation(source, workers=2)
+
+    assert result.keyframes == [0]
+    assert result.durations == source.durations
+    stages = [record.stage for record in tracer.records]
+    assert stages.count("detect_exact_upscale") == 1
+    assert stages.count("mesh_fit") == 4
+    for frame, small in zip(result.frames, smalls):
+        np.testing.assert_array_equal(np.array(frame)[:, :, :3], small)
+
+
+def test_pixelate_animation_redetects_changed_grid() -> None:
+    """A frame drawn on another grid becomes a keyframe with its own mesh."""
+    first, second = make_frames(2, cells=(12, 8))
+    frames = [upscale(first, 10), upscale(second, 10)]
+    # Same size, but a grid of 8 pixels
+    frames.append(upscale(make_frames(1, cells=(15, 10))[0], 8))
+    result = animation.pixelate_animation(animation.Animation(frames))
+
+    assert result.keyframes == [0, 2]
+    assert result.frames[2].size == (15, 10)
+
+
+def test_pixelate_animation_shares_palette() -> None:
+    """All frames are quantized to one palette of num_colors colors."""
+    smalls = make_frames(3)
+    source = animation.Animation([upscale(small, 10) for small in smalls])
+    result = animation.pixelate_animation(source, num_colors=3)
+
+    palette = set()
+    for frame in result.frames:
+        palette.update(color for _, color in frame.convert("RGB").getcolors())
+    assert len(palette) <= 3
+
+
+@pytest.mark.parametrize("suffix", [".gif", ".png"])
+def test_cli_animation(tmp_path: Path, suffix: str) -> None:
+    """Animated inputs are detected and written back as animations with their timing."""
+    smalls = make_frames(3)
+    frames = [upscale(small, 10) for small in smalls]
+    input_path = tmp_path / f"walk{suffix}"
+    frames[0].save(
+        input_path, save_all=True, append_images=frames[1:], duration=80, loop=0
+    )
+
+    cli.main([str(input_path), "-o", str(tmp_path / "out")])
+
+    out_path = tmp_path / "out" / f"walk_pixelated{suffix}"
+    loaded = animation.load_animation(out_path)
+    assert loaded.durations == [80] * 3
+    for frame, small in zip(loaded.frames, smalls):
+        np.testing.assert_array_equal(np.array(frame)[:, :, :3], small)
+
+
+def test_cli_frame_sequence(tmp_path: Path) -> None:
+    """--frames joins numbered files into one animation."""
+    smalls = make_frames(3)
+    for index, small in enumerate(smalls):
+        upscale(small, 10).save(tmp_path / f"frame_{index:02d}.png")
+    out_path = tmp_path / "walk.gif"
+
+    cli.main(
+        [str(tmp_path / "frame_*.png"), "--frames", "--frame-duration", "50"]
+        + ["-o", str(out_path)]
+    )
+
+    loaded = animation.load_animation(out_path)
+    assert loaded.durations == [50] * 3
+    for frame, small in zip(loaded.frames, smalls):
+        np.testing.assert_array_equal(np.array(frame)[:, :, :3], small)
@@ -0,0 +1,41 @@
+"""Tests for the batch module."""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from proper_pixel_art import batch, pixelate
+
+
+@pytest.mark.parametrize("executor", batch.EXECUTORS)
+def test_pixelate_many_matches_pixelate(
+    executor: str, tmp_path: Path, pixel_art
+) -> None:
+    """Every item comes back once with the same result as pixelate, failures included."""
+    params = {"num_colors": 8, "mesh_method": "spectral"}
+    images = [pixel_art(seed) for seed in range(3)]
+    path = tmp_path / "image.png"
+    images[0].save(path)
+    sources = [*images, path, tmp_path / "missing.png", "not an image".encode()]
+
+    results = list(batch.pixelate_many(sources, workers=2, executor=executor, **params))
+
+    by_index = {result.index: result for result in results}
+    assert sorted(by_index) == list(range(len(sources)))
+    for index, image in enumerate([*images, images[0]]):
+        assert by_index[index].ok
+        expected = pixelate.pixelate(image, **params)
+        np.testing.assert_array_equal(
+            np.array(by_index[index].image), np.array(expected)
+        )
+    assert isinstance(by_index[4].error, FileNotFoundError)
+    assert isinstance(by_index[5].error, TypeError)
+
+
+def test_pixelate_many_reuses_executor(pixel_art) -> None:
+    """An executor from create_executor can serve several batches."""
+    with batch.create_executor(workers=2) as executor:
+        for seed in range(2):
+            (result,) = batch.pixelate_many([pixel_art(seed)], executor=executor)
+            assert result.ok
@@ -0,0 +1,80 @@
+"""Tests for the cache module."""
+
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+
+from proper_pixel_art import batch, pixelate
+from proper_pixel_art.cache import StageCache
+
+
+def test_cached_pixelate_matches_uncached(tmp_path: Path, pixel_art) -> None:
+    """Changing only the quantization reuses the stored stages with the same result."""
+    cache = StageCache(tmp_path)
+    image = pixel_art(0)
+
+    # A clean upscale would be sliced back without the cache
+    params = {"exact_upscale": False}
+    first = pixelate.pixelate(image, num_colors=8, cache=cache, **params)
+    assert cache.stats() == {
+        "downsample": {"hits": 0, "misses": 1},
+        "mesh": {"hits": 0, "misses": 1},
+    }
+
+    for num_colors in (8, 4, None):
+        cached = pixelate.pixelate(
+            image, num_colors=num_colors, trim=True, cache=cache, **params
+        )
+        expected = pixelate.pixelate(image, num_colors=num_colors, trim=True, **params)
+        np.testing.assert_array_equal(np.array(cached), np.array(expected))
+    np.testing.assert_array_equal(
+        np.array(first), np.array(pixelate.pixelate(image, num_colors=8, **params))
+    )
+    assert cache.hits["downsample"] == 3
+    assert cache.misses["mesh"] == 1
+
+    # A parameter the mesh depends on is a different entry
+    pixelate.pixelate(image, mesh_method="spectral", cache=cache, **params)
+    assert cache.misses["downsample"] == 2
+
+
+def test_evicts_least_recently_used(tmp_path: Path) -> None:
+    """Going over max_bytes removes the entries used longest ago."""
+    entry = {"pixels": np.zeros(4096, dtype=np.uint8)}
+    # Room for three entries and their npz headers, not four
+    cache = StageCache(tmp_path, max_bytes=3 * 4096 + 2048)
+    for key in "abc":
+        cache.put("stage", key, entry)
+    # Keep the mtimes apart on file systems with coarse timestamps
+    for age, key in enumerate("bca"):
+        path = tmp_path / f"stage-{key}.npz"
+        mtime = path.stat().st_mtime + age
+        os.utime(path, (mtime, mtime))
+
+    cache.put("stage", "d", entry)
+
+    assert cache.get("stage", "b") is None
+    for key in "cad":
+        assert cache.get("stage", key) is not None
+
+
+def test_counts_worker_lookups(tmp_path: Path, pixel_art) -> None:
+    """Lookups made in worker processes are added to the parent's counters."""
+    cache = pickle.loads(pickle.dumps(StageCache(tmp_path)))
+    images = [pixel_art(seed) for seed in range(2)]
+
+    for _ in range(2):
+        results = list(
+            batch.pixelate_many(
+                images,
+                workers=2,
+                mesh_method="spectral",
+                cache=cache,
+                exact_upscale=False,
+            )
+        )
+        assert all(result.ok for result in results)
+
+    assert cache.stats()["downsample"] == {"hits": 2, "misses": 2}
@@ -0,0 +1,91 @@
+"""Tests for the command line interface."""
+
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from proper_pixel_art import cli
+
+
+@pytest.fixture(name="input_tree")
+def fixture_input_tree(tmp_path: Path, assets: Path) -> Path:
+    """A directory of source images with a nested subdirectory."""
+    root = tmp_path / "in"
+    (root / "sub").mkdir(parents=True)
+    shutil.copy(assets / "anchor" / "anchor.png", root / "anchor.png")
+    shutil.copy(assets / "ash" / "ash.png", root / "sub" / "ash.png")
+    (root / "notes.txt").write_text("not an image")
+    return root
+
+
+def test_expand_inputs(input_tree: Path, tmp_path: Path) -> None:
+    """Directories, globs and file lists expand to mirrored relative paths."""
+    expected = [
+        (input_tree / "anchor.png", Path("anchor.png")),
+        (input_tree / "sub" / "ash.png", Path("sub/ash.png")),
+    ]
+    assert cli.expand_inputs([str(input_tree)]) == expected
+    assert cli.expand_inputs([str(input_tree / "**" / "*.png")]) == expected
+
+    file_list = tmp_path / "list.txt"
+    file_list.write_text(f"# sprites\n{input_tree / 'sub' / 'ash.png'}\n\n")
+    assert cli.expand_inputs([f"@{file_list}"]) == [
+        (input_tree / "sub" / "ash.png", Path("ash.png"))
+    ]
+
+
+def test_batch_mirrors_tree_and_skips_up_to_date(
+    input_tree: Path, tmp_path: Path, capsys: pytest.CaptureFixture
+) -> None:
+    """A batch writes a mirrored tree and skips outputs made from the same source and parameters."""
+    out_dir = tmp_path / "out"
+    argv = [str(input_tree), "-o", str(out_dir), "-j", "1", "--mesh-method", "spectral"]
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main([*argv, "--skip-existing", "hash"])
+    assert exit_info.value.code == 0
+    anchor_out = out_dir / "anchor_pixelated.png"
+    assert anchor_out.exists()
+    assert (out_dir / "sub" / "ash_pixelated.png").exists()
+
+    # Same parameters: nothing to do, even if the output looks older than the source
+    os.utime(anchor_out, (0, 0))
+    with pytest.raises(SystemExit):
+        cli.main([*argv, "--skip-existing", "hash"])
+    assert "0/0" in capsys.readouterr().err
+    assert anchor_out.stat().st_mtime == 0
+
+    # The output is older than the source, so mtime mode redoes it
+    with pytest.raises(SystemExit):
+        cli.main([*argv, "--skip-existing", "mtime"])
+    assert anchor_out.stat().st_mtime > 0
+    with Image.open(anchor_out) as result:
+        assert cli.DIGEST_KEY in result.info
+
+
+def test_batch_reports_failures(input_tree: Path, tmp_path: Path, capsys) -> None:
+    """A missing input fails the batch with a non-zero status naming the file."""
+    missing = tmp_path / "missing.png"
+    argv = [str(input_tree / "anchor.png"), str(missing), "-o", str(tmp_path / "out")]
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main([*argv, "-j", "1", "--mesh-method", "spectral"])
+    assert exit_info.value.code == 1
+    assert str(missing) in capsys.readouterr().err
+    assert (tmp_path / "out" / "anchor_pixelated.png").exists()
+
+
+def test_batch_reports_colliding_outputs(
+    input_tree: Path, tmp_path: Path, capsys
+) -> None:
+    """Inputs that would overwrite another input's output fail instead of vanishing."""
+    Image.open(input_tree / "anchor.png").convert("RGB").save(input_tree / "anchor.jpg")
+    argv = [str(input_tree), "-o", str(tmp_path / "out"), "-j", "1"]
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main([*argv, "--mesh-method", "spectral"])
+    assert exit_info.value.code == 1
+    err = capsys.readouterr().err
+    assert "Đã xử lý 2/3 ảnh" in err
+    assert f"{input_tree / 'anchor.png'}: LỖI" in err
+    assert (tmp_path / "out" / "anchor_pixelated.png").exists()
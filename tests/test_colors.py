@@ -1,6 +1,7 @@
 """Tests for the colors module."""
 
 import numpy as np
+from PIL import Image
 
 from proper_pixel_art import colors
 
@@ -280,3 +281,103 @@ class TestGetCellColorSkipQuantization:
 
         result = colors.get_cell_color_skip_quantization(cell)
         assert result == (0, 0, 0, 0)
+
+
+class TestCellColors:
+    """Tests for the batched cell statistics."""
+
+    def _cells(self) -> tuple[np.ndarray, np.ndarray, list[np.ndarray]]:
+        rng = np.random.default_rng(0)
+        # Clusters near the top of the range, where the offset grid would wrap in uint8
+        rgb = (230 + rng.integers(0, 26, size=(600, 3))).astype(np.uint8)
+        rgb[::3] = rng.integers(0, 256, size=(200, 3), dtype=np.uint8)
+        labels = rng.integers(0, 40, size=600)
+        return rgb, labels, [rgb[labels == cell] for cell in range(40)]
+
+    def test_dominant_matches_per_cell_binning(self):
+        """Each cell gets the color _dominant_rgb_by_binning picks for its pixels."""
+        rgb, labels, cells = self._cells()
+        result = colors.cell_colors(rgb, labels, np.ones(600), 40, "dominant")
+        for cell, pixels in enumerate(cells):
+            assert tuple(result[cell]) == colors._dominant_rgb_by_binning(pixels)
+
+    def test_median_and_mode_match_numpy(self):
+        """Medians match np.median cast to uint8, modes are the most frequent color."""
+        rgb, labels, _ = self._cells()
+        rgb[labels == 5] = [1, 2, 3]
+        cells = [rgb[labels == cell] for cell in range(40)]
+        medians = colors.cell_colors(rgb, labels, np.ones(600), 40, "median")
+        modes = colors.cell_colors(rgb, labels, np.ones(600), 40, "mode")
+        for cell, pixels in enumerate(cells):
+            expected = np.median(pixels, axis=0).astype(np.uint8)
+            np.testing.assert_array_equal(medians[cell], expected)
+        assert tuple(modes[5]) == (1, 2, 3)
+
+    def test_weights_leave_out_pixels(self):
+        """Pixels with zero weight do not count, and cells without weight are black."""
+        rgb = np.array([[10, 10, 10], [200, 0, 0], [200, 0, 0], [50, 50, 50]], np.uint8)
+        labels = np.array([0, 0, 0, 1])
+        weights = np.array([3, 1, 1, 0])
+        for cell_color in ("median", "mode", "dominant"):
+            result = colors.cell_colors(rgb, labels, weights, 2, cell_color)
+            assert tuple(result[0]) == (10, 10, 10)
+            assert tuple(result[1]) == (0, 0, 0)
+
+
+class TestPreprocessingArrays:
+    """Tests for the array versions of the preprocessing stages."""
+
+    def _rgba(self) -> np.ndarray:
+        rng = np.random.default_rng(1)
+        rgba = rng.integers(0, 256, size=(50, 70, 4), dtype=np.uint8)
+        rgba[:20, :30, :3] = [90, 60, 30]
+        rgba[0], rgba[:, 0] = [90, 60, 30, 255], [90, 60, 30, 255]
+        return rgba
+
+    def test_clamp_alpha_matches_composite(self):
+        """Transparent pixels get the background, the rest the PIL conversion."""
+        rgba = self._rgba()
+        image = Image.fromarray(rgba, mode="RGBA")
+        mask = image.getchannel("A").point(lambda p: 255 if p >= 128 else 0)
+        for mode in ("RGB", "L"):
+            background = Image.new("RGB", image.size, "#00ffff").convert(mode)
+            expected = Image.composite(image.convert(mode), background, mask)
+            result = colors.clamp_alpha_array(rgba, mode=mode, background_hex="#00ffff")
+            np.testing.assert_array_equal(result, np.array(expected))
+
+    def test_top_opaque_colors_counts_opaque_pixels(self):
+        """The most common opaque color comes first and transparent ones are left out."""
+        rgba = self._rgba()
+        rgba[30:, 40:] = [1, 2, 3, 0]
+        top = colors._top_opaque_colors_array(rgba, colors.ALPHA_THRESHOLD)
+        assert top[0] == (90, 60, 30)
+        assert (1, 2, 3) not in top
+
+    def test_make_background_transparent_matches_norm(self):
+        """Keying out in place matches the float distance to the boundary color."""
+        rgba = self._rgba()
+        distance = np.linalg.norm(
+            rgba[:, :, :3].astype(np.float32) - [90, 60, 30], axis=2
+        )
+        expected = rgba.copy()
+        expected[:, :, 3][distance < 40] = 0
+        result = colors.make_background_transparent_array(rgba, rows_per_chunk=7)
+        assert result is rgba
+        np.testing.assert_array_equal(rgba, expected)
+
+    def test_connected_background_keeps_enclosed_pixels(self):
+        """Only background colored pixels reachable from the boundary are keyed out."""
+        rgba = np.zeros((40, 40, 4), dtype=np.uint8)
+        rgba[:] = [200, 200, 200, 255]
+        rgba[10:30, 10:30] = [20, 40, 60, 255]
+        rgba[15:25, 15:25] = [205, 200, 195, 255]
+        keyed = colors.make_background_transparent_array(
+            rgba.copy(), background_mode="connected", rows_per_chunk=7
+        )
+        assert (keyed[15:25, 15:25, 3] == 255).all()
+        assert (keyed[10:30, 10:30, 3] == 255).all()
+        opaque = np.zeros((40, 40), dtype=bool)
+        opaque[10:30, 10:30] = True
+        assert (keyed[~opaque, 3] == 0).all()
+        everywhere = colors.make_background_transparent_array(rgba.copy())
+        assert (everywhere[15:25, 15:25, 3] == 0).all()
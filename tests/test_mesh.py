@@ -1,8 +1,10 @@
 from pathlib import Path
 
+import numpy as np
+import pytest
 from PIL import Image
 
-from proper_pixel_art import mesh
+from proper_pixel_art import mesh, profiling
 
 
 def test_mesh():
@@ -14,3 +16,167 @@ def test_mesh():
     mesh_x, mesh_y = mesh.compute_mesh(img)
     assert (len(mesh_x)) > 2
     assert (len(mesh_y)) > 2
+
+
+def test_spectral_mesh_recovers_grid():
+    """
+    Checks that the spectral method finds the pixel width and cell count
+    of a nearest neighbor upscale with a non-integer scale factor.
+    """
+    rng = np.random.default_rng(0)
+    small = rng.integers(0, 256, size=(15, 20, 4), dtype=np.uint8)
+    small[:, :, 3] = 255
+    img = Image.fromarray(small, mode="RGBA").resize(
+        (150, 113), resample=Image.Resampling.NEAREST
+    )
+    mesh_x, mesh_y = mesh.compute_mesh_spectral(img)
+    assert len(mesh_x) - 1 == 20
+    assert len(mesh_y) - 1 == 15
+    assert abs(np.median(np.diff(mesh_x)) - 7.5) <= 0.5
+
+
+def test_spectral_mesh_blob():
+    """
+    Checks that the spectral mesh of the blob image is close to the Hough mesh.
+    """
+    img_path = Path.cwd() / "assets" / "blob" / "blob.png"
+    img = Image.open(img_path).convert("RGBA")
+    (hough_x, hough_y), scale = mesh.compute_mesh_with_scaling(img, 2)
+    (mesh_x, mesh_y), spectral_scale = mesh.compute_mesh_with_scaling(
+        img, 2, mesh_method="spectral"
+    )
+    assert spectral_scale == 1
+    assert abs(len(mesh_x) - len(hough_x)) <= 2
+    assert abs(len(mesh_y) - len(hough_y)) <= 2
+
+
+def test_grid_spec_mesh():
+    """
+    Checks the lines of a known grid, keeping partial edge cells only
+    if they are at least half a cell wide.
+    """
+    spec = mesh.GridSpec.parse("10x7.5+4+0")
+    assert spec == mesh.GridSpec(10, 7.5, 4, 0)
+    (lines_x, lines_y), scale = spec.mesh_for(40, 30)
+    assert scale == 1
+    assert lines_x == [4, 14, 24, 34, 40]
+    assert lines_y == [0, 8, 15, 22, 30]
+    assert mesh.GridSpec(50, 50).mesh_for(40, 30)[0] == ([0, 40], [0, 30])
+
+
+def test_saved_mesh_round_trip(tmp_path: Path):
+    path = tmp_path / "mesh.json"
+    mesh.save_mesh(path, ([0, 4, 8], [0, 6]), scale=2)
+    fixed = mesh.parse_grid(str(path))
+    assert fixed.mesh_for(4, 3) == (([0, 4, 8], [0, 6]), 2)
+    with pytest.raises(ValueError):
+        fixed.mesh_for(3, 3)
+
+
+def test_pyramid_mesh_recovers_grid():
+    """
+    Checks that the pyramid method finds every line of a large
+    nearest neighbor upscale exactly, without upscaling it.
+    """
+    rng = np.random.default_rng(0)
+    small = rng.integers(0, 256, size=(100, 200, 4), dtype=np.uint8)
+    small[:, :, 3] = 255
+    img = Image.fromarray(small, mode="RGBA").resize(
+        (2400, 1200), resample=Image.Resampling.NEAREST
+    )
+    (lines_x, lines_y), scale = mesh.compute_mesh_with_scaling(
+        img, 2, mesh_method="pyramid"
+    )
+    assert scale == 1
+    assert lines_x == list(range(0, 2401, 12))
+    assert lines_y == list(range(0, 1201, 12))
+
+
+def test_pyramid_mesh_upscales_small_pixels():
+    """Pixels below the minimum width fall back to the upscaled Hough mesh."""
+    img = Image.open(Path.cwd() / "assets" / "blob" / "blob.png").convert("RGBA")
+    small_pixels = img.resize((160, 160), resample=Image.Resampling.NEAREST)
+    with profiling.Tracer(memory=False) as tracer:
+        _, scale = mesh.compute_mesh_pyramid(small_pixels, upscale_factor=2)
+    (record,) = [r for r in tracer.records if r.stage == "compute_mesh_pyramid"]
+    assert record.info["pyramid_fallback"] is True
+    assert scale in (1, 2)
+
+
+def test_pyramid_fallback_keeps_pixel_width():
+    """A pixel width below the pyramid minimum is still used by the fallback."""
+    img = Image.open(Path.cwd() / "assets" / "blob" / "blob.png").convert("RGBA")
+    pyramid = mesh.compute_mesh_with_scaling(
+        img, 2, pixel_width=4, mesh_method="pyramid"
+    )
+    hough = mesh.compute_mesh_with_scaling(img, 2, pixel_width=4, mesh_method="hough")
+    assert pyramid == hough
+    assert pyramid != mesh.compute_mesh_with_scaling(img, 2, mesh_method="pyramid")
+
+
+def test_auto_upscale_factor():
+    """
+    Checks that auto upscaling skips the upscale for wide pixels and for noise,
+    and upscales the small pixels of the blob image.
+    """
+    rng = np.random.default_rng(0)
+    small = rng.integers(0, 256, size=(12, 12, 4), dtype=np.uint8)
+    small[:, :, 3] = 255
+    wide_pixels = Image.fromarray(small, mode="RGBA").resize(
+        (768, 768), resample=Image.Resampling.NEAREST
+    )
+    noise = Image.fromarray(rng.integers(0, 256, size=(400, 400, 3), dtype=np.uint8))
+    blob = Image.open(Path.cwd() / "assets" / "blob" / "blob.png").convert("RGBA")
+
+    with profiling.Tracer(memory=False) as tracer:
+        (lines_x, lines_y), scale = mesh.compute_mesh_with_scaling(wide_pixels, "auto")
+        assert scale == 1
+        assert len(lines_x) - 1 == len(lines_y) - 1 == 12
+        assert mesh.compute_mesh_with_scaling(noise.convert("RGBA"), "auto")[1] == 1
+        assert mesh.compute_mesh_with_scaling(blob, "auto")[1] == 2
+
+    reasons = [
+        r.info["upscale_reason"]
+        for r in tracer.records
+        if r.stage == "choose_upscale_factor"
+    ]
+    assert reasons == ["large_pixels", "no_grid", "small_pixels"]
+    # No pass on the original image follows a pass at scale 1
+    assert [r.stage for r in tracer.records].count("compute_mesh") == 3
+
+    with pytest.raises(ValueError):
+        mesh.compute_mesh_with_scaling(blob, "twice")
+
+
+def test_detect_exact_upscale():
+    """
+    Checks that clean upscales by integer and non-integer factors, cropped or with
+    transparent pixels of any color, give their cells, and noisy ones give None.
+    """
+    rng = np.random.default_rng(0)
+    small = rng.integers(0, 256, size=(30, 40, 4), dtype=np.uint8)
+    small[:, :, 3] = 255
+    small[0, 0] = [9, 9, 9, 0]
+
+    for size in ((400, 300), (300, 225)):
+        img = Image.fromarray(small).resize(size, resample=Image.Resampling.NEAREST)
+        pixels = np.array(img)
+        pixels[pixels[:, :, 3] == 0] = rng.integers(0, 256, size=4) & 0x7F
+        lines_x, lines_y = mesh.detect_exact_upscale(Image.fromarray(pixels))
+        assert len(lines_x) - 1 == 40
+        assert len(lines_y) - 1 == 30
+        assert lines_x[0] == lines_y[0] == 0
+        assert (lines_x[-1], lines_y[-1]) == size
+
+    img = Image.fromarray(small).resize((400, 300), resample=Image.Resampling.NEAREST)
+    # The partial cells of 6 and 3 pixels are kept and dropped
+    lines_x, lines_y = mesh.detect_exact_upscale(img.crop((4, 7, 400, 300)))
+    assert lines_x[:3] == [0, 6, 16]
+    assert lines_y[:3] == [3, 13, 23]
+
+    noisy = np.array(img).astype(np.int16) + rng.integers(-2, 3, size=(300, 400, 4))
+    noisy[:, :, 3] = 255
+    assert (
+        mesh.detect_exact_upscale(Image.fromarray(noisy.clip(0, 255).astype(np.uint8)))
+        is None
+    )
@@ -0,0 +1,108 @@
+"""Tests for the palette module."""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from proper_pixel_art import cli, pixelate
+from proper_pixel_art.palette import Palette
+
+
+@pytest.mark.parametrize("num_colors", [1, 2, 16, 256])
+def test_apply_maps_to_nearest_color(num_colors: int) -> None:
+    """Every pixel gets exactly its nearest palette color, and keeps its alpha."""
+    rng = np.random.default_rng(num_colors)
+    palette = Palette(tuple(map(tuple, rng.integers(0, 256, (num_colors, 3)).tolist())))
+    rgba = rng.integers(0, 256, (64, 64, 4), dtype=np.uint8)
+
+    result = np.array(palette.apply(Image.fromarray(rgba, mode="RGBA")))
+
+    diff = rgba[:, :, None, :3].astype(int) - palette.array.astype(int)
+    nearest = (diff * diff).sum(axis=3).min(axis=2)
+    chosen = result[:, :, :3].astype(int) - rgba[:, :, :3]
+    np.testing.assert_array_equal((chosen * chosen).sum(axis=2), nearest)
+    np.testing.assert_array_equal(result[:, :, 3], rgba[:, :, 3])
+
+
+@pytest.mark.parametrize("suffix", [".gpl", ".hex", ".png"])
+def test_save_and_load(tmp_path: Path, suffix: str) -> None:
+    """Palettes round trip through GIMP, hex and image files."""
+    palette = Palette(((255, 0, 77), (16, 32, 48), (0, 0, 0)))
+    path = tmp_path / f"palette{suffix}"
+    if suffix == ".png":
+        swatch = np.array([[[255, 0, 77]] * 3 + [[16, 32, 48]] * 2 + [[0, 0, 0]]])
+        Image.fromarray(swatch.astype(np.uint8), mode="RGB").save(path)
+    else:
+        palette.save(path)
+    assert Palette.load(path) == palette
+
+
+def test_fit_shares_palette() -> None:
+    """A palette fitted to several images covers their colors, most used first."""
+    red = Image.new("RGBA", (8, 8), (200, 30, 30, 255))
+    blue = Image.new("RGBA", (4, 4), (30, 30, 200, 255))
+    clear = Image.new("RGBA", (8, 8), (0, 255, 0, 0))
+    palette = Palette.fit([red, blue, clear], num_colors=4)
+    assert palette.colors == ((200, 30, 30), (30, 30, 200))
+
+
+def test_pixelate_with_palette(assets: Path) -> None:
+    """pixelate maps its result to a given palette instead of quantizing."""
+    image = Image.open(assets / "anchor" / "anchor.png")
+    unquantized = pixelate.pixelate(image, mesh_method="spectral")
+    palette = Palette.fit([unquantized], num_colors=6)
+    result = pixelate.pixelate(image, mesh_method="spectral", palette=palette)
+
+    used = {color for _, color in result.convert("RGB").getcolors()}
+    assert used <= set(palette.colors)
+    np.testing.assert_array_equal(
+        np.array(result), np.array(palette.apply(unquantized))
+    )
+
+
+def test_cli_lock_palette(
+    assets: Path, tmp_path: Path, capsys: pytest.CaptureFixture
+) -> None:
+    """
+    --lock-palette maps every image of a batch to one saved palette,
+    and an up to date batch is skipped without fitting the palette again.
+    """
+    inputs = [assets / "anchor" / "anchor.png", assets / "ash" / "ash.png"]
+    out_dir = tmp_path / "out"
+    palette_path = tmp_path / "batch.gpl"
+    argv = [*map(str, inputs), "-o", str(out_dir), "-j", "1", "-c", "8"]
+    argv += ["--lock-palette", "--skip-existing", "hash"]
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main([*argv, "--save-palette", str(palette_path)])
+    assert exit_info.value.code == 0
+    assert "Đã tạo bảng" in capsys.readouterr().err
+
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main(argv)
+    assert exit_info.value.code == 0
+    err = capsys.readouterr().err
+    assert "Đã tạo bảng" not in err
+    assert "bỏ qua 2 ảnh" in err
+
+    palette = Palette.load(palette_path)
+    for path in inputs:
+        result = Image.open(out_dir / f"{path.stem}_pixelated.png")
+        used = {color for _, color in result.convert("RGB").getcolors()}
+        assert used <= set(palette.colors)
+
+
+def test_palette_sample_is_stable(tmp_path: Path) -> None:
+    """The sample does not depend on the order of the inputs, and grows predictably."""
+    for index in range(cli.PALETTE_SAMPLE_SIZE + 10):
+        (tmp_path / f"{index}.png").touch()
+    sources = cli.expand_inputs([str(tmp_path)])
+    sample = cli.palette_sample(sources[1:])
+    assert len(sample) == cli.PALETTE_SAMPLE_SIZE
+    assert cli.palette_sample(sources[:0:-1]) == sample
+    grown = cli.palette_sample(sources)
+    if sources[0][0] in grown:
+        assert set(grown) - set(sample) == {sources[0][0]}
+    else:
+        assert grown == sample
@@ -1,10 +1,14 @@
 """Visual output tests"""
 
+import tracemalloc
+from itertools import product
 from pathlib import Path
 
+import numpy as np
+import pytest
 from PIL import Image
 
-from proper_pixel_art import pixelate
+from proper_pixel_art import colors, mesh, pixelate, profiling, utils
 
 
 def test_pixelate_pngs(pixelate_png_test_params: dict[str, dict]) -> None:
@@ -41,3 +45,230 @@ def test_pixelate_pngs(pixelate_png_test_params: dict[str, dict]) -> None:
             f"Manually inspect the results in {output_dir} to verify pixelation quality."
         )
     )
+
+
+def _downsample_per_cell(
+    img_array: np.ndarray, mesh_lines, original_alpha: np.ndarray | None = None
+) -> np.ndarray:
+    """Reference implementation looping over every cell with the colors functions."""
+    lines_x, lines_y = mesh_lines
+    out = np.zeros((len(lines_y) - 1, len(lines_x) - 1, 4), dtype=np.uint8)
+    for j, i in product(range(len(lines_y) - 1), range(len(lines_x) - 1)):
+        x0, x1 = lines_x[i], lines_x[i + 1]
+        y0, y1 = lines_y[j], lines_y[j + 1]
+        cell = img_array[y0:y1, x0:x1]
+        if img_array.shape[2] == 4:
+            out[j, i] = colors.get_cell_color_skip_quantization(cell)
+        elif original_alpha is not None:
+            cell_alpha = original_alpha[y0:y1, x0:x1]
+            out[j, i] = colors.get_cell_color_with_alpha(cell, cell_alpha)
+        else:
+            out[j, i] = colors.get_opaque_cell_color(cell)
+    return out
+
+
+def test_downsample_matches_per_cell_selection() -> None:
+    """The vectorized downsample gives the same result as selecting each cell's color."""
+    rng = np.random.default_rng(0)
+    img_array = rng.integers(0, 256, size=(60, 80, 4), dtype=np.uint8)
+    # Include an empty column and an empty row of cells
+    mesh_lines = ([0, 7, 7, 20, 33, 50, 79], [1, 9, 18, 18, 40, 59])
+
+    result = pixelate.downsample(
+        Image.fromarray(img_array, mode="RGBA"), mesh_lines, skip_quantization=True
+    )
+    expected = _downsample_per_cell(img_array, mesh_lines)
+    np.testing.assert_array_equal(np.array(result), expected)
+
+    rgb_array = img_array[:, :, :3]
+    alpha = img_array[:, :, 3]
+    rgb_img = Image.fromarray(rgb_array, mode="RGB")
+    result = pixelate.downsample(rgb_img, mesh_lines, original_alpha=alpha)
+    expected = _downsample_per_cell(rgb_array, mesh_lines, original_alpha=alpha)
+    np.testing.assert_array_equal(np.array(result), expected)
+
+    result = pixelate.downsample(rgb_img, mesh_lines)
+    expected = _downsample_per_cell(rgb_array, mesh_lines)
+    np.testing.assert_array_equal(np.array(result), expected)
+
+
+def test_downsample_with_mesh_scale_matches_upscaled_image() -> None:
+    """Downsampling the original with a scaled mesh matches downsampling the upscaled image."""
+    rng = np.random.default_rng(1)
+    img_array = rng.integers(0, 256, size=(40, 50, 4), dtype=np.uint8)
+    img = Image.fromarray(img_array, mode="RGBA")
+    for mesh_scale in (2, 3):
+        width, height = 50 * mesh_scale, 40 * mesh_scale
+        # Lines on and between original pixel borders, including a cell within one pixel
+        lines_x = sorted({0, 1, 5, 6, 17, 31, 44, width - 9, width - 1, width})
+        lines_y = sorted({0, 2, 3, 12, 25, 26, 40, height - 1})
+        mesh_lines = (lines_x, lines_y)
+
+        scaled_img = utils.scale_img(img, mesh_scale)
+        expected = pixelate.downsample(scaled_img, mesh_lines, skip_quantization=True)
+        result = pixelate.downsample(
+            img, mesh_lines, skip_quantization=True, mesh_scale=mesh_scale
+        )
+        np.testing.assert_array_equal(np.array(result), np.array(expected))
+
+        alpha = img_array[:, :, 3]
+        scaled_alpha = colors.extract_and_scale_alpha(img, mesh_scale)
+        expected = pixelate.downsample(
+            scaled_img.convert("RGB"), mesh_lines, original_alpha=scaled_alpha
+        )
+        result = pixelate.downsample(
+            img.convert("RGB"),
+            mesh_lines,
+            original_alpha=alpha,
+            mesh_scale=mesh_scale,
+        )
+        np.testing.assert_array_equal(np.array(result), np.array(expected))
+
+
+def test_pixelate_with_known_grid(pixel_art) -> None:
+    """A known grid with an offset gives back the cells without detecting the mesh."""
+    image = pixel_art(0, cells=12, cell_size=10)
+    small = np.array(image)[::10, ::10]
+    # Partial cells of 4 pixels are dropped, those of 7 pixels are kept
+    cropped = image.crop((6, 3, image.width, image.height))
+
+    result = pixelate.pixelate(cropped, grid=mesh.GridSpec(10, 10, 4, 7))
+
+    np.testing.assert_array_equal(np.array(result), small[:, 1:])
+
+
+def test_downsample_cell_color_matches_upscaled_image() -> None:
+    """The robust statistics of a scaled mesh are those of the upscaled image."""
+    rng = np.random.default_rng(2)
+    img_array = rng.integers(0, 256, size=(40, 50, 4), dtype=np.uint8)
+    img_array[:, :, :3] //= 64
+    img = Image.fromarray(img_array, mode="RGBA")
+    mesh_lines = ([0, 1, 5, 6, 17, 31, 44, 91, 99, 100], [0, 2, 3, 12, 25, 26, 40, 80])
+    scaled_img = utils.scale_img(img, 2)
+    for cell_color in colors.CELL_COLORS:
+        expected = pixelate.downsample(
+            scaled_img, mesh_lines, skip_quantization=True, cell_color=cell_color
+        )
+        result = pixelate.downsample(
+            img, mesh_lines, skip_quantization=True, mesh_scale=2, cell_color=cell_color
+        )
+        np.testing.assert_array_equal(np.array(result), np.array(expected))
+
+
+def test_downsample_cell_color_ignores_transparent_pixels() -> None:
+    """Robust statistics with original_alpha leave the transparent pixels out."""
+    rng = np.random.default_rng(3)
+    img_array = rng.integers(0, 256, size=(40, 50, 4), dtype=np.uint8)
+    img_array[:, :, :3] //= 64
+    img_array[:, :, 3] = np.where(img_array[:, :, 3] < 96, 0, 255)
+    rgb_img = Image.fromarray(img_array[:, :, :3], mode="RGB")
+    mesh_lines = ([0, 3, 9, 20, 33, 50], [0, 4, 15, 28, 40])
+    for cell_color in set(colors.CELL_COLORS) - {"mean"}:
+        result = pixelate.downsample(
+            rgb_img,
+            mesh_lines,
+            skip_quantization=False,
+            original_alpha=img_array[:, :, 3],
+            cell_color=cell_color,
+        )
+        expected = pixelate.downsample(
+            Image.fromarray(img_array, mode="RGBA"),
+            mesh_lines,
+            skip_quantization=True,
+            cell_color=cell_color,
+        )
+        np.testing.assert_array_equal(np.array(result), np.array(expected))
+
+
+def test_pixelate_exact_upscale_skips_mesh_detection(pixel_art) -> None:
+    """A clean upscale gives back its cells without detecting the mesh."""
+    image = pixel_art(0, cells=12, cell_size=10)
+    with profiling.Tracer(memory=False) as tracer:
+        result = pixelate.pixelate(image)
+    np.testing.assert_array_equal(np.array(result), np.array(image)[::10, ::10])
+    stages = {record.stage for record in tracer.records}
+    assert "detect_exact_upscale" in stages
+    assert "compute_mesh_with_scaling" not in stages
+
+
+def test_pixelate_array_matches_pixelate(assets: Path) -> None:
+    """A read-only array gives the pixels of pixelate and is left unchanged."""
+    image = Image.open(assets / "anchor" / "anchor.png").convert("RGBA")
+    array = np.array(image)
+    array.flags.writeable = False
+    before = array.copy()
+
+    result = pixelate.pixelate_array(array, num_colors=16, transparent_background=True)
+
+    expected = pixelate.pixelate(image, num_colors=16, transparent_background=True)
+    np.testing.assert_array_equal(result, np.array(expected))
+    np.testing.assert_array_equal(array, before)
+    # memoryviews, e.g. of shared memory, and RGB arrays work the same way
+    from_view = pixelate.pixelate_array(memoryview(np.ascontiguousarray(array)))
+    from_rgb = pixelate.pixelate_array(array[:, :, :3])
+    np.testing.assert_array_equal(from_view, np.array(pixelate.pixelate(image)))
+    np.testing.assert_array_equal(
+        from_rgb, np.array(pixelate.pixelate(image.convert("RGB")))
+    )
+
+
+def test_pixelate_array_peak_memory(pixel_art) -> None:
+    """Keying out the background of a frame on a known grid stays within two frames."""
+    image = pixel_art(0, cells=64, cell_size=16)
+    rng = np.random.default_rng(3)
+    array = np.array(image)
+    # Noise makes every cell a mix of colors, so all of its pixels are averaged
+    array[:, :, :3] ^= rng.integers(0, 4, size=array.shape[:2] + (3,), dtype=np.uint8)
+
+    tracemalloc.start()
+    try:
+        result = pixelate.pixelate_array(
+            array, transparent_background=True, grid=mesh.GridSpec(16, 16)
+        )
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert result.shape == (64, 64, 4)
+    assert peak < 2 * array.nbytes
+
+
+# Result sizes and clamp_alpha backgrounds of the assets with 16 colors,
+# as the baseline before any optimization computed them
+BASELINE_ASSET_OUTPUTS = {
+    ("anchor", False): ((32, 32), (255, 255, 255)),
+    ("anchor", True): ((32, 32), (255, 255, 255)),
+    ("ash", False): ((51, 58), (0, 0, 255)),
+    ("ash", True): ((51, 58), (255, 0, 255)),
+    ("bat", False): ((27, 28), (255, 255, 255)),
+    ("bat", True): ((27, 28), (255, 255, 255)),
+    ("blob", False): ((30, 29), (255, 0, 255)),
+    ("blob", True): ((30, 29), (255, 0, 255)),
+    ("demon", False): ((62, 61), (255, 255, 255)),
+    ("demon", True): ((62, 61), (255, 255, 255)),
+    ("mountain", False): ((118, 77), (255, 255, 0)),
+    ("mountain", True): ((113, 79), (255, 255, 0)),
+    ("pumpkin", False): ((53, 58), (255, 0, 255)),
+    ("pumpkin", True): ((38, 41), (0, 255, 255)),
+}
+
+
+@pytest.mark.parametrize(("name", "transparent_background"), BASELINE_ASSET_OUTPUTS)
+def test_asset_outputs_match_baseline(
+    assets: Path, name: str, transparent_background: bool
+) -> None:
+    """The assets keep the result sizes and mesh backgrounds of the baseline."""
+    size, background = BASELINE_ASSET_OUTPUTS[name, transparent_background]
+    image = Image.open(assets / name / f"{name}.png")
+
+    preprocessed = np.asarray(
+        pixelate.preprocess(image, transparent_background=transparent_background)
+    )
+    common = colors._top_opaque_colors_array(
+        preprocessed[2:-2, 2:-2], colors.ALPHA_THRESHOLD
+    )
+    assert colors._pick_background(common) == background
+
+    result = pixelate.pixelate(
+        image, num_colors=16, transparent_background=transparent_background
+    )
+    assert result.size == size
@@ -0,0 +1,53 @@
+"""Tests for the profiling module."""
+
+import io
+import json
+
+from PIL import Image
+
+from proper_pixel_art import batch, pixelate, profiling
+
+
+def test_tracer_records_nested_stages(pixel_art) -> None:
+    with profiling.Tracer(source="test") as tracer:
+        pixelate.pixelate(pixel_art(0), num_colors=8, exact_upscale=False)
+    assert profiling.active_tracer() is None
+
+    records = {record.stage: record for record in tracer.records}
+    assert tracer.records[0].stage == "pixelate"
+    assert records["canny"].parent == "compute_mesh"
+    assert records["downsample"].info["input_size"] == [120, 120, 4]
+    assert records["pixelate"].info["output_size"] == [12, 12, 4]
+    assert records["compute_mesh_with_scaling"].info["upscale_fallback"] is False
+    for record in tracer.records:
+        assert record.wall_s >= 0 and record.cpu_s >= 0
+        assert record.peak_bytes >= 0
+    # A stage allocates at least as much as any stage inside it
+    assert records["compute_mesh"].peak_bytes >= records["canny"].peak_bytes
+
+    output = io.StringIO()
+    tracer.write_jsonl(output)
+    rows = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert len(rows) == len(tracer.records)
+    assert rows[0]["source"] == "test"
+
+
+def test_records_upscale_fallback() -> None:
+    """A flat image has no mesh in the upscaled image, so the fallback runs."""
+    with profiling.Tracer(memory=False) as tracer:
+        pixelate.pixelate(Image.new("RGBA", (64, 64), (200, 10, 10, 255)))
+    (record,) = [r for r in tracer.records if r.stage == "compute_mesh_with_scaling"]
+    assert record.info["upscale_fallback"] is True
+    assert record.peak_bytes is None
+
+
+def test_pixelate_many_traces(pixel_art) -> None:
+    images = [pixel_art(seed) for seed in range(2)]
+    results = list(batch.pixelate_many(images, workers=2, profile=True))
+    for result in results:
+        assert result.ok
+        assert result.trace[0]["stage"] == "pixelate"
+        assert result.trace[0]["peak_bytes"] > 0
+
+    (result,) = batch.pixelate_many(images[:1], workers=1)
+    assert result.trace is None
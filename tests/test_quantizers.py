@@ -0,0 +1,141 @@
+"""Tests for the quantizers module."""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from proper_pixel_art import cli, pixelate, profiling, quantizers
+from proper_pixel_art.session import PixelationSession
+
+
+def test_oklab_round_trip() -> None:
+    """Every sRGB color survives the conversion to Oklab and back."""
+    values = np.arange(0, 256, 5, dtype=np.uint8)
+    rgb = np.stack(np.meshgrid(values, values, values), axis=-1).reshape(-1, 3)
+    np.testing.assert_array_equal(
+        quantizers.oklab_to_srgb(quantizers.srgb_to_oklab(rgb)), rgb
+    )
+
+
+@pytest.mark.parametrize("method", ["median_cut", "kmeans"])
+def test_fit_colors(method: str) -> None:
+    """At most num_colors colors, most used first, and few colors are kept exactly."""
+    rng = np.random.default_rng(0)
+    rgb = rng.integers(0, 256, (2000, 3), dtype=np.uint8)
+    palette, indices = quantizers.fit_colors(rgb, 16, method)
+    assert len(palette) <= 16
+    counts = np.bincount(indices, minlength=len(palette))
+    assert (np.diff(counts) <= 0).all()
+
+    few = rgb[[0, 1, 2, 1, 1]]
+    palette, indices = quantizers.fit_colors(few, 16, method)
+    np.testing.assert_array_equal(palette[indices], few)
+    np.testing.assert_array_equal(palette[0], rgb[1])
+
+
+def test_kmeans_refines_median_cut() -> None:
+    """k-means from the median cut boxes never has a larger error than median cut."""
+    rng = np.random.default_rng(1)
+    rgb = rng.integers(0, 256, (5000, 3), dtype=np.uint8)
+    lab = quantizers.srgb_to_oklab(rgb)
+    errors = {}
+    for method in ("median_cut", "kmeans"):
+        palette, indices = quantizers.fit_colors(rgb, 8, method)
+        errors[method] = np.linalg.norm(
+            quantizers.srgb_to_oklab(palette)[indices] - lab, axis=1
+        ).mean()
+    assert errors["kmeans"] <= errors["median_cut"]
+
+
+def test_quantize_array_ignores_transparent_pixels() -> None:
+    """Transparent pixels are neither counted nor changed."""
+    rgba = np.zeros((4, 8, 4), dtype=np.uint8)
+    rgba[:, :4] = (200, 20, 20, 255)
+    rgba[:, 4:6] = (20, 20, 200, 255)
+    rgba[:, 6:] = (20, 200, 20, 0)
+    result = quantizers.quantize_array(rgba, 2)
+    np.testing.assert_array_equal(result, rgba)
+
+    result = quantizers.quantize_array(rgba, 1)
+    np.testing.assert_array_equal(result[:, 6:], rgba[:, 6:])
+    assert len(np.unique(result[:, :6].reshape(-1, 4), axis=0)) == 1
+
+
+@pytest.mark.parametrize("method", ["median_cut", "kmeans"])
+def test_pixelate_quantize_method(assets: Path, method: str) -> None:
+    """pixelate quantizes with the numpy methods, keeping the alpha of the result."""
+    image = Image.open(assets / "bat" / "bat.png")
+    unquantized = np.array(pixelate.pixelate(image, mesh_method="spectral"))
+    result = np.array(
+        pixelate.pixelate(
+            image, num_colors=8, mesh_method="spectral", quantize_method=method
+        )
+    )
+    np.testing.assert_array_equal(result[:, :, 3], unquantized[:, :, 3])
+    opaque = result[:, :, 3] >= 128
+    assert len(np.unique(result[opaque][:, :3], axis=0)) <= 8
+
+
+@pytest.mark.parametrize("num_colors", [3, 5, 8])
+def test_palette_sweep(num_colors: int) -> None:
+    """Every k reads a k color image from one split, and noisy colors are recovered."""
+    rng = np.random.default_rng(num_colors)
+    base = np.array(
+        [
+            (20, 20, 30),
+            (230, 220, 200),
+            (200, 40, 40),
+            (40, 160, 60),
+            (60, 80, 200),
+            (240, 200, 40),
+            (120, 60, 140),
+            (90, 200, 220),
+        ]
+    )
+    rgb = base[rng.integers(0, num_colors, (32, 32))]
+    rgb += rng.integers(-8, 9, (32, 32, 3))
+    rgba = np.full((32, 32, 4), 255, dtype=np.uint8)
+    rgba[:, :, :3] = np.clip(rgb, 0, 255)
+    rgba[:4, :, 3] = 0
+    sweep = quantizers.PaletteSweep(Image.fromarray(rgba))
+
+    assert sweep.max_colors == quantizers.AUTO_MAX_COLORS
+    assert (np.diff(sweep.errors) <= 1e-12).all()
+    assert sweep.best_num_colors() == num_colors
+    for k in (1, 3, 8):
+        result = np.array(sweep.image(k))
+        np.testing.assert_array_equal(result[:4], rgba[:4])
+        assert len(np.unique(result[4:].reshape(-1, 4), axis=0)) <= k
+        assert len(sweep.palette(k)) == k
+
+
+def test_auto_colors(assets: Path, tmp_path: Path, capsys) -> None:
+    """
+    num_colors 'auto' quantizes to the count the sweep picks, also from the CLI.
+    The numpy methods return the image of the sweep without clustering again.
+    """
+    image = Image.open(assets / "bat" / "bat.png")
+    params = {"mesh_method": "spectral", "quantize_method": "median_cut"}
+    session = PixelationSession(image, num_colors="auto", **params)
+    sweep = quantizers.PaletteSweep(session.downsampled)
+    best = session.num_colors
+    assert best == sweep.best_num_colors()
+    with profiling.Tracer(memory=False) as tracer:
+        result = session.result
+    assert "fit_colors" not in [record.stage for record in tracer.records]
+    expected = np.array(sweep.image(best))
+    np.testing.assert_array_equal(np.array(result), expected)
+
+    session.update(quantize_method="maxcoverage")
+    maxcoverage = pixelate.pixelate(
+        image, num_colors=best, mesh_method="spectral", quantize_method="maxcoverage"
+    )
+    np.testing.assert_array_equal(np.array(session.result), np.array(maxcoverage))
+
+    out_path = tmp_path / "bat.png"
+    argv = [str(assets / "bat" / "bat.png"), "-o", str(out_path), "-c", "auto"]
+    cli.main([*argv, "--mesh-method", "spectral", "--quantize-method", "median_cut"])
+    assert f"{best} màu" in capsys.readouterr().err
+    np.testing.assert_array_equal(np.array(Image.open(out_path)), expected)
@@ -0,0 +1,159 @@
+"""Tests for the server and client modules."""
+
+import io
+import json
+import os
+import shutil
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from proper_pixel_art import cli, client, pixelate
+from proper_pixel_art.server import (
+    PixelationService,
+    ServerBusy,
+    create_server,
+    plan_run,
+)
+
+
+@pytest.fixture(name="serve")
+def fixture_serve(tmp_path: Path) -> Iterator:
+    """Start a server with a thread pool at an address, returning the address."""
+    servers = []
+
+    def serve(address: str, **limits) -> str:
+        service = PixelationService(workers=2, executor="thread", **limits)
+        httpd = create_server(address, service)
+        servers.append((httpd, service))
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        if not address.startswith("unix:"):
+            address = f"127.0.0.1:{httpd.server_address[1]}"
+        return address
+
+    yield serve
+    for httpd, service in servers:
+        httpd.shutdown()
+        httpd.server_close()
+        service.shutdown()
+
+
+def test_pixelate_endpoint(assets: Path, serve) -> None:
+    """Images sent over HTTP come back pixelated, and bad requests get a 400."""
+    address = serve("127.0.0.1:0")
+    assert client.health(address)["status"] == "ok"
+
+    path = assets / "bat" / "bat.png"
+    params = {"num_colors": 8, "mesh_method": "spectral", "grid": None}
+    png = client.pixelate_bytes(path.read_bytes(), params, address=address)
+    expected = pixelate.pixelate(Image.open(path), **params)
+    np.testing.assert_array_equal(
+        np.array(Image.open(io.BytesIO(png))), np.array(expected)
+    )
+
+    with pytest.raises(RuntimeError, match="400"):
+        client.pixelate_bytes(path.read_bytes(), {"colors": 8}, address=address)
+    with pytest.raises(RuntimeError, match="400"):
+        client.pixelate_bytes(b"not an image", {}, address=address)
+    stats = client.stats(address)
+    assert stats["completed"] == 1
+    assert stats["inflight"] == 0
+
+
+def test_run_and_fallback(
+    assets: Path, tmp_path: Path, serve, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """The client runs single images on the server and falls back for the rest."""
+    address = serve(f"unix:{tmp_path / 'ppa.sock'}")
+    monkeypatch.chdir(tmp_path)
+    source = assets / "anchor" / "anchor.png"
+    argv = [str(source), "-o", "served", "-c", "8", "--mesh-method", "spectral"]
+    assert client.run(argv, address=address) == 0
+
+    cli.main([*argv[:2], "local", *argv[3:]])
+    served = Image.open(tmp_path / "served" / "anchor_pixelated.png")
+    local = Image.open(tmp_path / "local" / "anchor_pixelated.png")
+    np.testing.assert_array_equal(np.array(served), np.array(local))
+
+    assert client.run([str(source), str(source)], address=address) is None
+    assert client.run(["--no-such-flag"], address=address) is None
+    assert client.run(argv, address=f"unix:{tmp_path / 'missing.sock'}") is None
+
+
+def test_backpressure_and_timeout() -> None:
+    """Jobs beyond max_inflight and max_queued are refused, slow ones time out."""
+    release = threading.Event()
+    service = PixelationService(
+        workers=1, max_inflight=1, max_queued=0, timeout=0.2, executor="thread"
+    )
+    try:
+        with pytest.raises(TimeoutError):
+            service.run(release.wait)
+        # The timed out job still holds the only slot until it finishes
+        with pytest.raises(ServerBusy):
+            service.run(sum, [1, 2])
+        release.set()
+        for _ in range(50):
+            if service.stats()["inflight"] == 0:
+                break
+            threading.Event().wait(0.01)
+        assert service.run(sum, [1, 2]) == 3
+        stats = service.stats()
+        assert (stats["rejected"], stats["timed_out"], stats["completed"]) == (1, 1, 1)
+    finally:
+        release.set()
+        service.shutdown()
+
+
+def test_refuses_requests_from_web_pages(tmp_path: Path, serve) -> None:
+    """
+    /run is only served over the Unix socket, as JSON, and requests a web page
+    could send, with an Origin or to a rebound host name, are refused.
+    """
+    tcp = serve("127.0.0.1:0")
+    unix = serve(f"unix:{tmp_path / 'ppa.sock'}")
+    run = json.dumps({"argv": ["x.png"], "cwd": str(tmp_path)}).encode()
+    as_json = {"Content-Type": "application/json"}
+
+    assert client.request("POST", "/run", run, as_json, address=tcp)[0] == 403
+    assert client.request("POST", "/run", run, address=unix)[0] == 415
+    assert client.request("POST", "/run", run, as_json, address=unix)[0] == 422
+    evil = {"Origin": "https://evil.example", "X-PPA-Params": "{}"}
+    assert client.request("POST", "/pixelate", b"", evil, address=tcp)[0] == 403
+    rebound = {"Host": "evil.example:80"}
+    assert client.request("GET", "/health", headers=rebound, address=tcp)[0] == 403
+    assert client.request("POST", "/pixelate", b"", address=tcp)[0] == 400
+    assert (
+        client.request("GET", "/health", address=f"localhost:{tcp.split(':')[1]}")[0]
+        == 200
+    )
+    assert client.run(["x.png"], address=tcp) is None
+
+
+def test_plan_run_resolves_paths_against_cwd(
+    assets: Path, tmp_path: Path, capsys: pytest.CaptureFixture
+) -> None:
+    """Jobs are planned from their own directory without touching the process's."""
+    shutil.copy(assets / "bat" / "bat.png", tmp_path / "bat.png")
+    (tmp_path / "colors.hex").write_text("000000\nffffff\n")
+    before = os.getcwd()
+    input_path, out_path, params = plan_run(
+        ["bat.png", "-o", "out", "--palette", "colors.hex", "--cache-dir", "cache"],
+        str(tmp_path),
+    )
+    assert input_path == tmp_path / "bat.png"
+    assert out_path == tmp_path / "out" / "bat_pixelated.png"
+    assert len(params["palette"]) == 2
+    assert params["cache"].directory == tmp_path / "cache"
+
+    assert plan_run(["bat.png", "--no-such-flag"], str(tmp_path)) is None
+    assert plan_run(["--help"], str(tmp_path)) is None
+    assert plan_run(["missing.png"], str(tmp_path)) is None
+    with pytest.raises(ValueError):
+        plan_run(["bat.png"], "relative")
+    assert os.getcwd() == before
+    assert capsys.readouterr() == ("", "")
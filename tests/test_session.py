@@ -0,0 +1,52 @@
+"""Tests for the session module."""
+
+import numpy as np
+import pytest
+
+from proper_pixel_art import pixelate
+from proper_pixel_art.session import PixelationSession
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {},
+        {"num_colors": 8, "trim": True, "scale_result": 3},
+        {"mesh_method": "spectral", "transparent_background": True},
+    ],
+)
+def test_result_matches_pixelate(params: dict, pixel_art) -> None:
+    image = pixel_art(0)
+    session = PixelationSession(image, **params)
+    expected = pixelate.pixelate(image, **params)
+    np.testing.assert_array_equal(np.array(session.result), np.array(expected))
+
+
+def test_update_invalidates_dependent_stages(pixel_art) -> None:
+    image = pixel_art(0)
+    session = PixelationSession(image, num_colors=8)
+    first = session.result
+    mesh, downsampled = session.mesh, session.downsampled
+    assert len(session.palette) <= 8
+
+    session.update(num_colors=4, scale_result=2)
+    assert session.computed == ("preprocessed", "mesh", "downsampled")
+    expected = pixelate.pixelate(image, num_colors=4, scale_result=2)
+    np.testing.assert_array_equal(np.array(session.result), np.array(expected))
+    assert session.mesh is mesh
+    assert session.downsampled is downsampled
+    assert session.result is not first
+    assert len(session.palette) <= 4
+
+    # Setting a parameter to its current value keeps everything
+    session.update(num_colors=4)
+    assert "result" in session.computed
+
+    session.update(mesh_method="spectral")
+    assert session.computed == ("preprocessed",)
+
+    session.update(image=pixel_art(1))
+    assert session.computed == ()
+
+    with pytest.raises(TypeError):
+        session.update(colors=4)
@@ -0,0 +1,80 @@
+"""Tests for the spritesheet module."""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from proper_pixel_art import cli, spritesheet
+
+# Left, top and cells wide and high of each sprite, with 10 pixel cells
+SPRITES = [(20, 30, 8, 6), (250, 40, 12, 10), (60, 220, 6, 9), (330, 230, 10, 10)]
+
+
+@pytest.fixture(name="sheet")
+def fixture_sheet() -> tuple[Image.Image, list[np.ndarray]]:
+    """Upscaled random sprites on a transparent sheet, with the sprites themselves."""
+    rng = np.random.default_rng(0)
+    sheet = np.zeros((400, 600, 4), dtype=np.uint8)
+    sprites = []
+    for left, top, width, height in SPRITES:
+        sprite = rng.integers(0, 256, size=(height, width, 4), dtype=np.uint8)
+        sprite[:, :, 3] = 255
+        sprites.append(sprite)
+        sheet[top : top + 10 * height, left : left + 10 * width] = sprite.repeat(
+            10, axis=0
+        ).repeat(10, axis=1)
+    return Image.fromarray(sheet, mode="RGBA"), sprites
+
+
+def test_find_sprites(sheet) -> None:
+    """Each sprite is one tight box, in reading order, and specks are dropped."""
+    image, _ = sheet
+    pixels = np.array(image)
+    pixels[396:398, 596:598] = 255
+    boxes = spritesheet.find_sprites(Image.fromarray(pixels, mode="RGBA"))
+    assert boxes == [
+        (left, top, left + 10 * width, top + 10 * height)
+        for left, top, width, height in SPRITES
+    ]
+
+
+@pytest.mark.parametrize("share_pixel_width", [False, True])
+def test_pixelate_sheet(sheet, share_pixel_width: bool) -> None:
+    """Sprites come back at their true resolution, placed as in the source sheet."""
+    image, sprites = sheet
+    result = spritesheet.pixelate_sheet(
+        image, workers=2, share_pixel_width=share_pixel_width
+    )
+
+    assert result.cell_size == ((10.0, 10.0) if share_pixel_width else None)
+    assert [sprite.ok for sprite in result.sprites] == [True] * len(SPRITES)
+    reassembled = np.array(result.image)
+    for sprite, expected, (left, top, _, _) in zip(result.sprites, sprites, SPRITES):
+        np.testing.assert_array_equal(np.array(sprite.image), expected)
+        assert sprite.offset == (left // 10, top // 10)
+        x, y = sprite.offset
+        height, width = expected.shape[:2]
+        np.testing.assert_array_equal(
+            reassembled[y : y + height, x : x + width], expected
+        )
+
+
+def test_cli_sprite_sheet(sheet, tmp_path: Path) -> None:
+    """The CLI saves the sheet, every sprite, and the manifest of offsets."""
+    image, sprites = sheet
+    image.save(tmp_path / "sheet.png")
+    out_path = tmp_path / "out" / "sheet.png"
+
+    cli.main([str(tmp_path / "sheet.png"), "-o", str(out_path), "--sprite-sheet"])
+
+    manifest = json.loads(out_path.with_suffix(".json").read_text())
+    assert manifest["size"] == list(Image.open(out_path).size)
+    assert [sprite["offset"] for sprite in manifest["sprites"]] == [
+        [left // 10, top // 10] for left, top, _, _ in SPRITES
+    ]
+    for index, expected in enumerate(sprites):
+        saved = Image.open(tmp_path / "out" / "sheet_sprites" / f"{index:03d}.png")
+        np.testing.assert_array_equal(np.array(saved), expected)
@@ -0,0 +1,74 @@
+"""Tests for the variants module."""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from proper_pixel_art import cli, pixelate, profiling
+from proper_pixel_art.variants import Variant, parse_variants, pixelate_variants
+
+
+def test_parse_variants() -> None:
+    """Scales and colors default to 1 and the given number, duplicates are dropped."""
+    assert parse_variants("1x@16,4x@16,8x@32,4x@16") == (
+        Variant(1, 16),
+        Variant(4, 16),
+        Variant(8, 32),
+    )
+    assert parse_variants("2x,@auto,3x@all", num_colors=8) == (
+        Variant(2, 8),
+        Variant(1, "auto"),
+        Variant(3, None),
+    )
+    assert [variant.name for variant in parse_variants("4x@16,1x@auto,8x@all")] == [
+        "4x_16c",
+        "1x_auto",
+        "8x",
+    ]
+    for spec in ("", "4", "0x@16", "4x@0", "4x@16c"):
+        with pytest.raises(ValueError):
+            parse_variants(spec)
+
+
+def test_pixelate_variants_share_mesh(pixel_art) -> None:
+    """Every variant matches its own pixelate call, and the mesh is detected once."""
+    image = pixel_art(0)
+    variants = parse_variants("1x@8,4x@8,3x@4,2x@all")
+    with profiling.Tracer() as tracer:
+        results = pixelate_variants(image, variants, trim=True)
+    assert list(results) == list(variants)
+    stages = [record.stage for record in tracer.records]
+    assert stages.count("detect_exact_upscale") == 1
+    assert stages.count("downsample") == 1
+    assert stages.count("quantize") == 3
+
+    for variant, result in results.items():
+        expected = pixelate.pixelate(
+            image,
+            num_colors=variant.num_colors,
+            scale_result=variant.scale if variant.scale > 1 else None,
+            trim=True,
+        )
+        np.testing.assert_array_equal(np.array(result), np.array(expected))
+
+    with pytest.raises(TypeError):
+        pixelate_variants(image, variants, num_colors=8)
+
+
+def test_cli_batch_variants(assets: Path, tmp_path: Path) -> None:
+    """A batch with --variants writes every variant of every input."""
+    inputs = [assets / "anchor" / "anchor.png", assets / "ash" / "ash.png"]
+    out_dir = tmp_path / "out"
+    argv = [*map(str, inputs), "-o", str(out_dir), "-j", "1", "-c", "8"]
+    argv += ["--mesh-method", "spectral", "--variants", "1x,3x@4"]
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main(argv)
+    assert exit_info.value.code == 0
+
+    for path in inputs:
+        small = Image.open(out_dir / f"{path.stem}_pixelated_1x_8c.png")
+        large = Image.open(out_dir / f"{path.stem}_pixelated_3x_4c.png")
+        assert large.size == (3 * small.width, 3 * small.height)
+        assert len(large.convert("RGB").getcolors()) <= 4
@@ -0,0 +1,94 @@
+"""Tests for the web module."""
+
+import gc
+import weakref
+
+import numpy as np
+import pytest
+
+from proper_pixel_art import pixelate, web
+
+
+def test_process_reuses_upstream_stages(pixel_art) -> None:
+    """Changing the scale of the same upload only reruns the last stage."""
+    image = pixel_art(0)
+    state = {}
+    web.process(
+        image, 8, False, 1, 2, 0, False, False, "hough", "", "mean", "global", state
+    )
+    session = state["session"]
+    mesh = session.mesh
+
+    # Gradio hands over a new image object with the same pixels
+    scaled = web.process(
+        image.copy(),
+        8,
+        False,
+        4,
+        2,
+        0,
+        False,
+        True,
+        "hough",
+        "",
+        "mean",
+        "global",
+        state,
+    )
+    assert state["session"] is session
+    assert session.mesh is mesh
+    expected = pixelate.pixelate(image, num_colors=8, scale_result=4, trim=True)
+    np.testing.assert_array_equal(np.array(scaled), np.array(expected))
+
+    web.process(
+        pixel_art(1),
+        8,
+        False,
+        4,
+        2,
+        0,
+        False,
+        True,
+        "hough",
+        "",
+        "mean",
+        "global",
+        state,
+    )
+    assert state["session"] is not session
+
+
+def test_state_holds_one_session(pixel_art) -> None:
+    """Memory stays bounded: a new upload releases the stages of the previous one."""
+    state = {}
+    args = (8, False, 1, 2, 0, False, False, "spectral", "", "mean", "global", state)
+    web.process(pixel_art(0), *args)
+    first = weakref.ref(state["session"])
+    for seed in range(1, 4):
+        web.process(pixel_art(seed), *args)
+    gc.collect()
+    assert first() is None
+    assert set(state) == {"digest", "session"}
+
+
+def test_previews_match_conversion(pixel_art) -> None:
+    """Each preview is the image converting with its number of colors gives."""
+    image = pixel_art(0)
+    state = {}
+    args = (False, 1, 2, 0, False, False, "spectral", "", "mean", "global", state)
+    web.process(image, 16, *args)
+    previews = web.preview_colors(state)
+    assert any(label.endswith("(tự chọn)") for _, label in previews)
+    for preview, label in previews:
+        num_colors = -1 if label.endswith("(tự chọn)") else int(label.split()[0])
+        converted = web.process(image, num_colors, *args)
+        np.testing.assert_array_equal(np.array(preview), np.array(converted))
+
+
+def test_process_reports_malformed_grid(pixel_art) -> None:
+    """A malformed grid is shown as a message in the UI, not a generic error."""
+    gr = pytest.importorskip("gradio")
+    args = (8, False, 1, 2, 0, False, False, "hough")
+    for grid in ("16by16", "0x16"):
+        with pytest.raises(gr.Error, match="Lưới"):
+            web.process(pixel_art(0), *args, grid)